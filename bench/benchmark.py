@@ -0,0 +1,326 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Headless benchmarks for the mount lifecycle, tray menu rebuilds and the
+# config window. Runs TrayIcon and ConfigWindow on Qt's offscreen platform
+# against the fake rclone / umount / systemd-inhibit in bench/fakebin.
+#
+#   python compile.py
+#   python bench/benchmark.py -o before.json
+#   ... make changes ...
+#   python bench/benchmark.py -o after.json --compare before.json
+#
+# The fake rclone mounts a tmpfs. When not run as root the benchmark re-runs
+# itself in a user + mount namespace (unshare) so it can do that.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(script_dir, "..", "src")
+fakebin_dir = os.path.join(script_dir, "fakebin")
+
+
+def stats(values: List[float]) -> Dict:
+    if len(values) == 0:
+        return {"count": 0}
+    values = sorted(values)
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": pct(50),
+        "p95": pct(95),
+        "max": values[-1],
+    }
+
+
+def make_config(count: int, mount_dir: str, backend: str):
+    from config import Config, RemoteConfig
+    config = Config(settings={"backend": backend, "log_dir": os.path.join(mount_dir, "logs")})
+    for i in range(count):
+        config.add(RemoteConfig("remote{}".format(i), os.path.join(mount_dir, "remote{}".format(i)),
+                                "--dir-cache-time 1m0s\n--vfs-cache-mode full"))
+    return config
+
+
+def make_rclone_config(count: int, path: str):
+    # The remotes have to exist or mounting them is refused (see remotes.py)
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write("[remote{}]\ntype = memory\n\n".format(i))
+
+
+class EventRecorder:
+    # Records engine events with timestamps. Called on engine worker threads.
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.start: Dict[str, float] = {}
+        self.latency: Dict[str, List[float]] = {}
+        self.done = threading.Condition(self.lock)
+        self.pending = 0
+
+    def expect(self, names: List[str]):
+        with self.lock:
+            now = time.perf_counter()
+            for name in names:
+                self.start[name] = now
+            self.pending = len(names)
+
+    def __call__(self, event: str, name: str, detail: str):
+        if event not in ("mounted", "mount_failed", "unmounted", "unmount_failed"):
+            return
+        with self.lock:
+            if name in self.start:
+                self.latency.setdefault(event, []).append(time.perf_counter() - self.start.pop(name))
+                self.pending -= 1
+                self.done.notify_all()
+
+    def wait(self, app, timeout: float):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            with self.lock:
+                if self.pending <= 0:
+                    break
+                self.done.wait(0.01)
+            app.processEvents()
+        app.processEvents()
+
+    def take(self) -> Dict[str, List[float]]:
+        with self.lock:
+            latency = self.latency
+            self.latency = {}
+            self.start = {}
+            return latency
+
+
+def timed(fn, repeat: int) -> List[float]:
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(args) -> Dict:
+    sys.path.insert(0, src_dir)
+    try:
+        from PySide6.QtWidgets import QApplication
+        from PySide6.QtCore import QStandardPaths
+    except:
+        from PySide2.QtWidgets import QApplication
+        from PySide2.QtCore import QStandardPaths
+    try:
+        import trayicon
+        from configwindow import ConfigWindow
+    except ImportError as e:
+        print("Failed to import the app ({}). Run compile.py first.".format(e))
+        sys.exit(1)
+
+    QStandardPaths.setTestModeEnabled(True)
+    app = QApplication.instance() or QApplication([])
+    app.setApplicationName("rclone-drive-manager-bench")
+
+    # Dialogs would block headless runs. Count them instead.
+    warnings = []
+    trayicon.show_warning = lambda text, detail: warnings.append(text)
+
+    results = {}
+    for count in args.sizes:
+        print("[{} remotes]".format(count))
+        mount_dir = tempfile.mkdtemp(prefix="rdm-bench-")
+        data = make_config(count, mount_dir, args.backend)
+        make_rclone_config(count, os.path.join(mount_dir, "rclone.conf"))
+        os.environ["RCLONE_CONFIG"] = os.path.join(mount_dir, "rclone.conf")
+        win = ConfigWindow()
+        tray = trayicon.TrayIcon(win)
+        recorder = EventRecorder()
+        tray.engine.add_listener(recorder)
+        tray.engine.set_max_parallel(args.max_parallel)
+        res = {}
+
+        res["update_menu"] = stats(timed(lambda: tray.update_menu(data), args.repeat))
+
+        def show_window():
+            win.show(data)
+            app.processEvents()
+            win.hide()
+        res["config_window_show"] = stats(timed(show_window, args.repeat))
+
+        if count <= args.max_mounts:
+            tray.update_menu(data)
+            names = data.names()
+
+            recorder.expect(names)
+            start = time.perf_counter()
+            tray.mount_all()
+            recorder.wait(app, args.timeout)
+            res["mount_all_total"] = time.perf_counter() - start
+            latency = recorder.take()
+            res["mount"] = stats(latency.get("mounted", []))
+            res["mount_failed"] = len(latency.get("mount_failed", []))
+
+            mounted = list(tray.engine.mounted)
+            recorder.expect(mounted)
+            start = time.perf_counter()
+            tray.unmount_all()
+            recorder.wait(app, args.timeout)
+            res["unmount_all_total"] = time.perf_counter() - start
+            latency = recorder.take()
+            res["unmount"] = stats(latency.get("unmounted", []))
+            res["unmount_failed"] = len(latency.get("unmount_failed", []))
+
+            # Shutdown: same engine path exit_app() uses after its prompt
+            tray.mount_all()
+            tray.engine.wait_idle(args.timeout)
+            app.processEvents()
+            start = time.perf_counter()
+            failed = tray.engine.unmount_all(args.shutdown_timeout)
+            if len(failed) != 0:
+                tray.engine.unmount_all(args.shutdown_timeout, True)
+            res["shutdown"] = time.perf_counter() - start
+            res["shutdown_forced"] = len(failed)
+            recorder.take()
+
+        tray.engine.shutdown()
+        app.processEvents()
+        tray.hide()
+        win.deleteLater()
+        tray.deleteLater()
+        app.processEvents()
+        shutil.rmtree(mount_dir, ignore_errors=True)
+        results[str(count)] = res
+        print(json.dumps(res, indent=2))
+
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {
+            "backend": args.backend,
+            "max_parallel": args.max_parallel,
+            "repeat": args.repeat,
+            "rclone_delay": args.rclone_delay,
+            "rclone_fail_rate": args.rclone_fail_rate,
+            "umount_delay": args.umount_delay,
+            "umount_fail_rate": args.umount_fail_rate,
+            "inhibit_delay": args.inhibit_delay,
+        },
+        "dialogs": len(warnings),
+        "results": results,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=script_dir,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return ""
+
+
+def flatten(prefix: str, value, out: Dict[str, float]):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            flatten("{}.{}".format(prefix, k) if prefix else k, v, out)
+    elif isinstance(value, (int, float)):
+        out[prefix] = value
+
+
+def compare(old: Dict, new: Dict):
+    old_flat, new_flat = {}, {}
+    flatten("", old["results"], old_flat)
+    flatten("", new["results"], new_flat)
+    print("{:<45} {:>12} {:>12} {:>8}".format("metric", old.get("commit", "old"), new.get("commit", "new"), "ratio"))
+    for key in new_flat:
+        if key not in old_flat or key.endswith(".count"):
+            continue
+        ratio = new_flat[key] / old_flat[key] if old_flat[key] else float("nan")
+        print("{:<45} {:>12.6f} {:>12.6f} {:>8.2f}".format(key, old_flat[key], new_flat[key], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RcloneDriveManager benchmarks")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--max-mounts", type=int, default=1000, help="Skip mount benchmarks above this many remotes")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats for update_menu / config window timings")
+    parser.add_argument("--backend", choices=["process", "rcd"], default="process")
+    parser.add_argument("--max-parallel", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=600.0, help="Max seconds to wait for a batch")
+    parser.add_argument("--shutdown-timeout", type=float, default=5.0)
+    parser.add_argument("--rclone-delay", type=float, default=0.05)
+    parser.add_argument("--rclone-fail-rate", type=float, default=0.0)
+    parser.add_argument("--umount-delay", type=float, default=0.0)
+    parser.add_argument("--umount-fail-rate", type=float, default=0.0)
+    parser.add_argument("--inhibit-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if os.geteuid() != 0 and os.environ.get("RDM_BENCH_NS") != "1":
+        # Mounting tmpfs needs a mount namespace we own
+        env = dict(os.environ, RDM_BENCH_NS="1")
+        cmd = ["unshare", "--user", "--map-root-user", "--mount", sys.executable] + sys.argv
+        sys.exit(subprocess.call(cmd, env=env))
+
+    os.environ["REAL_UMOUNT"] = shutil.which("umount") or "/usr/bin/umount"
+    os.environ["PATH"] = fakebin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    os.environ["FAKE_RCLONE_DELAY"] = str(args.rclone_delay)
+    os.environ["FAKE_RCLONE_FAIL_RATE"] = str(args.rclone_fail_rate)
+    os.environ["FAKE_UMOUNT_DELAY"] = str(args.umount_delay)
+    os.environ["FAKE_UMOUNT_FAIL_RATE"] = str(args.umount_fail_rate)
+    os.environ["FAKE_INHIBIT_DELAY"] = str(args.inhibit_delay)
+
+    out = run(args)
+    with open(args.output, "w") as f:
+        json.dump(out, f, indent=2)
+    print("Results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import select
+import signal
+import subprocess
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from rc import RC_USER, RcClient
+
+
+# Finding rclone mounts that are still running from a previous run of the
+# app (crash, session restart) so they can be supervised again instead of
+# being remounted.
+
+
+class AdoptedProcess:
+    # Popen like handle for an rclone process this app did not start. It is
+    # not our child, so its exit code can't be collected. returncode is -1
+    # once it has exited.
+
+    def __init__(self, pid: int, args: List[str]) -> None:
+        self.pid = pid
+        self.args = args
+        self.returncode: Optional[int] = None
+        self.start_time = start_time(pid)
+        try:
+            self.pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self.pidfd = None
+
+    def alive(self) -> bool:
+        if self.pidfd is not None:
+            return len(select.select([self.pidfd], [], [], 0)[0]) == 0
+        # No pidfd. Make sure the pid was not reused by another process.
+        return self.start_time is not None and start_time(self.pid) == self.start_time
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None and not self.alive():
+            self.returncode = -1
+            if self.pidfd is not None:
+                os.close(self.pidfd)
+                self.pidfd = None
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            if self.pidfd is not None:
+                select.select([self.pidfd], [], [], remaining)
+            else:
+                time.sleep(0.05 if remaining is None else min(remaining, 0.05))
+        return self.returncode
+
+    def send_signal(self, sig: int):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class RunningMount:
+    __slots__ = ("pid", "args", "remote", "mountpoint", "rc")
+
+    def __init__(self, pid: int, args: List[str], remote: str, mountpoint: str, rc: Optional[RcClient]):
+        self.pid = pid
+        self.args = args
+        self.remote = remote  # Remote name (without the ":path")
+        self.mountpoint = mountpoint
+        self.rc = rc
+
+
+def start_time(pid: int) -> Optional[int]:
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            return int(f.read().rpartition(")")[2].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def read_cmdline(pid: int) -> List[str]:
+    try:
+        with open("/proc/{}/cmdline".format(pid), "rb") as f:
+            data = f.read()
+    except OSError:
+        return []
+    return [a.decode("utf-8", "surrogateescape") for a in data.split(b"\0")[:-1]]
+
+
+def read_environ(pid: int) -> Dict[str, str]:
+    # Only readable for our own processes
+    try:
+        with open("/proc/{}/environ".format(pid), "rb") as f:
+            data = f.read()
+    except OSError:
+        return {}
+    env = {}
+    for entry in data.split(b"\0"):
+        key, eq, value = entry.decode("utf-8", "surrogateescape").partition("=")
+        if eq != "":
+            env[key] = value
+    return env
+
+
+def parse_flags(args: List[str]) -> Dict[str, str]:
+    flags = {}
+    for i, arg in enumerate(args):
+        if arg.startswith("--") and "=" in arg:
+            key, _, value = arg.partition("=")
+            flags[key] = value
+        elif arg.startswith("--") and i + 1 < len(args):
+            flags[arg] = args[i + 1]
+    return flags
+
+
+def rc_client(pid: int, flags: Dict[str, str]) -> RcClient:
+    # The password is passed in the environment (older versions of this app used --rc-pass)
+    password = flags.get("--rc-pass")
+    if password is None:
+        password = read_environ(pid).get("RCLONE_RC_PASS", "")
+    return RcClient("http://{}/".format(flags["--rc-addr"]), flags.get("--rc-user", ""), password)
+
+
+def parse_mount(pid: int, args: List[str]) -> Optional[RunningMount]:
+    # Recognizes "rclone mount [flags] remote:path mountpoint", the way this
+    # app starts it (remote and mountpoint last).
+    if len(args) < 4 or os.path.basename(args[0]) != "rclone" or args[1] != "mount":
+        return None
+    remote, mountpoint = args[-2], args[-1]
+    if ":" not in remote or remote.startswith("-") or mountpoint.startswith("-"):
+        return None
+    flags = parse_flags(args[2:-2])
+    rc = None
+    if "--rc" in args and "--rc-addr" in flags:
+        rc = rc_client(pid, flags)
+    cwd = "/proc/{}/cwd".format(pid)
+    try:
+        mountpoint = os.path.join(os.readlink(cwd), mountpoint)
+    except OSError:
+        pass
+    return RunningMount(pid, args, remote.partition(":")[0], os.path.realpath(mountpoint), rc)
+
+
+def own_processes() -> Iterator[Tuple[int, List[str]]]:
+    # pid and command line of this user's other processes
+    uid = os.getuid()
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            if os.stat("/proc/{}".format(entry)).st_uid != uid:
+                continue
+        except OSError:
+            continue
+        yield int(entry), read_cmdline(int(entry))
+
+
+def find_mounts() -> Dict[str, RunningMount]:
+    # Running rclone mount processes of this user by real mountpoint
+    mounts = {}
+    for pid, args in own_processes():
+        mount = parse_mount(pid, args)
+        if mount is not None:
+            mounts[mount.mountpoint] = mount
+    return mounts
+
+
+def find_rcd() -> Optional[Tuple[AdoptedProcess, RcClient]]:
+    # An "rclone rcd" started by this app that is still running (eg after a crash)
+    for pid, args in own_processes():
+        if len(args) < 2 or os.path.basename(args[0]) != "rclone" or args[1] != "rcd":
+            continue
+        flags = parse_flags(args[2:])
+        if flags.get("--rc-user") == RC_USER and "--rc-addr" in flags:
+            return AdoptedProcess(pid, args), rc_client(pid, flags)
+    return None
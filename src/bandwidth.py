@@ -0,0 +1,163 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import datetime
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Optional, Tuple
+
+from config import Config
+from mountengine import MountEngine
+from rc import RcError, parse_size
+
+
+# Shares a global bandwidth budget between the mounted drives and applies it
+# live through each rclone's core/bwlimit rc call. Configured with the top
+# level "bandwidth" setting:
+#   {"limit": "10M:2M", "schedule": [{"start": "08:00", "end": "18:00", "days": ["mon", "tue"], "limit": "1M"}]}
+# Limits are "UP:DOWN" or one rate for both ("off" for no limit). The first
+# schedule entry covering the current time wins, "limit" applies otherwise.
+# Each rclone process gets a share proportional to the bw_weight of the drives
+# it serves. Drives without an rc API (see mount_rc) are not limited, and in
+# rcd mode all drives share one process and so one limit.
+
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+Limit = Tuple[Optional[int], Optional[int]]  # Upload, download bytes / s (None = unlimited)
+
+
+def parse_rate(text: str) -> Optional[int]:
+    text = text.strip()
+    if text in ("", "off"):
+        return None
+    return parse_size(text)
+
+
+def parse_limit(text: str) -> Limit:
+    up, sep, down = str(text).partition(":")
+    return parse_rate(up), parse_rate(down if sep != "" else up)
+
+
+def parse_clock(text: str) -> int:
+    hours, _, minutes = text.partition(":")
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def current_limit(bandwidth: Dict, now: datetime.datetime) -> Limit:
+    minute = now.hour * 60 + now.minute
+    day = DAYS[now.weekday()]
+    for entry in bandwidth.get("schedule", []):
+        days = [d.lower()[:3] for d in entry.get("days", DAYS)]
+        start, end = parse_clock(entry.get("start", "0:00")), parse_clock(entry.get("end", "24:00"))
+        if start <= end:
+            active = day in days and start <= minute < end
+        else:
+            # Past midnight. The day is the one the entry started on.
+            yesterday = DAYS[(now.weekday() - 1) % 7]
+            active = (day in days and minute >= start) or (yesterday in days and minute < end)
+        if active:
+            return parse_limit(entry.get("limit", "off"))
+    return parse_limit(bandwidth.get("limit", "off"))
+
+
+def format_rate(limit: Limit) -> str:
+    if limit == (None, None):
+        return "off"
+    return ":".join("off" if r is None else "{}B".format(max(1, int(r))) for r in limit)
+
+
+class BandwidthScheduler:
+    def __init__(self, engine: MountEngine, get_config: Callable[[], Config]) -> None:
+        self.engine = engine
+        self.get_config = get_config
+        self.cond = threading.Condition()
+        self.applied: Dict[str, str] = {}  # rc url: rate
+        self.thread = threading.Thread(target=self.run, name="bandwidth", daemon=True)
+        self.thread.start()
+        engine.add_listener(self.engine_event)
+
+    def engine_event(self, event: str, name: str, detail: str):
+        if event in ("mounted", "unmounted", "died"):
+            self.wake()
+
+    def wake(self):
+        # Also call after the config changed
+        with self.cond:
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            try:
+                scheduled = self.rebalance()
+            except:
+                traceback.print_exc()
+                scheduled = False
+            with self.cond:
+                if scheduled:
+                    # Schedules have minute resolution
+                    self.cond.wait(60 - time.time() % 60)
+                else:
+                    self.cond.wait()
+
+    def rebalance(self) -> bool:
+        # Returns True if the limits depend on the time of day
+        config = self.get_config()
+        bandwidth = config.setting("bandwidth") or {}
+        with self.engine.lock:
+            mounts = list(self.engine.mounted.values())
+        groups = {}  # rc url: [rc, weight]
+        for mount in mounts:
+            if mount.rc is None:
+                continue
+            remote = config.get(mount.name)
+            weight = max(0.0, float(remote.bw_weight)) if remote is not None else 1.0
+            groups.setdefault(mount.rc.url, [mount.rc, 0.0])[1] += weight
+        if len(bandwidth) == 0 and len(self.applied) == 0:
+            # Not in use. Leave any --bwlimit in mount_args alone.
+            return False
+        up, down = current_limit(bandwidth, datetime.datetime.now())
+        total = sum(weight for rc, weight in groups.values()) or 1.0
+        applied = {}
+        for url, (rc, weight) in groups.items():
+            share = weight / total
+            rate = format_rate((None if up is None else up * share, None if down is None else down * share))
+            if self.applied.get(url) != rate:
+                try:
+                    rc.call("core/bwlimit", timeout=2.0, rate=rate)
+                    print("Bandwidth limit of {} set to {}".format(url, rate))
+                except RcError:
+                    traceback.print_exc()
+                    continue
+            applied[url] = rate
+        self.applied = applied if len(bandwidth) != 0 else {}
+        return len(bandwidth.get("schedule", [])) != 0
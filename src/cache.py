@@ -0,0 +1,329 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+import shutil
+import threading
+import traceback
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from config import Config, RemoteConfig
+from metrics import MetricsCollector, Sample, process_tree
+from mountengine import MountEngine
+from rc import parse_size
+
+
+# Keeps the VFS caches of all remotes within one disk budget (top level
+# "cache_budget" setting, eg "20G"). Drives mounted with a cache mode get a
+# generated --vfs-cache-max-size which is half an equal share of the budget
+# (among all remotes with a cache mode) and half a share by recent I/O,
+# capped at what the other mounted drives leave of the budget. Caches of unmounted remotes are deleted,
+# least recently used first, while the total is over the budget. Caches with
+# writes that were not uploaded yet are never deleted.
+#
+# Sizes come from vfs/stats when the drive has an rc API. Otherwise the cache
+# directory is walked, listing and stat'ing only the files of directories whose
+# mtime changed since the last walk. Cached files only grow while rclone has
+# them open, so those (read from /proc/<pid>/fd) are stat'ed every time too.
+# Caches of unmounted remotes don't change so are measured once.
+
+
+CHECK_INTERVAL = 60.0
+ACTIVITY_DECAY = 0.9  # Per metrics sample
+
+
+def flag_value(mount_args: str, flag: str) -> Optional[str]:
+    args = str(mount_args).split()
+    for i, arg in enumerate(args):
+        if arg == flag:
+            return args[i + 1] if i + 1 < len(args) else ""
+        if arg.startswith(flag + "="):
+            return arg[len(flag) + 1:]
+    return None
+
+
+def cache_dirs(remote: RemoteConfig) -> Tuple[str, str]:
+    # Data and metadata dirs of the remote's VFS cache
+    root = flag_value(remote.mount_args, "--cache-dir")
+    if not root:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        root = os.path.join(base, "rclone")
+    root = os.path.expanduser(root)
+    return os.path.join(root, "vfs", remote.remote_name), os.path.join(root, "vfsMeta", remote.remote_name)
+
+
+def uses_cache(remote: RemoteConfig) -> bool:
+    return flag_value(remote.mount_args, "--vfs-cache-mode") not in (None, "", "off")
+
+
+def open_files(pid: int) -> Set[str]:
+    # Files the process (and its children) have open
+    paths = set()
+    for p in process_tree(pid):
+        fd_dir = "/proc/{}/fd".format(p)
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                paths.add(os.readlink(os.path.join(fd_dir, fd)))
+            except OSError:
+                pass
+    return paths
+
+
+class DirSizer:
+    def __init__(self) -> None:
+        self.listings: Dict[str, Tuple[int, Dict[str, int], List[str]]] = {}  # dir: (mtime, file: bytes, subdirs)
+
+    def size(self, root: str, changing: Set[str] = frozenset()) -> int:
+        # Disk usage (sparse files only count allocated blocks). Sizes of files
+        # in unchanged directories are reused unless they are in changing.
+        total = 0
+        # changing has resolved paths (eg from /proc). Translate to below root.
+        real = os.path.realpath(root)
+        changing = {root + f[len(real):] for f in changing if f.startswith(real + os.sep)}
+        pending = [root]
+        seen = set()
+        while len(pending) != 0:
+            path = pending.pop()
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            listing = self.listings.get(path)
+            if listing is None or listing[0] != mtime:
+                files, dirs = {}, []
+                try:
+                    with os.scandir(path) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                dirs.append(entry.path)
+                                continue
+                            try:
+                                files[entry.path] = entry.stat(follow_symlinks=False).st_blocks * 512
+                            except OSError:
+                                pass
+                except OSError:
+                    continue
+                listing = (mtime, files, dirs)
+                self.listings[path] = listing
+            else:
+                for f in changing.intersection(listing[1]):
+                    try:
+                        listing[1][f] = os.lstat(f).st_blocks * 512
+                    except OSError:
+                        pass
+            total += sum(listing[1].values())
+            pending.extend(listing[2])
+        # Forget directories that are gone
+        for path in [p for p in self.listings if (p == root or p.startswith(root + os.sep)) and p not in seen]:
+            del self.listings[path]
+        return total
+
+
+def has_dirty(meta_dir: str) -> bool:
+    # Files written but not uploaded yet are marked dirty in their metadata
+    for dirpath, dirnames, filenames in os.walk(meta_dir):
+        for filename in filenames:
+            try:
+                with open(os.path.join(dirpath, filename)) as f:
+                    if json.load(f).get("Dirty"):
+                        return True
+            except (OSError, ValueError, AttributeError):
+                # Unreadable metadata. Assume the worst.
+                return True
+    return False
+
+
+class CacheManager:
+    def __init__(self, engine: MountEngine, collector: MetricsCollector, get_config: Callable[[], Config]) -> None:
+        self.engine = engine
+        self.get_config = get_config
+        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.sizer = DirSizer()
+        self.usage: Dict[str, int] = {}  # name: bytes
+        self.frozen: Dict[str, int] = {}  # name: bytes, for unmounted remotes
+        self.activity: Dict[str, float] = {}  # name: decaying bytes / s
+        self.assigned: Dict[str, int] = {}  # name: generated --vfs-cache-max-size
+        self.thread = threading.Thread(target=self.run, name="cache", daemon=True)
+        self.thread.start()
+        collector.add_listener(self.samples)
+        engine.add_listener(self.engine_event)
+        engine.add_arg_provider(self.mount_args)
+
+    def budget(self) -> Optional[int]:
+        budget = self.get_config().setting("cache_budget")
+        return parse_size(str(budget)) if budget else None
+
+    def engine_event(self, event: str, name: str, detail: str):
+        if event == "mounted":
+            with self.lock:
+                self.frozen.pop(name, None)
+        elif event in ("unmounted", "died", "idle"):
+            with self.lock:
+                self.assigned.pop(name, None)
+            self.wake()
+
+    def samples(self, samples: Dict[str, Sample]):
+        with self.lock:
+            for name, sample in samples.items():
+                rate = (sample.read_rate or 0) + (sample.write_rate or 0)
+                self.activity[name] = self.activity.get(name, rate) * ACTIVITY_DECAY + rate * (1 - ACTIVITY_DECAY)
+                if sample.cache_bytes is not None:
+                    self.usage[name] = sample.cache_bytes
+
+    def mount_args(self, remote: RemoteConfig) -> List[str]:
+        # Runs on a mount worker right before mounting
+        budget = self.budget()
+        if budget is None or not uses_cache(remote) or flag_value(remote.mount_args, "--vfs-cache-max-size") is not None:
+            return []
+        config = self.get_config()
+        name = remote.remote_name
+        # Shares are of every remote that may use the cache, not only mounted ones
+        names = [n for n, r in config.remotes.items() if n != name and uses_cache(r)] + [name]
+        with self.engine.lock:
+            others = [n for n in self.engine.mounted if n != name and config.get(n) is not None]
+        with self.lock:
+            activity = {n: self.activity.get(n) for n in names}
+            # Never hand out more than what's left of the budget
+            given = 0
+            for n in others:
+                size = flag_value(config.get(n).mount_args, "--vfs-cache-max-size")
+                given += parse_size(size) if size else self.assigned.get(n, 0)
+        known = [a for a in activity.values() if a is not None]
+        default = sum(known) / len(known) if len(known) != 0 else 1.0
+        activity = {n: (default if a is None else a) for n, a in activity.items()}
+        total = sum(activity.values())
+        share = 0.5 / len(names) + (0.5 * activity[name] / total if total > 0 else 0.5 / len(names))
+        size = max(1 << 20, min(int(budget * share), budget - given))
+        with self.lock:
+            self.assigned[name] = size
+        return ["--vfs-cache-max-size", "{}M".format(size >> 20)]
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            budget = None
+            try:
+                budget = self.budget()
+                if budget is not None:
+                    self.measure()
+                    self.prune()
+            except:
+                traceback.print_exc()
+            # Without a budget only a config reload (wake) has anything to do
+            with self.cond:
+                self.cond.wait(CHECK_INTERVAL if budget is not None else None)
+
+    def measure(self) -> Dict[str, int]:
+        # Runs on the cache thread
+        config = self.get_config()
+        with self.engine.lock:
+            mounted = dict(self.engine.mounted)
+        usage = {}
+        for name, remote in config.remotes.items():
+            with self.lock:
+                if name in self.frozen:
+                    usage[name] = self.frozen[name]
+                    continue
+                if name in mounted and mounted[name].rc is not None and name in self.usage:
+                    # From vfs/stats
+                    usage[name] = self.usage[name]
+                    continue
+            data_dir, meta_dir = cache_dirs(remote)
+            changing = set()
+            if name in mounted and mounted[name].proc is not None:
+                changing = open_files(mounted[name].proc.pid)
+            size = self.sizer.size(data_dir, changing) + self.sizer.size(meta_dir, changing)
+            usage[name] = size
+            if name not in mounted and not self.engine.is_busy(name):
+                with self.lock:
+                    self.frozen[name] = size
+        with self.lock:
+            self.usage = usage
+        return usage
+
+    def prune(self):
+        budget = self.budget()
+        config = self.get_config()
+        with self.lock:
+            usage = dict(self.usage)
+        total = sum(usage.values())
+        if budget is None or total <= budget:
+            return
+        candidates = []
+        for name, size in usage.items():
+            remote = config.get(name)
+            if size == 0 or remote is None or self.engine.state(name) not in ("unmounted", "idle"):
+                continue
+            data_dir, meta_dir = cache_dirs(remote)
+            try:
+                last_used = os.stat(data_dir).st_mtime
+            except OSError:
+                last_used = 0
+            candidates.append((last_used, name, data_dir, meta_dir))
+        for last_used, name, data_dir, meta_dir in sorted(candidates):
+            if total <= budget:
+                break
+            if has_dirty(meta_dir):
+                print("Not pruning cache of {}, it has files waiting to be uploaded".format(name))
+                continue
+            # Move out of the way while no mount can start, delete after
+            trash = []
+            with self.engine.lock:
+                if self.engine.state(name) not in ("unmounted", "idle"):
+                    continue
+                for path in (data_dir, meta_dir):
+                    try:
+                        os.rename(path, path + ".pruning")
+                        trash.append(path + ".pruning")
+                    except OSError:
+                        pass
+            print("Pruning cache of {} ({} bytes)".format(name, usage[name]))
+            for path in trash:
+                shutil.rmtree(path, ignore_errors=True)
+            total -= usage[name]
+            with self.lock:
+                self.usage[name] = 0
+                self.frozen[name] = 0
+
+    def report(self) -> Tuple[Dict[str, int], Optional[int]]:
+        # Last measured usage per remote and the budget
+        with self.lock:
+            return dict(self.usage), self.budget()
@@ -0,0 +1,193 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import tracing
+
+
+# Config model. On disk the format stays {"count": N, "items": {"0": {...}}}
+# plus optional top level settings. In memory each remote is a RemoteConfig
+# and remotes are indexed by name.
+
+
+DEFAULT_MOUNT_TIMEOUT = 10.0
+
+# Per remote keys and their defaults. Keys with a default of None are
+# always written. Others are only written when changed from the default.
+REMOTE_FIELDS = {
+    "remote_name": None,
+    "mount_point": None,
+    "mount_args": None,
+    "mount_timeout": DEFAULT_MOUNT_TIMEOUT,
+    "idle_timeout": 0,  # Minutes without activity before unmounting (0 = never)
+    "bw_weight": 1.0,  # Share of the global bandwidth budget
+    "mount_at_startup": False,
+    "priority": 0,  # Higher is mounted first at startup
+    "warm_paths": [],  # Folders whose listings are prefetched after mounting
+    "warm_depth": 2,  # Levels of warm_paths to prefetch (0 = all)
+    "max_rss": 0,  # Soft limits, restart when exceeded (0 = none)
+    "max_cpu": 0,
+    "max_fds": 0,
+    "hard_rss": 0,  # Hard limits applied at spawn (0 = none)
+    "hard_cpu": 0,
+    "hard_fds": 0,
+}
+
+
+class RemoteConfig:
+    __slots__ = tuple(REMOTE_FIELDS) + ("extra",)
+
+    def __init__(self, remote_name: str = "", mount_point: str = "", mount_args: str = "", **kwargs) -> None:
+        self.remote_name = remote_name
+        self.mount_point = mount_point
+        self.mount_args = mount_args
+        for key, default in REMOTE_FIELDS.items():
+            if default is not None:
+                # Lists are copied so instances don't share the default
+                setattr(self, key, kwargs.pop(key, list(default) if isinstance(default, list) else default))
+        self.extra: Dict[str, Any] = kwargs  # Unknown keys, kept as is
+
+    @staticmethod
+    def from_dict(data: Dict) -> "RemoteConfig":
+        data = dict(data)
+        return RemoteConfig(str(data.pop("remote_name", "")), str(data.pop("mount_point", "")),
+                            str(data.pop("mount_args", "")), **data)
+
+    def to_dict(self) -> Dict:
+        data = {}
+        for key, default in REMOTE_FIELDS.items():
+            value = getattr(self, key)
+            if default is None or value != default:
+                data[key] = value
+        data.update(self.extra)
+        return data
+
+    def copy(self) -> "RemoteConfig":
+        return RemoteConfig.from_dict(self.to_dict())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RemoteConfig) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return "RemoteConfig({!r})".format(self.to_dict())
+
+
+class Config:
+    def __init__(self, items: Optional[List[RemoteConfig]] = None, settings: Optional[Dict] = None) -> None:
+        self.items: List[RemoteConfig] = []
+        self.remotes: Dict[str, RemoteConfig] = {}  # remote_name: item (first one wins)
+        self.settings: Dict[str, Any] = dict(settings or {})
+        for item in items or []:
+            self.add(item)
+
+    def add(self, item: RemoteConfig):
+        self.items.append(item)
+        self.remotes.setdefault(item.remote_name, item)
+
+    def get(self, name: str) -> Optional[RemoteConfig]:
+        return self.remotes.get(name)
+
+    def names(self) -> List[str]:
+        return list(self.remotes)
+
+    def setting(self, key: str, default: Any = None) -> Any:
+        return self.settings.get(key, default)
+
+    @staticmethod
+    def from_dict(data: Dict) -> "Config":
+        settings = {k: v for k, v in data.items() if k not in ("count", "items")}
+        items = [RemoteConfig.from_dict(data["items"][str(i)]) for i in range(data.get("count", 0))]
+        return Config(items, settings)
+
+    def to_dict(self) -> Dict:
+        data = dict(self.settings)
+        data["count"] = len(self.items)
+        data["items"] = {str(i): item.to_dict() for i, item in enumerate(self.items)}
+        return data
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Config) and self.to_dict() == other.to_dict()
+
+    def diff(self, new: "Config") -> Tuple[List[str], List[str], List[str]]:
+        # Names (added, removed, changed) going from self to new
+        added = [name for name in new.remotes if name not in self.remotes]
+        removed = [name for name in self.remotes if name not in new.remotes]
+        changed = [name for name in new.remotes if name in self.remotes and new.remotes[name] != self.remotes[name]]
+        return added, removed, changed
+
+
+def default_config_path() -> str:
+    # Same location the tray uses (QStandardPaths::AppDataLocation)
+    data_dir = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(data_dir, "rclone-drive-manager", "config.json")
+
+
+def load_config(path: str) -> Config:
+    with tracing.span("load config"), open(path, "r") as f:
+        return Config.from_dict(json.load(f))
+
+
+def save_config(path: str, config: Config) -> bool:
+    # Only writes if the settings changed (formatting of a hand edited file
+    # doesn't matter). Written to a temp file which is
+    # then renamed over the old one so a crash never leaves a partial file.
+    # Returns True if the file was written.
+    with tracing.span("save config"):
+        text = json.dumps(config.to_dict())
+        try:
+            with open(path, "r") as f:
+                if Config.from_dict(json.load(f)) == config:
+                    return False
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # Missing or unreadable. Replace it.
+            pass
+        folder = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".config.json.", dir=folder)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        # Make the rename itself durable
+        dir_fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return True
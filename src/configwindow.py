@@ -32,94 +32,198 @@
 import traceback
 
 try:
-    from PySide6.QtWidgets import QMainWindow, QWidget, QMessageBox
-    from PySide6.QtCore import Signal, QStandardPaths, QFile
+    from PySide6.QtWidgets import QMainWindow, QWidget, QMessageBox, QCompleter
+    from PySide6.QtCore import Signal, QStandardPaths, QFile, Qt, QAbstractListModel, QModelIndex, QStringListModel
     from PySide6.QtGui import QShowEvent, QCloseEvent
 except:
-    from PySide2.QtWidgets import QMainWindow, QWidget, QMessageBox
-    from PySide2.QtCore import Signal, QStandardPaths, QFile
+    from PySide2.QtWidgets import QMainWindow, QWidget, QMessageBox, QCompleter
+    from PySide2.QtCore import Signal, QStandardPaths, QFile, Qt, QAbstractListModel, QModelIndex, QStringListModel
     from PySide2.QtGui import QShowEvent, QCloseEvent
 
-from typing import Optional
+from typing import Optional, List
 from ui_configwindow import Ui_ConfigWindow
 from ui_config_list_item import Ui_ConfigListItem
-import json
+from config import Config, RemoteConfig, save_config
+import remotes
 import os
 
 
+DEFAULT_MOUNT_ARGS = "--dir-cache-time 1m0s\n--vfs-cache-mode full"
+
+
 class ConfigListItem(QWidget):
     removed = Signal(QWidget)
+    changed = Signal()
 
     def __init__(self, parent: Optional[QWidget] = None) -> None:
         super().__init__(parent)
         self.ui = Ui_ConfigListItem()
         self.ui.setupUi(self)
+        self.remote = RemoteConfig()  # Holds settings not shown in the editor
+        self.loading = False
+        # Complete remote names from rclone's config
+        self.known_remotes = QStringListModel(self)
+        completer = QCompleter(self.known_remotes, self)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.ui.txt_remote.setCompleter(completer)
         self.ui.btn_remove.clicked.connect(self.__remove)
+        self.ui.txt_remote.textChanged.connect(self.__check_remote)
+        self.ui.txt_remote.textChanged.connect(self.__changed)
+        self.ui.txt_mountpoint.textChanged.connect(self.__changed)
+        self.ui.txt_args.textChanged.connect(self.__check_remote)  # May name a --config
+        self.ui.txt_args.textChanged.connect(self.__changed)
+        self.ui.spin_priority.valueChanged.connect(self.__changed)
+        self.ui.chk_startup.toggled.connect(self.__changed)
 
     def __remove(self):
         self.removed.emit(self)
 
+    def __changed(self):
+        if not self.loading:
+            self.changed.emit()
+
+    def __check_remote(self):
+        name = self.ui.txt_remote.text()
+        error = remotes.catalog.check(name, self.ui.txt_args.toPlainText()) if name != "" else None
+        self.ui.txt_remote.setToolTip("" if error is None else error)
+
+    def set_known_remotes(self, names: List[str]):
+        self.known_remotes.setStringList(names)
+
+    def set_remote(self, remote: RemoteConfig):
+        self.loading = True
+        self.remote = remote
+        self.ui.txt_remote.setText(remote.remote_name)
+        self.ui.txt_mountpoint.setText(remote.mount_point)
+        self.ui.txt_args.setPlainText(remote.mount_args)
+        self.ui.spin_priority.setValue(int(remote.priority))
+        self.ui.chk_startup.setChecked(bool(remote.mount_at_startup))
+        self.loading = False
+
+    def store_remote(self):
+        # Write edits back to the remote being edited
+        self.remote.remote_name = self.ui.txt_remote.text()
+        self.remote.mount_point = self.ui.txt_mountpoint.text()
+        self.remote.mount_args = self.ui.txt_args.toPlainText()
+        self.remote.priority = self.ui.spin_priority.value()
+        self.remote.mount_at_startup = self.ui.chk_startup.isChecked()
+
+
+class ConfigListModel(QAbstractListModel):
+    def __init__(self, parent: Optional[QWidget] = None) -> None:
+        super().__init__(parent)
+        self.remotes: List[RemoteConfig] = []
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.remotes)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.remotes):
+            return None
+        remote = self.remotes[index.row()]
+        if role == Qt.DisplayRole:
+            return remote.remote_name if remote.remote_name != "" else "(unnamed)"
+        if role == Qt.ToolTipRole:
+            return remote.mount_point
+        return None
+
+    def set_remotes(self, remotes: List[RemoteConfig]):
+        self.beginResetModel()
+        self.remotes = remotes
+        self.endResetModel()
+
+    def append(self, remote: RemoteConfig) -> int:
+        row = len(self.remotes)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.remotes.append(remote)
+        self.endInsertRows()
+        return row
+
+    def remove(self, row: int):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.remotes[row]
+        self.endRemoveRows()
+
+    def row_changed(self, row: int):
+        self.dataChanged.emit(self.index(row), self.index(row))
+
 
 class ConfigWindow(QMainWindow):
-    closed = Signal(dict)
+    closed = Signal(object)  # Saved Config, or None if saving failed
 
     def __init__(self, parent: Optional[QWidget] = None) -> None:
         super().__init__(parent)
         self.ui = Ui_ConfigWindow()
         self.ui.setupUi(self)
-        self.list_items = []
-        self.ui.btn_add.clicked.connect(self.add_config)
+        self.settings = {}
         self.cfg_file = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation) + "/config.json"
 
+        # Remotes are listed in a view. One editor (reused every time the
+        # window is shown) edits whichever remote is selected.
+        self.model = ConfigListModel(self)
+        self.ui.lst_remotes.setModel(self.model)
+        self.editor = ConfigListItem()
+        self.editor.setEnabled(False)
+        self.ui.pnl_editor.layout().insertWidget(0, self.editor)
+        self.ui.splitter.setStretchFactor(1, 3)
+        self.editor.removed.connect(self.remove_config)
+        self.editor.changed.connect(self.editor_changed)
+        self.ui.lst_remotes.selectionModel().currentChanged.connect(self.current_changed)
+        self.ui.btn_add.clicked.connect(self.add_config)
+
         version_file = QFile(":/version.txt")
         if version_file.open(QFile.ReadOnly):
             version_txt = bytes(version_file.readLine()).strip().decode()
             self.setWindowTitle("{0} - v{1}".format(self.windowTitle(), version_txt))
 
+    def current_row(self) -> int:
+        return self.ui.lst_remotes.currentIndex().row()
+
+    def select_row(self, row: int):
+        if row < 0 or row >= self.model.rowCount():
+            self.editor.setEnabled(False)
+            self.editor.set_remote(RemoteConfig())
+            return
+        self.ui.lst_remotes.setCurrentIndex(self.model.index(row))
+
+    def current_changed(self, current: QModelIndex, previous: QModelIndex):
+        if not current.isValid():
+            return
+        self.editor.set_remote(self.model.remotes[current.row()])
+        self.editor.setEnabled(True)
+
+    def editor_changed(self):
+        row = self.current_row()
+        if row >= 0:
+            self.editor.store_remote()
+            self.model.row_changed(row)
+
     def add_config(self):
-        item = ConfigListItem()
-        # Default args
-        item.ui.txt_args.setPlainText("--dir-cache-time 1m0s\n--vfs-cache-mode full")
-        item.removed.connect(self.remove_config)
-        self.ui.sa_main.layout().insertWidget(self.ui.sa_main.layout().count() - 1, item)
-        self.list_items.append(item)
+        self.select_row(self.model.append(RemoteConfig(mount_args=DEFAULT_MOUNT_ARGS)))
+        self.editor.ui.txt_remote.setFocus()
 
     def remove_config(self, which: ConfigListItem):
-        self.ui.sa_main.layout().removeWidget(which)
-        self.list_items.remove(which)
-        which.deleteLater()
-
-    def clear_configs(self):
-        for cfg_list_item in self.list_items:
-            self.ui.sa_main.layout().removeWidget(cfg_list_item)
-        self.list_items.clear()
-
-    def show(self, data: dict):
-        self.clear_configs()
-        for i in range(data["count"]):
-            self.add_config()
-            obj: ConfigListItem = self.ui.sa_main.layout().itemAt(i).widget()
-            obj.ui.txt_remote.setText(data["items"][str(i)]["remote_name"])
-            obj.ui.txt_mountpoint.setText(data["items"][str(i)]["mount_point"])
-            obj.ui.txt_args.setPlainText(data["items"][str(i)]["mount_args"])
+        row = self.current_row()
+        if row < 0:
+            return
+        self.model.remove(row)
+        self.select_row(min(row, self.model.rowCount() - 1))
+
+    def show(self, config: Config):
+        # Keep global settings (not editable here) so they survive saving
+        self.settings = dict(config.settings)
+        self.model.set_remotes([remote.copy() for remote in config.items])
+        self.editor.set_known_remotes(remotes.catalog.remotes() or [])
+        self.select_row(0)
         return super().show()
     
     def closeEvent(self, event: QCloseEvent):
         try:
             if not os.path.exists(os.path.dirname(self.cfg_file)):
                 os.makedirs(os.path.dirname(self.cfg_file))
-            with open(self.cfg_file, "w") as f:
-                data = {}
-                data["count"] = self.ui.sa_main.layout().count() - 1
-                data["items"] = {}
-                for i in range(data["count"]):
-                    data["items"][str(i)] = {}
-                    obj: ConfigListItem = self.ui.sa_main.layout().itemAt(i).widget()
-                    data["items"][str(i)]["remote_name"] = obj.ui.txt_remote.text()
-                    data["items"][str(i)]["mount_point"] = obj.ui.txt_mountpoint.text()
-                    data["items"][str(i)]["mount_args"] = obj.ui.txt_args.toPlainText()
-                json.dump(data, f)
-                self.closed.emit(data)
+            config = Config([remote.copy() for remote in self.model.remotes], self.settings)
+            save_config(self.cfg_file, config)
+            self.closed.emit(config)
         except Exception as e:
             traceback.print_exc()
             dialog = QMessageBox(self)
@@ -130,5 +234,5 @@ class ConfigWindow(QMainWindow):
             dialog.setStandardButtons(QMessageBox.Ok)
             dialog.setDefaultButton(QMessageBox.Ok)
             dialog.exec_()
-            self.closed.emit({})
+            self.closed.emit(None)
         return super().closeEvent(event)
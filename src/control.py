@@ -0,0 +1,336 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import traceback
+from concurrent.futures import wait
+from typing import Callable, Dict, Iterator, List, Optional
+
+from config import Config
+from mountengine import MountEngine
+
+
+# Control API for a MountEngine over a unix domain socket. Used by the
+# headless daemon (daemon.py) and optionally by the tray.
+#
+# Newline delimited JSON. Each request is an object with a "cmd" and an
+# optional "id" which is copied into the reply:
+#   {"cmd": "status", "names": [...]}            states of remotes (all if no names)
+#   {"cmd": "mount", "names": [...], "wait": b}  mount remotes (all configured if no names)
+#   {"cmd": "unmount", "names": [...], "force": b, "wait": b}
+#   {"cmd": "log", "name": "...", "lines": n}     last output lines of a remote's rclone
+#   {"cmd": "batch", "cmds": [{...}, ...]}       run several commands, one reply
+#   {"cmd": "subscribe"}                         stream engine events on this connection
+#   {"cmd": "reload"}                            reload config.json
+#   {"cmd": "shutdown"}                          unmount everything and exit (daemon only)
+# Replies are {"id": ..., "ok": true, "result": ...} or {"id": ..., "ok": false, "error": "..."}.
+# Without "wait", mount / unmount reply with the names that were started.
+# Mounting a drive in the "idle" state (see idle.py) remounts it. Unmounting
+# it keeps it unmounted.
+# Events are sent as {"event": "mounted", "name": "...", "detail": "..."}.
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, "rclone-drive-manager.sock")
+
+
+class ControlError(Exception):
+    pass
+
+
+class Connection(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.events: Optional[queue.Queue] = None
+
+    def send(self, obj: Dict):
+        data = (json.dumps(obj) + "\n").encode()
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        server: ControlServer = self.server.control
+        try:
+            for line in self.rfile:
+                if line.strip() == b"":
+                    continue
+                request = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ControlError("Request must be a JSON object")
+                    if request.get("cmd") == "subscribe":
+                        self.subscribe(server)
+                        reply = {"ok": True, "result": None}
+                    else:
+                        reply = {"ok": True, "result": server.run(request)}
+                except (ControlError, ValueError) as e:
+                    reply = {"ok": False, "error": str(e)}
+                except Exception as e:
+                    traceback.print_exc()
+                    reply = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+                if isinstance(request, dict) and "id" in request:
+                    reply["id"] = request["id"]
+                self.send(reply)
+        except (OSError, ValueError):
+            pass
+        finally:
+            if self.events is not None:
+                server.unsubscribe(self.events)
+                self.events.put(None)
+
+    def subscribe(self, server: "ControlServer"):
+        if self.events is not None:
+            return
+        # Engine listeners run on worker threads. A sender thread per
+        # subscriber keeps a slow client from stalling them.
+        self.events = server.subscribe()
+        threading.Thread(target=self.send_events, daemon=True).start()
+
+    def send_events(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            try:
+                self.send(event)
+            except (OSError, ValueError):
+                return
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+    def __init__(self, engine: MountEngine, get_config: Callable[[], Config], path: str = "",
+                 reload: Optional[Callable[[], None]] = None, shutdown: Optional[Callable[[], None]] = None) -> None:
+        self.engine = engine
+        self.get_config = get_config
+        self.reload = reload
+        self.shutdown = shutdown
+        self.path = path or default_socket_path()
+        self.lock = threading.Lock()
+        self.subscribers: List[queue.Queue] = []
+        self.commands = {
+            "status": self.status,
+            "mount": self.mount,
+            "unmount": self.unmount,
+            "log": self.log,
+            "batch": self.batch,
+            "reload": self.reload_config,
+            "shutdown": self.shutdown_daemon,
+        }
+        if os.path.exists(self.path):
+            # Stale socket from a previous run (a live one refuses this)
+            if ControlClient.alive(self.path):
+                raise ControlError("Another instance is already listening on {}".format(self.path))
+            os.unlink(self.path)
+        old_umask = os.umask(0o177)  # Socket is only accessible by this user
+        try:
+            self.server = UnixServer(self.path, Connection)
+        finally:
+            os.umask(old_umask)
+        self.server.control = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="control", daemon=True)
+        self.thread.start()
+        engine.add_listener(self.engine_event)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def subscribe(self) -> queue.Queue:
+        events = queue.Queue()
+        with self.lock:
+            self.subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events: queue.Queue):
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+    def engine_event(self, event: str, name: str, detail: str):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for events in subscribers:
+            events.put({"event": event, "name": name, "detail": detail})
+
+    def run(self, request: Dict):
+        cmd = request.get("cmd")
+        if cmd not in self.commands:
+            raise ControlError("Unknown command {}".format(cmd))
+        return self.commands[cmd](request)
+
+    def names(self, request: Dict, default: List[str]) -> List[str]:
+        names = request.get("names")
+        if names is None:
+            return default
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            raise ControlError("names must be a list of strings")
+        return names
+
+    def status(self, request: Dict) -> Dict:
+        config = self.get_config()
+        with self.engine.lock:
+            mounted = dict(self.engine.mounted)
+        names = self.names(request, config.names() + [n for n in mounted if n not in config.remotes])
+        result = {}
+        for name in names:
+            info = {"state": self.engine.state(name), "configured": name in config.remotes}
+            if name in mounted:
+                mount = mounted[name]
+                info["mountpoint"] = mount.mountpoint
+                info["pid"] = mount.proc.pid if mount.proc is not None else None
+                info["ready_time"] = mount.ready_time
+            result[name] = info
+        return result
+
+    def timeout(self, request: Dict) -> Optional[float]:
+        timeout = request.get("timeout")
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout < 0):
+            raise ControlError("timeout must be a non-negative number")
+        return timeout
+
+    def wait_results(self, request: Dict, futures: Dict, timeout: Optional[float]) -> Dict:
+        if not request.get("wait", False):
+            return {"started": [name for name, fut in futures.items() if fut is not None]}
+        wait([f for f in futures.values() if f is not None], timeout)
+        return {name: (fut.result() if fut is not None and fut.done() else None) for name, fut in futures.items()}
+
+    def mount(self, request: Dict) -> Dict:
+        config = self.get_config()
+        names = self.names(request, config.names())
+        timeout = self.timeout(request)
+        missing = [name for name in names if config.get(name) is None]
+        if len(missing) != 0:
+            raise ControlError("No configuration for {}".format(", ".join(missing)))
+        return self.wait_results(request, {name: self.engine.mount(config.get(name)) for name in names}, timeout)
+
+    def unmount(self, request: Dict) -> Dict:
+        names = self.names(request, list(self.engine.mounted))
+        force = bool(request.get("force", False))
+        timeout = self.timeout(request)
+        return self.wait_results(request, {name: self.engine.unmount(name, force) for name in names}, timeout)
+
+    def log(self, request: Dict) -> List[str]:
+        name = request.get("name")
+        lines = request.get("lines")
+        if not isinstance(name, str):
+            raise ControlError("name must be a string")
+        if lines is not None and (not isinstance(lines, int) or lines < 0):
+            raise ControlError("lines must be a non-negative integer")
+        return self.engine.log_tail(name, lines)
+
+    def batch(self, request: Dict) -> List[Dict]:
+        cmds = request.get("cmds", [])
+        if not isinstance(cmds, list):
+            raise ControlError("cmds must be a list")
+        results = []
+        for cmd in cmds:
+            # One failing command doesn't abort the others
+            try:
+                if not isinstance(cmd, dict) or cmd.get("cmd") in ("batch", "subscribe"):
+                    raise ControlError("Not allowed in a batch")
+                results.append({"ok": True, "result": self.run(cmd)})
+            except (ControlError, ValueError) as e:
+                results.append({"ok": False, "error": str(e)})
+            except Exception as e:
+                traceback.print_exc()
+                results.append({"ok": False, "error": "{}: {}".format(type(e).__name__, e)})
+        return results
+
+    def reload_config(self, request: Dict):
+        if self.reload is None:
+            raise ControlError("Reload not supported")
+        self.reload()
+
+    def shutdown_daemon(self, request: Dict):
+        if self.shutdown is None:
+            raise ControlError("Shutdown not supported")
+        self.shutdown()
+
+
+class ControlClient:
+    def __init__(self, path: str = "") -> None:
+        self.path = path or default_socket_path()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+        self.rfile = self.sock.makefile("rb")
+        self.next_id = 0
+
+    @staticmethod
+    def alive(path: str) -> bool:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(path)
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def call(self, cmd: str, **params):
+        self.next_id += 1
+        params["cmd"] = cmd
+        params["id"] = self.next_id
+        self.sock.sendall((json.dumps(params) + "\n").encode())
+        for msg in self.messages():
+            if msg.get("id") == self.next_id:
+                if not msg.get("ok"):
+                    raise ControlError(msg.get("error", "Unknown error"))
+                return msg.get("result")
+        raise ControlError("Connection closed")
+
+    def messages(self) -> Iterator[Dict]:
+        for line in self.rfile:
+            yield json.loads(line)
+
+    def events(self) -> Iterator[Dict]:
+        self.call("subscribe")
+        for msg in self.messages():
+            if "event" in msg:
+                yield msg
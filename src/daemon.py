@@ -0,0 +1,171 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+from config import Config, default_config_path, load_config
+from control import ControlClient, ControlError, ControlServer, default_socket_path
+from bandwidth import BandwidthScheduler
+from cache import CacheManager
+from idle import IdleMonitor
+from startup import StartupMounter
+from warm import Warmer
+from watchdog import Watchdog
+import tracing
+from metrics import MetricsCollector, DEFAULT_INTERVAL
+from mountengine import MountEngine, DEFAULT_SHUTDOWN_TIMEOUT
+
+
+# Headless mode. "daemon.py run" supervises mounts without any GUI and is
+# controlled over a unix socket (see control.py). The other subcommands are
+# a small client for scripting:
+#
+#   python3 daemon.py run &
+#   python3 daemon.py mount --wait OneDrive GDrive
+#   python3 daemon.py status
+#   python3 daemon.py events
+
+
+class Daemon:
+    def __init__(self, config_path: str, socket_path: str) -> None:
+        self.config_path = config_path
+        self.config = Config()
+        self.stopping = threading.Event()
+        self.engine = MountEngine()
+        self.engine.add_listener(self.log_event)
+        self.metrics = MetricsCollector(self.engine)
+        self.idle_monitor = IdleMonitor(self.engine, self.metrics, lambda: self.config)
+        self.bandwidth = BandwidthScheduler(self.engine, lambda: self.config)
+        self.cache = CacheManager(self.engine, self.metrics, lambda: self.config)
+        self.warmer = Warmer(self.engine, lambda: self.config)
+        self.watchdog = Watchdog(self.engine, self.metrics, lambda: self.config)
+        self.reload()
+        # Bind first. Fails if another daemon is listening, before anything is mounted.
+        self.server = ControlServer(self.engine, lambda: self.config, socket_path,
+                                    reload=self.reload, shutdown=self.stopping.set)
+        self.engine.adopt_running(self.config)
+        self.startup = StartupMounter(self.engine, self.config)
+
+    def log_event(self, event: str, name: str, detail: str):
+        print("{}: {} {}".format(event, name, detail).rstrip(), flush=True)
+
+    def reload(self):
+        if os.path.exists(self.config_path):
+            try:
+                self.config = load_config(self.config_path)
+            except Exception as e:
+                print("Error occurred loading configuration file: {}".format(e), file=sys.stderr)
+                return
+        self.engine.apply_config(self.config)
+        self.metrics.set_interval(self.config.setting("metrics_interval", DEFAULT_INTERVAL))
+        self.bandwidth.wake()
+        self.cache.wake()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda sig, frame: self.stopping.set())
+        signal.signal(signal.SIGINT, lambda sig, frame: self.stopping.set())
+        signal.signal(signal.SIGHUP, lambda sig, frame: self.reload())
+        print("Listening on {}".format(self.server.path), flush=True)
+        while not self.stopping.wait(3600):
+            pass
+        self.startup.cancel()
+        self.watchdog.cancel()
+        timeout = self.config.setting("shutdown_timeout", DEFAULT_SHUTDOWN_TIMEOUT)
+        failed = self.engine.unmount_all(timeout)
+        if len(failed) != 0:
+            print("Forcing unmount of {}".format(", ".join(failed)), flush=True)
+            self.engine.unmount_all(timeout, True)
+        self.server.stop()
+        self.engine.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RcloneDriveManager headless daemon and control client")
+    parser.add_argument("--socket", default=default_socket_path(), help="Control socket path")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Run the daemon")
+    run.add_argument("--config", default=default_config_path(), help="config.json path")
+    run.add_argument("--trace", metavar="FILE", help="Write a Chrome trace of mount lifecycle phases to FILE on exit")
+    sub.add_parser("status", help="Show state of all remotes")
+    for name in ("mount", "unmount"):
+        cmd = sub.add_parser(name, help="{} remotes (all if none given)".format(name.capitalize()))
+        cmd.add_argument("names", nargs="*")
+        cmd.add_argument("--wait", action="store_true", help="Wait until done")
+        if name == "unmount":
+            cmd.add_argument("--force", action="store_true", help="Kill rclone if unmounting fails")
+    log = sub.add_parser("log", help="Show the last output of a remote's rclone")
+    log.add_argument("name")
+    log.add_argument("-n", "--lines", type=int, help="Number of lines")
+    sub.add_parser("events", help="Print events as they happen")
+    sub.add_parser("reload", help="Reload config.json")
+    sub.add_parser("shutdown", help="Unmount everything and stop the daemon")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.trace:
+            tracing.tracer.enable(args.trace)
+        Daemon(args.config, args.socket).run()
+        return
+
+    try:
+        client = ControlClient(args.socket)
+        if args.command == "events":
+            for event in client.events():
+                print(json.dumps(event), flush=True)
+            return
+        if args.command == "log":
+            for line in client.call("log", name=args.name, lines=args.lines):
+                print(line)
+            return
+        params = {}
+        if args.command in ("mount", "unmount"):
+            if len(args.names) != 0:
+                params["names"] = args.names
+            params["wait"] = args.wait
+            if args.command == "unmount":
+                params["force"] = args.force
+        result = client.call(args.command, **params)
+        if result is not None:
+            print(json.dumps(result, indent=2))
+    except (OSError, ControlError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from config import Config
+from metrics import RCD_SAMPLE, MetricsCollector, Sample
+from mountengine import MountEngine
+
+
+# Idle auto-unmount. Watches the metrics samples of each mounted drive and
+# cleanly unmounts drives with an idle_timeout after that many minutes
+# without activity. They are remounted on the next request (tray click or
+# "mount" over the control socket).
+#
+# Activity is any transfer or pending upload, a change in VFS cache usage, or
+# process I/O above a small rate (rclone polls the remote for changes even
+# when nobody uses the drive).
+#
+# In rcd mode transfers and process I/O are only known for the shared rcd as
+# a whole, not per remote (only the VFS cache stats are). Activity of the rcd
+# therefore counts for all of its drives: they are unmounted only once every
+# drive of the rcd is idle, rather than while one is being read.
+
+
+DEFAULT_IO_RATE = 32 * 1024  # Bytes per second
+
+
+class IdleMonitor:
+    def __init__(self, engine: MountEngine, collector: MetricsCollector, get_config: Callable[[], Config]) -> None:
+        self.engine = engine
+        self.get_config = get_config
+        self.lock = threading.Lock()
+        self.last_active: Dict[str, float] = {}
+        self.last_sample: Dict[str, Sample] = {}
+        collector.add_listener(self.samples)
+
+    def is_active(self, sample: Sample, prev: Optional[Sample], io_rate: float) -> bool:
+        if sample.transfers or sample.uploads_queued or sample.uploads_in_progress:
+            return True
+        if prev is not None and sample.cache_bytes is not None and sample.cache_bytes != prev.cache_bytes:
+            return True
+        if sample.read_rate is not None and sample.read_rate + sample.write_rate > io_rate:
+            return True
+        return False
+
+    def samples(self, samples: Dict[str, Sample]):
+        # Runs on the metrics thread
+        config = self.get_config()
+        io_rate = config.setting("idle_io_rate", DEFAULT_IO_RATE)
+        now = time.monotonic()
+        with self.engine.lock:
+            mounts = dict(self.engine.mounted)
+        names = list(mounts)
+        with self.lock:
+            shared = samples.get(RCD_SAMPLE)
+            rcd_active = shared is not None and self.is_active(shared, self.last_sample.get(RCD_SAMPLE), io_rate)
+            if shared is not None:
+                self.last_sample[RCD_SAMPLE] = shared
+            for name in list(self.last_active):
+                if name not in names:
+                    del self.last_active[name]
+                    self.last_sample.pop(name, None)
+            for name in names:
+                remote = config.get(name)
+                sample = samples.get(name)
+                if remote is None or remote.idle_timeout <= 0 or sample is None:
+                    self.last_active.pop(name, None)
+                    continue
+                active = self.is_active(sample, self.last_sample.get(name), io_rate)
+                if mounts[name].rcd is not None and rcd_active:
+                    active = True
+                if name not in self.last_active or active:
+                    self.last_active[name] = now
+                elif now - self.last_active[name] >= remote.idle_timeout * 60:
+                    print("Unmounting idle drive {}".format(name))
+                    del self.last_active[name]
+                    self.engine.unmount_idle(name)
+                self.last_sample[name] = sample
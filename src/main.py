@@ -28,31 +28,84 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os
 import sys
+import time
+
+# Startup profiling (--profile-startup). Defined before the Qt imports so
+# they are timed too.
+class StartupProfile:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.phases = []
+        self.last = time.perf_counter()
+        # Time from process start until this module ran (interpreter startup)
+        try:
+            with open("/proc/self/stat") as f:
+                start_ticks = int(f.read().rpartition(")")[2].split()[19])
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0])
+            self.phases.append(("interpreter startup", uptime - start_ticks / os.sysconf("SC_CLK_TCK")))
+        except (OSError, ValueError, IndexError):
+            pass
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("Startup profile:")
+        for phase, seconds in self.phases:
+            print("  {:<24} {:8.1f} ms".format(phase, seconds * 1000))
+        print("  {:<24} {:8.1f} ms".format("total", sum(s for p, s in self.phases) * 1000))
+
+
+profile = StartupProfile("--profile-startup" in sys.argv)
 
 try:
-    from PySide6.QtWidgets import QApplication, QSystemTrayIcon, QMenu
-    from PySide6.QtGui import QIcon, QAction
-    from PySide6.QtCore import Qt
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import Qt, QTimer
 except:
-    from PySide2.QtWidgets import QApplication, QSystemTrayIcon, QMenu, QAction
-    from PySide2.QtGui import QIcon
-    from PySide2.QtCore import Qt
+    from PySide2.QtWidgets import QApplication
+    from PySide2.QtCore import Qt, QTimer
+profile.mark("qt imports")
+
+import resources_rc  # Registers :/icon.png (the config window's ui loads it too)
+profile.mark("resources")
 
-from configwindow import ConfigWindow
+# The config window (and its generated ui modules) is only imported when it
+# is first opened
 from trayicon import TrayIcon
+import tracing
+profile.mark("app imports")
 
 
 if __name__ == "__main__":
+    argv = [arg for arg in sys.argv if arg != "--profile-startup"]
+    # --trace FILE records mount lifecycle spans (see tracing.py)
+    if "--trace" in argv:
+        i = argv.index("--trace")
+        tracing.tracer.enable(argv[i + 1] if i + 1 < len(argv) else "rclone-drive-manager-trace.json")
+        del argv[i:i + 2]
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
     QApplication.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
-    app = QApplication(sys.argv)
+    app = QApplication(argv)
     app.setQuitOnLastWindowClosed(False)
     app.setApplicationName("rclone-drive-manager")
+    profile.mark("QApplication")
 
-    win = ConfigWindow()
-    tray = TrayIcon(win)
+    tray = TrayIcon()
+    profile.mark("TrayIcon (config load)")
     tray.show()
+    profile.mark("tray show")
+
+    def event_loop_started():
+        profile.mark("event loop start")
+        profile.report()
+    QTimer.singleShot(0, event_loop_started)
 
     sys.exit(app.exec_())
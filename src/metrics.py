@@ -0,0 +1,251 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from rc import RcError
+
+
+# Per mount resource and throughput metrics. Process stats come from /proc,
+# transfer and cache stats from the rc API when the mount has one. Sampling
+# only runs while something is mounted (or the tray menu is open); otherwise
+# the sampler thread sleeps on a condition with no timeout. The Prometheus
+# endpoint lives in metricsexporter.py.
+
+
+DEFAULT_INTERVAL = 2.0
+RCD_SAMPLE = "(rcd)"  # Process stats of the shared rcd in rcd mode
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class Sample:
+    __slots__ = ("name", "time", "rss", "pss", "cpu_time", "cpu_percent", "read_bytes", "write_bytes",
+                 "read_rate", "write_rate", "speed", "transfers", "cache_bytes", "uploads_queued",
+                 "uploads_in_progress", "fds")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.time = time.monotonic()
+        for field in self.__slots__[2:]:
+            setattr(self, field, None)
+
+
+def process_tree(pid: int) -> List[int]:
+    # The mount pid is systemd-inhibit. rclone is its child.
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        try:
+            for task in os.listdir("/proc/{}/task".format(pids[i])):
+                with open("/proc/{}/task/{}/children".format(pids[i], task)) as f:
+                    pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+        i += 1
+    return pids
+
+
+def read_keyed(path: str) -> Dict[str, int]:
+    # Parses "Key: value [kB]" files (status, io, smaps_rollup)
+    out = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            parts = value.split()
+            if len(parts) == 0 or not parts[0].isdigit():
+                continue
+            out[key] = int(parts[0]) * (1024 if len(parts) > 1 and parts[1] == "kB" else 1)
+    return out
+
+
+def sample_process(sample: Sample, pid: int):
+    rss = pss = cpu = rd = wr = fds = 0
+    for p in process_tree(pid):
+        try:
+            rss += read_keyed("/proc/{}/status".format(p)).get("VmRSS", 0)
+            with open("/proc/{}/stat".format(p)) as f:
+                # Fields after the command name (which may contain spaces)
+                fields = f.read().rpartition(")")[2].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLK_TCK
+        except OSError:
+            continue
+        try:
+            fds += len(os.listdir("/proc/{}/fd".format(p)))
+        except OSError:
+            pass
+        try:
+            pss += read_keyed("/proc/{}/smaps_rollup".format(p)).get("Pss", 0)
+        except OSError:
+            pass
+        try:
+            io = read_keyed("/proc/{}/io".format(p))
+            rd += io.get("rchar", 0)
+            wr += io.get("wchar", 0)
+        except OSError:
+            # Not readable for processes we did not start (eg adopted setuid)
+            pass
+    sample.rss, sample.pss, sample.cpu_time, sample.read_bytes, sample.write_bytes = rss, pss, cpu, rd, wr
+    sample.fds = fds
+
+
+def sample_core(sample: Sample, rc):
+    stats = rc.call("core/stats", timeout=1.0)
+    sample.speed = stats.get("speed", 0)
+    sample.transfers = len(stats.get("transferring") or [])
+
+
+def sample_vfs(sample: Sample, mount):
+    vfs = mount.rc.call("vfs/stats", timeout=1.0, **mount.vfs_params())
+    cache = vfs.get("diskCache", {})
+    sample.cache_bytes = cache.get("bytesUsed")
+    sample.uploads_queued = cache.get("uploadsQueued")
+    sample.uploads_in_progress = cache.get("uploadsInProgress")
+
+
+def add_rates(sample: Sample, prev: Optional[Sample]):
+    if prev is None or sample.cpu_time is None or prev.cpu_time is None:
+        return
+    dt = sample.time - prev.time
+    if dt <= 0:
+        return
+    sample.cpu_percent = 100.0 * max(0.0, sample.cpu_time - prev.cpu_time) / dt
+    sample.read_rate = max(0, sample.read_bytes - prev.read_bytes) / dt
+    sample.write_rate = max(0, sample.write_bytes - prev.write_bytes) / dt
+
+
+def format_size(n: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024:
+            return "{:.1f} {}".format(n, unit) if unit != "B" else "{:.0f} B".format(n)
+        n /= 1024
+    return "{:.1f} TiB".format(n)
+
+
+def describe(sample: Sample) -> str:
+    parts = []
+    if sample.rss is not None:
+        parts.append("{} RSS".format(format_size(sample.rss)))
+    if sample.cpu_percent is not None:
+        parts.append("{:.0f}% CPU".format(sample.cpu_percent))
+    if sample.speed is not None:
+        parts.append("{}/s".format(format_size(sample.speed)))
+    elif sample.read_rate is not None:
+        parts.append("{}/s in, {}/s out".format(format_size(sample.read_rate), format_size(sample.write_rate)))
+    if sample.transfers:
+        parts.append("{} transfers".format(sample.transfers))
+    if sample.cache_bytes is not None:
+        parts.append("{} cached".format(format_size(sample.cache_bytes)))
+    return ", ".join(parts)
+
+
+class MetricsCollector:
+    def __init__(self, engine, interval: float = DEFAULT_INTERVAL) -> None:
+        self.engine = engine
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.menu_open = False
+        self.samples: Dict[str, Sample] = {}
+        self.listeners: List[Callable[[Dict[str, Sample]], None]] = []
+        self.thread = threading.Thread(target=self.run, name="metrics", daemon=True)
+        self.thread.start()
+        engine.add_listener(self.engine_event)
+
+    def add_listener(self, listener: Callable[[Dict[str, Sample]], None]):
+        self.listeners.append(listener)
+
+    def engine_event(self, event: str, name: str, detail: str):
+        if event in ("mounted", "unmounted", "died"):
+            self.wake()
+
+    def set_menu_open(self, menu_open: bool):
+        self.menu_open = menu_open
+        self.wake()
+
+    def set_interval(self, interval: float):
+        self.interval = max(0.1, float(interval))
+        self.wake()
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
+
+    def active(self) -> bool:
+        # Busy drives count too. A failed unmount puts the drive back without an event.
+        return self.menu_open or len(self.engine.mounted) != 0 or len(self.engine.busy) != 0
+
+    def run(self):
+        while True:
+            with self.cond:
+                if self.active():
+                    self.cond.wait(self.interval)
+                else:
+                    self.cond.wait()
+            # Runs once more after the last unmount to clear out samples
+            try:
+                self.collect()
+            except:
+                traceback.print_exc()
+
+    def collect(self):
+        with self.engine.lock:
+            mounts = list(self.engine.mounted.values())
+        samples = {}
+        for mount in mounts:
+            sample = Sample(mount.name)
+            try:
+                if mount.rcd is not None:
+                    # Shared process. Report process and transfer stats once.
+                    if RCD_SAMPLE not in samples:
+                        samples[RCD_SAMPLE] = Sample(RCD_SAMPLE)
+                        if mount.proc is not None:
+                            sample_process(samples[RCD_SAMPLE], mount.proc.pid)
+                        sample_core(samples[RCD_SAMPLE], mount.rc)
+                else:
+                    sample_process(sample, mount.proc.pid)
+                    if mount.rc is not None:
+                        sample_core(sample, mount.rc)
+                if mount.rc is not None:
+                    sample_vfs(sample, mount)
+            except RcError:
+                pass
+            samples[mount.name] = sample
+        for name, sample in samples.items():
+            add_rates(sample, self.samples.get(name))
+        self.samples = samples
+        for listener in self.listeners:
+            try:
+                listener(samples)
+            except:
+                traceback.print_exc()
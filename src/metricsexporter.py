@@ -0,0 +1,100 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+from metrics import MetricsCollector, Sample
+
+
+# Prometheus text exporter for MetricsCollector samples. Only imported when
+# metrics_port is set.
+
+
+PROMETHEUS_METRICS = [
+    ("rss", "rclone_drive_rss_bytes", "gauge", "Resident memory of the rclone process"),
+    ("pss", "rclone_drive_pss_bytes", "gauge", "Proportional memory of the rclone process"),
+    ("cpu_time", "rclone_drive_cpu_seconds_total", "counter", "CPU time used by the rclone process"),
+    ("fds", "rclone_drive_open_fds", "gauge", "Open file descriptors of the rclone process"),
+    ("read_rate", "rclone_drive_read_bytes_per_second", "gauge", "Bytes read by the rclone process per second"),
+    ("write_rate", "rclone_drive_write_bytes_per_second", "gauge", "Bytes written by the rclone process per second"),
+    ("speed", "rclone_drive_transfer_bytes_per_second", "gauge", "Transfer speed reported by rclone"),
+    ("transfers", "rclone_drive_transfers_in_flight", "gauge", "Transfers in progress"),
+    ("cache_bytes", "rclone_drive_vfs_cache_bytes", "gauge", "VFS disk cache usage"),
+    ("uploads_queued", "rclone_drive_vfs_uploads_queued", "gauge", "VFS uploads waiting"),
+    ("uploads_in_progress", "rclone_drive_vfs_uploads_in_progress", "gauge", "VFS uploads in progress"),
+]
+
+
+def prometheus_text(samples: Dict[str, Sample]) -> str:
+    lines = []
+    for field, metric, kind, help_text in PROMETHEUS_METRICS:
+        values = [(name, getattr(s, field)) for name, s in sorted(samples.items()) if getattr(s, field) is not None]
+        if len(values) == 0:
+            continue
+        lines.append("# HELP {} {}".format(metric, help_text))
+        lines.append("# TYPE {} {}".format(metric, kind))
+        for name, value in values:
+            label = name.replace("\\", "\\\\").replace("\"", "\\\"")
+            lines.append("{}{{remote=\"{}\"}} {}".format(metric, label, value))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text(self.server.collector.samples).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    # Prometheus text endpoint on localhost only (http://127.0.0.1:port/metrics)
+
+    def __init__(self, collector: MetricsCollector, port: int) -> None:
+        self.port = port
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        self.server.collector = collector
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,244 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+from metrics import format_size
+from rc import MOUNT_OPTS, VFS_OPTS
+
+
+# Throughput benchmark for a mounted drive and mount args suggested from it.
+# Works on any directory, so it can be tried on a plain directory or a mount
+# of rclone's local backend:
+#   python3 mountbench.py ~/OneDrive --size 64 --args "--vfs-cache-mode writes"
+#
+# Reads drop the kernel page cache of the file first, but data still in
+# rclone's own VFS cache is read from there. Results are best compared
+# between runs of the same drive.
+
+
+DEFAULT_SIZE = 32 << 20
+BLOCK = 1 << 20
+RANDOM_BLOCK = 64 << 10
+RANDOM_OPS = 64
+SMALL_FILES = 50
+HISTORY = 10  # Results kept per remote
+
+# Flags set by suggest(). Any existing values are replaced.
+TUNED_FLAGS = ("--vfs-cache-mode", "--buffer-size", "--vfs-read-ahead", "--vfs-read-chunk-size",
+               "--dir-cache-time", "--transfers")
+
+
+def drop_cache(fd: int):
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError):
+        pass
+
+
+def seq_write(path: str, size: int) -> float:
+    block = os.urandom(BLOCK)
+    start = time.perf_counter()
+    with open(path, "wb") as f:
+        for _ in range(size // BLOCK):
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    return size / (time.perf_counter() - start)
+
+
+def seq_read(path: str) -> Dict[str, float]:
+    with open(path, "rb") as f:
+        drop_cache(f.fileno())
+        start = time.perf_counter()
+        f.read(1)
+        first_byte = time.perf_counter() - start
+        total = 1
+        while True:
+            data = f.read(BLOCK)
+            if not data:
+                break
+            total += len(data)
+    return {"seq_read": total / (time.perf_counter() - start), "first_byte": first_byte}
+
+
+def random_io(path: str, size: int, write: bool) -> float:
+    rng = random.Random(1)
+    offsets = [rng.randrange(0, max(1, size - RANDOM_BLOCK)) for _ in range(RANDOM_OPS)]
+    block = os.urandom(RANDOM_BLOCK)
+    with open(path, "r+b" if write else "rb") as f:
+        drop_cache(f.fileno())
+        start = time.perf_counter()
+        for offset in offsets:
+            f.seek(offset)
+            if write:
+                f.write(block)
+            else:
+                f.read(RANDOM_BLOCK)
+        if write:
+            f.flush()
+            os.fsync(f.fileno())
+    return RANDOM_OPS * RANDOM_BLOCK / (time.perf_counter() - start)
+
+
+def metadata(folder: str) -> float:
+    # Create, stat, list and delete small files. Returns operations / s.
+    os.mkdir(folder)
+    start = time.perf_counter()
+    for i in range(SMALL_FILES):
+        with open(os.path.join(folder, "f{}".format(i)), "wb") as f:
+            f.write(b"x" * 1024)
+    for i in range(SMALL_FILES):
+        os.stat(os.path.join(folder, "f{}".format(i)))
+    os.listdir(folder)
+    for i in range(SMALL_FILES):
+        os.unlink(os.path.join(folder, "f{}".format(i)))
+    os.rmdir(folder)
+    return (3 * SMALL_FILES + 1) / (time.perf_counter() - start)
+
+
+def run(mountpoint: str, size: int = DEFAULT_SIZE) -> Dict:
+    # Returns bytes / s for seq_write, seq_read, rand_read, rand_write,
+    # operations / s for metadata and seconds for first_byte. A workload that
+    # fails (eg random writes without a VFS cache mode) is left out and its
+    # error is listed in "errors".
+    size = max(BLOCK, size - size % BLOCK)
+    folder = tempfile.mkdtemp(prefix=".rclone-drive-manager-bench-", dir=mountpoint)
+    try:
+        path = os.path.join(folder, "data")
+        results = {"time": time.time(), "size": size, "errors": {}}
+        workloads = [
+            ("seq_write", lambda: {"seq_write": seq_write(path, size)}),
+            ("seq_read", lambda: seq_read(path)),
+            ("rand_read", lambda: {"rand_read": random_io(path, size, False)}),
+            ("rand_write", lambda: {"rand_write": random_io(path, size, True)}),
+            ("metadata", lambda: {"metadata": metadata(os.path.join(folder, "small"))}),
+        ]
+        for name, workload in workloads:
+            try:
+                results.update(workload())
+            except OSError as e:
+                results["errors"][name] = e.strerror or str(e)
+        return results
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def describe(results: Dict) -> str:
+    errors = results.get("errors", {})
+    lines = []
+    for key, label in (("seq_write", "Sequential write"), ("seq_read", "Sequential read"),
+                       ("rand_read", "Random read"), ("rand_write", "Random write"), ("metadata", "Metadata")):
+        if key in errors:
+            lines.append("{}: failed ({})".format(label, errors[key]))
+        elif key == "metadata":
+            lines.append("{}: {:.0f} operations/s".format(label, results[key]))
+        elif key == "seq_read":
+            lines.append("{}: {}/s (first byte after {:.0f} ms)".format(label, format_size(results[key]),
+                                                                      results["first_byte"] * 1000))
+        else:
+            lines.append("{}: {}/s".format(label, format_size(results[key])))
+    return "\n".join(lines)
+
+
+def suggest(results: Dict, mount_args: str, rcd: bool = False) -> str:
+    # Returns mount_args with the tuned flags replaced. With rcd, only flags a
+    # mount of a shared rcd accepts are suggested.
+    tuned = {}
+    errors = results.get("errors", {})
+    slow_start = results.get("first_byte", 0) > 0.1
+    slow_random = "rand_read" in results and "seq_read" in results and results["rand_read"] < 0.25 * results["seq_read"]
+    slow_write = "seq_write" in results and "seq_read" in results and results["seq_write"] < 0.5 * results["seq_read"]
+    if slow_start or slow_random:
+        # Latency bound remote. Cache whole files and read ahead further.
+        tuned["--vfs-cache-mode"] = "full"
+        tuned["--vfs-read-ahead"] = "256M"
+        tuned["--buffer-size"] = "32M"
+        tuned["--vfs-read-chunk-size"] = "32M"
+    elif slow_write or "rand_write" in errors:
+        # Slow uploads, or random writes need a cache. Let writes complete to the local cache.
+        tuned["--vfs-cache-mode"] = "writes"
+        tuned["--buffer-size"] = "16M"
+    else:
+        tuned["--buffer-size"] = "16M"
+    if results.get("metadata", 50) < 50:
+        # Slow listings and small file uploads
+        tuned["--dir-cache-time"] = "5m"
+        tuned["--transfers"] = "8"
+    if rcd:
+        tuned = {flag: value for flag, value in tuned.items() if flag in VFS_OPTS or flag in MOUNT_OPTS}
+    # Group each flag with its value, keeping one flag per line
+    groups = []
+    for arg in str(mount_args).split():
+        if arg.startswith("-") or len(groups) == 0:
+            groups.append([arg])
+        else:
+            groups[-1].append(arg)
+    kept = [" ".join(group) for group in groups if group[0].partition("=")[0] not in tuned]
+    return "\n".join(kept + ["{} {}".format(flag, tuned[flag]) for flag in TUNED_FLAGS if flag in tuned])
+
+
+def load_results(path: str) -> Dict[str, List[Dict[str, float]]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_results(path: str, name: str, results: Dict[str, float]):
+    history = load_results(path)
+    history[name] = (history.get(name, []) + [results])[-HISTORY:]
+    with open(path, "w") as f:
+        json.dump(history, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a mounted drive (or any directory)")
+    parser.add_argument("path")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE >> 20, help="Test file size in MiB")
+    parser.add_argument("--args", default="", help="Current mount args, to suggest tuned ones")
+    parser.add_argument("--rcd", action="store_true", help="Only suggest args supported by the rcd backend")
+    args = parser.parse_args()
+    results = run(args.path, args.size << 20)
+    print(describe(results))
+    print("\nSuggested mount args:\n{}".format(suggest(results, args.args, args.rcd)))
+
+
+if __name__ == "__main__":
+    main()
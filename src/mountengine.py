@@ -0,0 +1,692 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import errno
+import os
+import shutil
+import subprocess
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import adopt
+import mountinfo
+import remotes
+import tracing
+from adopt import AdoptedProcess
+from config import Config, RemoteConfig
+import uploads
+from mountlog import DEFAULT_LINES, DEFAULT_MAX_BYTES, LogReader, MountLog, default_log_dir
+from procwatch import ProcessWatcher
+from rc import RC_USER, RcClient, RcDaemon, RcError, free_port, new_password
+
+
+# Mount / unmount engine. This is deliberately Qt free. Work runs on a pool of
+# worker threads so the tray's event loop never blocks on rclone or umount.
+# Two backends exist: "process" runs one rclone mount process per drive and
+# "rcd" hosts all mounts in a single rclone rcd via the rc API.
+# Listeners are called from worker threads as listener(event, name, detail)
+# with event being one of:
+#   mounting, mounted, mount_failed, unmounting, draining, unmounted, unmount_failed, died, idle
+# "draining" is sent while an unmount waits for pending uploads, with a
+# progress text as detail (see uploads.py).
+# Each rclone mount process writes its output to <log_dir>/<remote>.log,
+# which outlives the app, and the last lines are kept in a MountLog (see
+# log_tail).
+# Mounting a remote whose mountpoint is already served by a running rclone
+# mount of it (eg left over from before the app restarted) adopts that
+# process instead (see adopt.py). Dead FUSE mounts are cleaned up first.
+# A drive unmounted for being idle (see idle.py) is in the "idle" state until
+# it is mounted again.
+
+
+DEFAULT_MAX_PARALLEL = 4
+DEFAULT_SHUTDOWN_TIMEOUT = 5.0
+LOG_DRAIN_TIMEOUT = 0.5  # Wait for the last output of an exited process
+DEFAULT_UPLOAD_TIMEOUT = 60.0
+UNMOUNT_RESERVE = 1.0  # Time kept for the unmount itself when draining uploads
+
+
+class MountError(Exception):
+    pass
+
+
+class Mount:
+    __slots__ = ("name", "mountpoint", "proc", "ready_time", "rcd", "rc")
+
+    def __init__(self, name: str, mountpoint: str, proc: Optional[subprocess.Popen],
+                 ready_time: float = 0.0, rcd: Optional[RcDaemon] = None, rc: Optional[RcClient] = None):
+        self.name = name
+        self.mountpoint = mountpoint
+        self.proc = proc  # rclone process (shared rcd in rcd mode, None for external rcd)
+        self.ready_time = ready_time  # Seconds from spawn until the mount appeared
+        self.rcd = rcd
+        self.rc = rc  # rc API of the process serving this mount, if any
+
+    def vfs_params(self) -> Dict:
+        # vfs/* rc calls must name the remote when the rcd serves several
+        return {"fs": "{}:/".format(self.name)} if self.rcd is not None else {}
+
+
+class MountEngine:
+    def __init__(self, max_parallel: int = DEFAULT_MAX_PARALLEL) -> None:
+        self.lock = threading.RLock()
+        self.mounted: Dict[str, Mount] = {}
+        self.busy: Dict[str, str] = {}  # name: "mounting" or "unmounting"
+        self.idle: Set[str] = set()
+        self.listeners: List[Callable[[str, str, str], None]] = []
+        self.futures: List[Tuple[str, Future]] = []  # name, job
+        self.max_parallel = max(1, int(max_parallel))
+        self.pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="mount")
+        self.watcher = ProcessWatcher()
+        self.rcd: Optional[RcDaemon] = None
+        self.daemons: List[RcDaemon] = []
+        self.mount_rc = False
+        self.log_reader = LogReader()
+        self.logs: Dict[str, MountLog] = {}  # name: output of the last mount
+        self.log_lines = DEFAULT_LINES
+        self.log_dir = default_log_dir()
+        self.log_max_bytes = DEFAULT_MAX_BYTES
+        self.arg_providers: List[Callable[[RemoteConfig], List[str]]] = []
+        self.command_prefixes: List[Callable[[RemoteConfig], List[str]]] = []
+        self.upload_timeout = DEFAULT_UPLOAD_TIMEOUT
+        self.closing: Optional[Tuple[float, bool]] = None  # (deadline, force) once unmount_all was called
+
+    def add_listener(self, listener: Callable[[str, str, str], None]):
+        self.listeners.append(listener)
+
+    def add_arg_provider(self, provider: Callable[[RemoteConfig], List[str]]):
+        # provider(remote) returns extra rclone mount args. Called on a worker
+        # right before each mount.
+        self.arg_providers.append(provider)
+
+    def add_command_prefix(self, provider: Callable[[RemoteConfig], List[str]]):
+        # provider(remote) returns a command (eg a limit wrapper) that runs
+        # rclone mount. Process backend only.
+        self.command_prefixes.append(provider)
+
+    def emit(self, event: str, name: str, detail: str = ""):
+        for listener in self.listeners:
+            try:
+                listener(event, name, detail)
+            except:
+                traceback.print_exc()
+
+    def set_max_parallel(self, max_parallel: int):
+        max_parallel = max(1, int(max_parallel))
+        if max_parallel == self.max_parallel:
+            return
+        with self.lock:
+            # Jobs already queued on the old pool still run there
+            self.pool.shutdown(wait=False)
+            self.max_parallel = max_parallel
+            self.pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="mount")
+
+    def apply_config(self, config: Config):
+        self.set_max_parallel(config.setting("max_parallel", DEFAULT_MAX_PARALLEL))
+        self.set_backend(config.setting("backend", "process"), config.setting("rcd_url", ""),
+                         config.setting("mount_rc", False))
+        with self.lock:
+            self.idle.intersection_update(config.remotes)
+        self.log_lines = config.setting("log_lines", DEFAULT_LINES)
+        self.log_dir = os.path.expanduser(config.setting("log_dir", "")) or default_log_dir()
+        self.log_max_bytes = config.setting("log_max_bytes", DEFAULT_MAX_BYTES)
+        self.upload_timeout = float(config.setting("upload_timeout", DEFAULT_UPLOAD_TIMEOUT))
+
+    def set_backend(self, backend: str, rcd_url: str = "", mount_rc: bool = False):
+        # Existing mounts keep the backend they were mounted with. mount_rc
+        # gives each rclone mount process its own rc API (process backend).
+        with self.lock:
+            self.mount_rc = mount_rc
+            if backend != "rcd":
+                self.rcd = None
+            elif self.rcd is None or self.rcd.url != rcd_url:
+                self.rcd = RcDaemon(rcd_url)
+                self.daemons.append(self.rcd)
+                if rcd_url == "":
+                    self.adopt_rcd(self.rcd)
+
+    def adopt_rcd(self, rcd: RcDaemon):
+        # An rcd left running by a previous run still serves its mounts
+        running = adopt.find_rcd()
+        if running is None:
+            return
+        proc, client = running
+        try:
+            client.call("rc/noop", timeout=1.0)
+        except RcError:
+            return
+        print("Adopted running rclone rcd (pid {})".format(proc.pid))
+        rcd.adopt(proc, client)
+
+    def state(self, name: str) -> str:
+        with self.lock:
+            if name in self.busy:
+                return self.busy[name]
+            if name in self.mounted:
+                return "mounted"
+            if name in self.idle:
+                return "idle"
+            return "unmounted"
+
+    def is_busy(self, name: str) -> bool:
+        with self.lock:
+            return name in self.busy
+
+    def submit(self, name: str, state: str, fn, *args, pool: Optional[ThreadPoolExecutor] = None) -> Optional[Future]:
+        with self.lock:
+            if name in self.busy:
+                return None
+            self.busy[name] = state
+        # Before the job can start, or its final event could arrive first.
+        # Outside the lock since listeners take their own.
+        self.emit(state, name)
+        with self.lock:
+            fut = (pool or self.pool).submit(self.run_job, name, state, time.perf_counter(), fn, *args)
+            self.futures = [(n, f) for n, f in self.futures if not f.done()]
+            self.futures.append((name, fut))
+        return fut
+
+    def run_job(self, name: str, state: str, submitted: float, fn, *args) -> bool:
+        try:
+            queued = (time.perf_counter() - submitted) * 1000
+            with tracing.span(state, remote=name, queued_ms=queued):
+                return fn(name, *args)
+        finally:
+            with self.lock:
+                self.busy.pop(name, None)
+
+    def mount(self, remote: RemoteConfig) -> Optional[Future]:
+        name = remote.remote_name
+        with self.lock:
+            if name in self.mounted:
+                return None
+        return self.submit(name, "mounting", self.do_mount, remote.copy())
+
+    def adopt_running(self, config: Config) -> List[Future]:
+        # Adopt the rclone mounts that are still running for configured remotes
+        # (and clean up stale mounts). Anything not mounted is left alone.
+        mounts = mountinfo.read_mounts() if mountinfo.available() else None
+        # Mounts of an external or adopted rcd (not always in the mount table, eg rcstub.py)
+        rcd_mounts = set()
+        rcd = self.rcd
+        if rcd is not None and rcd.client is not None:
+            try:
+                rcd_mounts = {os.path.realpath(m.get("MountPoint", "")) for m in rcd.listmounts()}
+            except RcError:
+                pass
+        running = adopt.find_mounts() if mounts is not None else {}
+        remotes = []
+        for remote in config.remotes.values():
+            mountpoint = os.path.expandvars(os.path.expanduser(remote.mount_point))
+            real = os.path.realpath(mountpoint)
+            if real in rcd_mounts or (real in running and running[real].remote == remote.remote_name):
+                remotes.append(remote)
+            elif mounts is not None and mountinfo.is_mounted(mountpoint, mounts):
+                try:
+                    stale = self.is_stale(mountpoint)
+                except OSError:
+                    continue
+                if stale:
+                    # Only cleaned up. Mounting it again is up to the user.
+                    print("Removing stale mount on {}".format(mountpoint))
+                    self.detach(mountpoint)
+        return self.mount_many(remotes)
+
+    def unmount(self, name: str, force: bool = False) -> Optional[Future]:
+        with self.lock:
+            if name not in self.mounted:
+                # Unmounting an idle drive keeps it from being remounted
+                if name in self.idle:
+                    self.idle.discard(name)
+                    self.emit("unmounted", name)
+                return None
+        return self.submit(name, "unmounting", self.do_unmount, force, None)
+
+    def unmount_idle(self, name: str) -> Optional[Future]:
+        # Clean unmount only. If the drive is busy it just stays mounted.
+        with self.lock:
+            if name not in self.mounted:
+                return None
+        return self.submit(name, "unmounting", self.do_unmount, False, None, True)
+
+    def unmount_quietly(self, name: str) -> Optional[Future]:
+        # Clean unmount without an unmount_failed event (eg a restart by the
+        # watchdog). The future's result tells if it worked.
+        with self.lock:
+            if name not in self.mounted:
+                return None
+        return self.submit(name, "unmounting", self.do_unmount, False, None, False, True)
+
+    def mount_many(self, remotes: List[RemoteConfig]) -> List[Future]:
+        futures = [self.mount(remote) for remote in remotes]
+        return [f for f in futures if f is not None]
+
+    def unmount_many(self, names: List[str], force: bool = False) -> List[Future]:
+        futures = [self.unmount(name, force) for name in names]
+        return [f for f in futures if f is not None]
+
+    def unmount_all(self, timeout: float = DEFAULT_SHUTDOWN_TIMEOUT, force: bool = False) -> List[str]:
+        # Unmount everything at once (not limited by max_parallel) with one
+        # overall deadline when quitting. Returns names that are still mounted.
+        # From now on queued mounts are skipped and mounts still in progress
+        # are unmounted by their own job as soon as they finish.
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.closing = (deadline, force)
+            names = [name for name in self.mounted if name not in self.busy]
+            # Drop mounts that haven't started yet
+            cancelled = [name for name, fut in self.futures if not fut.done() and fut.cancel()]
+            for name in cancelled:
+                self.busy.pop(name, None)
+            running = [fut for name, fut in self.futures if not fut.cancelled()]
+        for name in cancelled:
+            self.emit("unmounted", name)
+        pool = ThreadPoolExecutor(max_workers=max(1, len(names)), thread_name_prefix="unmount")
+        futures = [self.submit(name, "unmounting", self.do_unmount, force, deadline, pool=pool) for name in names]
+        # Jobs stop retrying at the deadline. Allow a little extra for force kills.
+        wait([f for f in futures if f is not None] + running, max(0, deadline - time.monotonic()) + 0.5)
+        pool.shutdown(wait=False)
+        with self.lock:
+            return sorted(set(self.mounted) | set(self.busy))
+
+    def abort_close(self):
+        # Quitting was cancelled after unmount_all. Mounts work again.
+        with self.lock:
+            self.closing = None
+
+    def wait_idle(self, timeout: Optional[float] = None):
+        with self.lock:
+            futures = [fut for name, fut in self.futures]
+        end = None if timeout is None else time.monotonic() + timeout
+        for fut in futures:
+            try:
+                fut.result(None if end is None else max(0, end - time.monotonic()))
+            except:
+                pass
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        for rcd in self.daemons:
+            rcd.stop()
+
+    def open_log(self, name: str) -> MountLog:
+        path = os.path.join(self.log_dir, "{}.log".format(name))
+        log = MountLog(name, self.log_lines, path, self.log_max_bytes)
+        with self.lock:
+            old = self.logs.get(name)
+            self.logs[name] = log
+        if old is not None:
+            self.log_reader.detach(old)
+        return log
+
+    def reopen_log(self, name: str):
+        # An adopted rclone process still writes to the log file of the run
+        # which started it. Continue tailing that from its current end.
+        log = self.open_log(name)
+        try:
+            offset = os.path.getsize(log.path)
+        except OSError:
+            return
+        self.log_reader.attach(log, offset)
+
+    def log_tail(self, name: str, n: Optional[int] = None) -> List[str]:
+        with self.lock:
+            log = self.logs.get(name)
+        return log.tail(n) if log is not None else []
+
+    def drain_log(self, name: str):
+        # Stops tailing once rclone is done with the log file
+        with self.lock:
+            log = self.logs.get(name)
+        if log is not None:
+            self.log_reader.detach(log)
+            log.closed.wait(LOG_DRAIN_TIMEOUT)
+
+    def process_exited(self, mount: Mount):
+        # Exits of processes being unmounted are expected (no longer in mounted)
+        with self.lock:
+            if self.mounted.get(mount.name) is not mount:
+                return
+            del self.mounted[mount.name]
+        tracing.instant("died", remote=mount.name)
+        self.remove_mountpoint(mount.mountpoint)
+        if mount.rcd is None:
+            self.drain_log(mount.name)
+        # Exit code of adopted processes is unknown
+        if mount.proc is None or isinstance(mount.proc, AdoptedProcess):
+            self.emit("died", mount.name, "")
+        else:
+            self.emit("died", mount.name, str(mount.proc.returncode))
+
+    def remove_mountpoint(self, mountpoint: str):
+        # Remove mount dir when unmounted (only if empty to prevent accidental data loss)
+        try:
+            os.rmdir(mountpoint)
+        except:
+            traceback.print_exc()
+
+    def do_mount(self, name: str, remote: RemoteConfig) -> bool:
+        if self.closing is not None:
+            # Queued before quitting
+            self.emit("unmounted", name)
+            return False
+        try:
+            mount = self.start_mount(remote)
+        except MountError as e:
+            self.emit("mount_failed", name, str(e))
+            return False
+        except Exception as e:
+            traceback.print_exc()
+            self.emit("mount_failed", name, "{} occurred with message {}.".format(type(e).__name__, str(e)))
+            return False
+        with self.lock:
+            self.mounted[name] = mount
+            self.idle.discard(name)
+        self.emit("mounted", name)
+        if mount.proc is not None:
+            self.watcher.watch(mount.proc, lambda proc: self.process_exited(mount))
+        closing = self.closing
+        if closing is not None:
+            # Finished while quitting
+            self.do_unmount(name, closing[1], closing[0])
+            return False
+        return True
+
+    def start_mount(self, remote: RemoteConfig) -> Mount:
+        name = remote.remote_name
+        mountpoint = remote.mount_point
+        mount_args = remote.mount_args
+        timeout = remote.mount_timeout
+        if mountpoint == "":
+            raise MountError("No mountpoint was specified.")
+        # An external rcd has its own rclone config
+        rcd = self.rcd
+        if rcd is None or rcd.url == "":
+            with tracing.span("check remote", remote=name):
+                error = remotes.catalog.check(name, mount_args)
+            if error is not None:
+                raise MountError(error)
+        mountpoint = os.path.expandvars(os.path.expanduser(mountpoint))
+        with tracing.span("prepare mountpoint", remote=name):
+            if rcd is not None:
+                mount = self.adopt_rcd_mount(rcd, name, mountpoint)
+                if mount is not None:
+                    return mount
+            if mountinfo.available():
+                existing = mountinfo.find(mountpoint)
+                if existing is not None:
+                    mount = self.adopt_mount(name, mountpoint)
+                    if mount is not None:
+                        return mount
+            if not os.path.exists(mountpoint):
+                os.makedirs(mountpoint)
+            if not os.path.exists(mountpoint):
+                raise MountError("Mountpoint does not exist and could not be created.")
+            if not os.path.isdir(mountpoint):
+                raise MountError("Mountpoint exists, but is not a directory.")
+            if len(os.listdir(mountpoint)) != 0:
+                raise MountError("Mountpoint exists, but is a non-empty directory.")
+
+        with tracing.span("mount args", remote=name):
+            extra = [arg for provider in self.arg_providers for arg in provider(remote)]
+            if len(extra) != 0:
+                mount_args = " ".join([str(mount_args)] + extra)
+
+        if rcd is not None:
+            start = time.monotonic()
+            try:
+                with tracing.span("rcd mount", remote=name):
+                    rcd.mount(name, mountpoint, mount_args, timeout)
+            except (ValueError, RcError) as e:
+                raise MountError(str(e))
+            ready_time = time.monotonic() - start
+            print("Mounted {} in {:.3f}s (rcd)".format(name, ready_time))
+            return Mount(name, mountpoint, rcd.proc, ready_time, rcd, rcd.client)
+
+        args = [arg for provider in self.command_prefixes for arg in provider(remote)]
+        args.append("systemd-inhibit")   # Mounted remotes cause some systems to lockup on sleep
+        args.append("rclone")
+        args.append("mount")
+        args.extend(str(mount_args).split())
+        rc = None
+        env = None
+        if self.mount_rc:
+            port = free_port()
+            user = RC_USER
+            password = new_password()
+            args.extend(["--rc", "--rc-addr", "127.0.0.1:{}".format(port), "--rc-user", user])
+            rc = RcClient("http://127.0.0.1:{}/".format(port), user, password)
+            # Not on the command line, which any local user can read
+            env = dict(os.environ, RCLONE_RC_PASS=password)
+        args.append("{}:/".format(name))
+        args.append("{}".format(mountpoint))
+
+        print(" ".join(args))
+        start = time.monotonic()
+        with tracing.span("spawn", remote=name):
+            log = self.open_log(name)
+            # A file rather than a pipe: rclone would die writing to a pipe
+            # nobody reads any more, leaving a dead mount if the app crashes.
+            try:
+                out, offset = log.open_output()
+            except OSError as e:
+                raise MountError("Can't open log file {}: {}".format(log.path, e.strerror))
+            with out:
+                p = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT, env=env)
+            self.log_reader.attach(log, offset)
+
+        if not mountinfo.available():
+            # Can't see the mount table. Show mount failed if process dies
+            # immediately (within 100ms). This only sleeps on a worker thread.
+            while time.monotonic() - start < 0.1:
+                if p.poll() is not None:
+                    self.drain_log(name)
+                    raise MountError("Rclone exited with error code {}.".format(p.poll()))
+                time.sleep(0.01)
+            return Mount(name, mountpoint, p, rc=rc)
+
+        with tracing.span("wait for mount", remote=name):
+            ready = mountinfo.wait_for_mount(mountpoint, timeout, p)
+        if not ready:
+            if p.poll() is not None:
+                self.drain_log(name)
+                raise MountError("Rclone exited with error code {}.".format(p.poll()))
+            self.kill(p)
+            self.drain_log(name)
+            raise MountError("Drive was not mounted within {} seconds.".format(timeout))
+        ready_time = time.monotonic() - start
+        print("Mounted {} in {:.3f}s".format(name, ready_time))
+        if tracing.tracer.enabled:
+            # First request answered by rclone through FUSE
+            with tracing.span("first response", remote=name):
+                try:
+                    os.stat(mountpoint)
+                except OSError:
+                    pass
+        return Mount(name, mountpoint, p, ready_time, rc=rc)
+
+    def adopt_rcd_mount(self, rcd: RcDaemon, name: str, mountpoint: str) -> Optional[Mount]:
+        # Mounts of an rcd outlive the app (external rcd_url, or an adopted rcd)
+        if rcd.client is None:
+            return None
+        try:
+            mounts = rcd.listmounts()
+        except RcError:
+            return None
+        for entry in mounts:
+            if os.path.realpath(entry.get("MountPoint", "")) != os.path.realpath(mountpoint):
+                continue
+            remote = str(entry.get("Fs", "")).partition(":")[0]
+            if remote != name:
+                raise MountError("Mountpoint is in use by an rcd mount of {}.".format(remote))
+            print("Adopted rcd mount of {}".format(name))
+            return Mount(name, mountpoint, rcd.proc, rcd=rcd, rc=rcd.client)
+        return None
+
+    def adopt_mount(self, name: str, mountpoint: str) -> Optional[Mount]:
+        # Something is mounted on mountpoint already. Returns None if it was a
+        # stale mount which has been removed.
+        running = adopt.find_mounts().get(os.path.realpath(mountpoint))
+        if running is not None:
+            if running.remote != name:
+                raise MountError("Mountpoint is in use by an rclone mount of {}.".format(running.remote))
+            print("Adopted running mount of {} (pid {})".format(name, running.pid))
+            self.reopen_log(name)
+            return Mount(name, mountpoint, AdoptedProcess(running.pid, running.args), rc=running.rc)
+        if self.is_stale(mountpoint):
+            print("Removing stale mount on {}".format(mountpoint))
+            self.detach(mountpoint)
+            return None
+        raise MountError("Mountpoint is already in use by another mount.")
+
+    def is_stale(self, mountpoint: str) -> bool:
+        # FUSE mount whose process is gone
+        try:
+            os.stat(mountpoint)
+        except OSError as e:
+            if e.errno != errno.ENOTCONN:
+                raise
+            return True
+        return False
+
+    def do_unmount(self, name: str, force: bool, deadline: Optional[float], idle: bool = False,
+                   quiet: bool = False) -> bool:
+        # Don't report this process as died while unmounting it
+        with self.lock:
+            mount = self.mounted.pop(name, None)
+        if mount is None:
+            return True
+        proc = mount.proc
+
+        # If process is already dead, nothing left to unmount
+        if proc is not None and proc.poll() is not None:
+            if mount.rcd is None:
+                self.drain_log(name)
+            self.emit("unmounted", name)
+            return True
+
+        # Pending uploads would make the unmount fail (or be lost if forced)
+        if mount.rc is not None:
+            with tracing.span("drain uploads", remote=name):
+                self.drain_uploads(mount, deadline)
+
+        # Try clean unmount
+        # Try up to 3 times with 100ms delay between (fewer if deadline is hit)
+        ok = False
+        for i in range(3):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            with tracing.span("umount", remote=name, attempt=i + 1):
+                ok = self.try_unmount(mount, remaining)
+            if ok:
+                break
+            time.sleep(0.1)
+
+        # Force unmount if clean unmount failed
+        if not ok:
+            if force:
+                with tracing.span("force unmount", remote=name):
+                    self.force_unmount(mount)
+            else:
+                # Unmount failed. Add back to list
+                with self.lock:
+                    self.mounted[name] = mount
+                if not idle and not quiet:
+                    self.emit("unmount_failed", name, "Failed to cleanly unmount {}.".format(name))
+                # Exit while unmounting was ignored by the watcher
+                if proc is not None and proc.poll() is not None:
+                    self.process_exited(mount)
+                return False
+
+        self.remove_mountpoint(mount.mountpoint)
+        if mount.rcd is None:
+            # rclone logs until it exits after the unmount
+            if isinstance(proc, subprocess.Popen):
+                try:
+                    proc.wait(LOG_DRAIN_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    pass
+            self.drain_log(name)
+        self.emit("unmounted", name)
+        if idle:
+            with self.lock:
+                self.idle.add(name)
+            self.emit("idle", name)
+        return True
+
+    def drain_uploads(self, mount: Mount, deadline: Optional[float]):
+        drain_deadline = time.monotonic() + self.upload_timeout
+        if deadline is not None:
+            drain_deadline = min(drain_deadline, deadline - UNMOUNT_RESERVE)
+        try:
+            done = uploads.drain(mount.rc, mount.vfs_params(), drain_deadline,
+                                 lambda text: self.emit("draining", mount.name, text))
+        except RcError:
+            traceback.print_exc()
+            return
+        if not done:
+            print("Uploads of {} did not finish in time".format(mount.name))
+
+    def try_unmount(self, mount: Mount, timeout: Optional[float]) -> bool:
+        if mount.rcd is not None:
+            try:
+                mount.rcd.unmount(mount.mountpoint, timeout or 10.0)
+                return True
+            except RcError:
+                traceback.print_exc()
+                return False
+        try:
+            return subprocess.call(["umount", mount.mountpoint], timeout=timeout) == 0
+        except subprocess.TimeoutExpired:
+            return False
+
+    def force_unmount(self, mount: Mount):
+        if mount.rcd is not None:
+            # Can't kill the shared rcd for one drive. Detach the mount instead.
+            self.detach(mount.mountpoint)
+        else:
+            self.kill(mount.proc)
+
+    def detach(self, mountpoint: str):
+        # Lazy unmount. Gone from the tree now, cleaned up once no longer busy.
+        fusermount = shutil.which("fusermount3") or "fusermount"
+        subprocess.call([fusermount, "-uz", mountpoint])
+
+    def kill(self, proc: subprocess.Popen):
+        proc.terminate()
+        try:
+            proc.wait(0.3)
+        except subprocess.TimeoutExpired:
+            proc.kill()
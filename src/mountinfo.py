@@ -0,0 +1,116 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import re
+import select
+import subprocess
+import time
+from typing import List, Optional
+
+
+# Mount readiness detection. The kernel flags /proc/self/mountinfo with
+# POLLPRI whenever the mount table changes, so a mount can be waited on
+# without sleeping in a loop.
+
+
+MOUNTINFO = "/proc/self/mountinfo"
+
+
+def available() -> bool:
+    return os.path.exists(MOUNTINFO)
+
+
+def unescape(path: str) -> str:
+    # Spaces, tabs, newlines and backslashes are octal escaped (eg \040)
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), path)
+
+
+def parse(text: str) -> List[List[str]]:
+    # Returns [mountpoint, fstype, source] for each mount
+    mounts = []
+    for line in text.splitlines():
+        fields = line.split(" ")
+        if "-" not in fields:
+            continue
+        sep = fields.index("-")
+        mounts.append([unescape(fields[4]), fields[sep + 1], unescape(fields[sep + 2])])
+    return mounts
+
+
+def read_mounts() -> List[List[str]]:
+    with open(MOUNTINFO, "r") as f:
+        return parse(f.read())
+
+
+def find(mountpoint: str, mounts: Optional[List[List[str]]] = None) -> Optional[List[str]]:
+    # Last (topmost) mount on mountpoint
+    mountpoint = os.path.realpath(mountpoint)
+    if mounts is None:
+        mounts = read_mounts()
+    found = [m for m in mounts if m[0] == mountpoint]
+    return found[-1] if len(found) != 0 else None
+
+
+def is_mounted(mountpoint: str, mounts: Optional[List[List[str]]] = None) -> bool:
+    return find(mountpoint, mounts) is not None
+
+
+def wait_for_mount(mountpoint: str, timeout: float, proc: subprocess.Popen) -> bool:
+    # Returns True once mountpoint is mounted. False if timeout expires or proc
+    # exits first (check proc.poll() to tell them apart).
+    mountpoint = os.path.realpath(mountpoint)
+    deadline = time.monotonic() + timeout
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        pidfd = None
+    try:
+        with open(MOUNTINFO, "r") as f:
+            poller = select.poll()
+            poller.register(f.fileno(), select.POLLPRI | select.POLLERR)
+            if pidfd is not None:
+                poller.register(pidfd, select.POLLIN)
+            while True:
+                f.seek(0)
+                if is_mounted(mountpoint, parse(f.read())):
+                    return True
+                if proc.poll() is not None:
+                    return False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # Without a pidfd, wake up now and then to check the process
+                wait = remaining if pidfd is not None else min(remaining, 0.05)
+                poller.poll(wait * 1000)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
@@ -0,0 +1,271 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import collections
+import ctypes
+import os
+import selectors
+import shutil
+import struct
+import threading
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+
+# Captures the output of each rclone process. rclone writes to a log file
+# (<log_dir>/<remote>.log), not a pipe, so it keeps running if the app dies
+# (a write to a closed pipe would kill it). One thread tails all of the files
+# as data arrives, using inotify, and keeps the last lines of each in memory.
+# The tray never blocks on them and memory stays bounded no matter how much
+# rclone logs. Files are rotated once they reach max_bytes: copied to
+# <path>.1, then truncated. rclone appends, so it continues at the start.
+
+
+DEFAULT_LINES = 200
+DEFAULT_MAX_BYTES = 1024 * 1024
+MAX_LINE = 1024  # Longer lines are cut off
+READ_SIZE = 64 * 1024
+POLL_INTERVAL = 1.0  # Seconds between reads when inotify is not available
+IN_MODIFY = 0x2
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (then the name)
+
+
+def default_log_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "rclone-drive-manager", "logs")
+
+
+class MountLog:
+    def __init__(self, name: str, max_lines: int = DEFAULT_LINES, path: str = "",
+                 max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.name = name
+        self.lock = threading.Lock()
+        self.lines = collections.deque(maxlen=max(1, int(max_lines)))
+        self.partial = b""
+        self.skip = False  # Discarding the rest of an overlong line
+        self.path = path
+        self.max_bytes = max(1024, int(max_bytes))
+        self.closed = threading.Event()
+
+    def open_output(self):
+        # File for rclone's stdout / stderr (appending) and the offset to tail it from
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        out = open(self.path, "ab")
+        return out, out.tell()
+
+    def feed(self, data: bytes):
+        with self.lock:
+            lines = data.split(b"\n")
+            for i, line in enumerate(lines):
+                last = i == len(lines) - 1
+                if self.skip:
+                    self.skip = last
+                    continue
+                self.partial += line
+                if not last:
+                    self.add(self.partial)
+                    self.partial = b""
+                elif len(self.partial) > MAX_LINE:
+                    self.add(self.partial)
+                    self.partial = b""
+                    self.skip = True
+
+    def add(self, line: bytes):
+        self.lines.append(line[:MAX_LINE].decode("utf-8", "replace").rstrip("\r"))
+
+    def close(self):
+        with self.lock:
+            if self.partial != b"":
+                self.add(self.partial)
+                self.partial = b""
+        self.closed.set()
+
+    def tail(self, n: Optional[int] = None) -> List[str]:
+        with self.lock:
+            lines = list(self.lines)
+            if self.partial != b"":
+                lines.append(self.partial[:MAX_LINE].decode("utf-8", "replace"))
+        return lines if n is None else lines[max(0, len(lines) - n):]
+
+
+def inotify_init() -> Optional[int]:
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    return fd if fd >= 0 else None
+
+
+class Tail:
+    __slots__ = ("log", "file", "wd")
+
+    def __init__(self, log: MountLog, file, wd: int) -> None:
+        self.log = log
+        self.file = file
+        self.wd = wd
+
+
+class LogReader:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = os.pipe()
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.pending: List[Tuple[str, MountLog, int]] = []
+        self.thread = None
+        self.libc = None
+        self.inotify = inotify_init()
+        if self.inotify is not None:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            self.selector.register(self.inotify, selectors.EVENT_READ)
+        # Only touched by the reader thread
+        self.tails: Dict[MountLog, Tail] = {}
+        self.watches: Dict[int, List[Tail]] = {}  # wd: tails (one file may be tailed twice)
+
+    def attach(self, log: MountLog, offset: int):
+        # Tail log.path from offset
+        self.post("attach", log, offset)
+
+    def detach(self, log: MountLog):
+        # Reads what is left, then closes log
+        self.post("detach", log, 0)
+
+    def post(self, op: str, log: MountLog, offset: int):
+        with self.lock:
+            # Selector is only touched by the reader thread
+            self.pending.append((op, log, offset))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="logreader", daemon=True)
+                self.thread.start()
+        os.write(self.wake_w, b"\0")
+
+    def run(self):
+        while True:
+            polling = self.inotify is None and len(self.tails) != 0
+            for key, mask in self.selector.select(POLL_INTERVAL if polling else None):
+                try:
+                    if key.fd == self.wake_r:
+                        os.read(self.wake_r, 512)
+                        with self.lock:
+                            pending = self.pending
+                            self.pending = []
+                        for op, log, offset in pending:
+                            if op == "attach":
+                                self.start(log, offset)
+                            else:
+                                self.stop(log)
+                    else:
+                        self.inotify_events()
+                except:
+                    traceback.print_exc()
+            if polling:
+                for tail in list(self.tails.values()):
+                    self.read(tail)
+
+    def start(self, log: MountLog, offset: int):
+        if log in self.tails:
+            return
+        try:
+            file = open(log.path, "rb", buffering=0)
+            file.seek(offset)
+        except OSError:
+            traceback.print_exc()
+            log.close()
+            return
+        wd = -1
+        if self.inotify is not None:
+            wd = self.libc.inotify_add_watch(self.inotify, os.fsencode(log.path), IN_MODIFY)
+        tail = Tail(log, file, wd)
+        self.tails[log] = tail
+        if wd >= 0:
+            self.watches.setdefault(wd, []).append(tail)
+        self.read(tail)
+
+    def stop(self, log: MountLog):
+        tail = self.tails.pop(log, None)
+        if tail is None:
+            log.close()
+            return
+        self.read(tail)
+        tail.file.close()
+        if tail.wd >= 0:
+            tails = self.watches.get(tail.wd, [])
+            if tail in tails:
+                tails.remove(tail)
+            if len(tails) == 0:
+                self.watches.pop(tail.wd, None)
+                self.libc.inotify_rm_watch(self.inotify, tail.wd)
+        log.close()
+
+    def inotify_events(self):
+        try:
+            data = os.read(self.inotify, READ_SIZE)
+        except BlockingIOError:
+            return
+        wds = set()
+        i = 0
+        while i + INOTIFY_EVENT.size <= len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, i)
+            wds.add(wd)
+            i += INOTIFY_EVENT.size + length
+        for wd in wds:
+            for tail in list(self.watches.get(wd, [])):
+                self.read(tail)
+
+    def read(self, tail: Tail):
+        try:
+            if os.fstat(tail.file.fileno()).st_size < tail.file.tell():
+                # Truncated by someone else
+                tail.file.seek(0)
+            while True:
+                data = tail.file.read(READ_SIZE)
+                if not data:
+                    break
+                tail.log.feed(data)
+            if tail.file.tell() >= tail.log.max_bytes:
+                self.rotate(tail)
+        except OSError:
+            traceback.print_exc()
+
+    def rotate(self, tail: Tail):
+        # Copy and truncate. rclone keeps its (appending) file descriptor.
+        path = tail.log.path
+        end = tail.file.tell()
+        with open(path + ".1", "wb") as dst:
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, dst)
+            # Output written since the last read. Goes to both.
+            data = tail.file.read() or b""
+            tail.log.feed(data)
+            dst.write(data[max(0, dst.tell() - end):])
+        os.truncate(path, 0)
+        tail.file.seek(0)
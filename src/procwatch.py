@@ -0,0 +1,95 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import selectors
+import subprocess
+import threading
+import traceback
+from typing import Callable, List, Tuple
+
+
+# Event driven child exit detection. Each watched process gets a pidfd which
+# becomes readable the moment the process exits. One thread blocks on all of
+# them, so nothing wakes up periodically. Where pidfds are not available
+# (kernel < 5.3, python < 3.9) a thread blocked in wait() is used instead.
+
+
+class ProcessWatcher:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = os.pipe()
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.pending: List[Tuple[int, subprocess.Popen, Callable]] = []
+        self.thread = None
+
+    def watch(self, proc: subprocess.Popen, callback: Callable[[subprocess.Popen], None]):
+        try:
+            fd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            # No pidfd support or process already reaped
+            threading.Thread(target=self.wait_thread, args=(proc, callback), daemon=True).start()
+            return
+        with self.lock:
+            # Selector is only touched by the watcher thread
+            self.pending.append((fd, proc, callback))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="procwatch", daemon=True)
+                self.thread.start()
+        os.write(self.wake_w, b"\0")
+
+    def wait_thread(self, proc: subprocess.Popen, callback: Callable[[subprocess.Popen], None]):
+        proc.wait()
+        self.notify(proc, callback)
+
+    def notify(self, proc: subprocess.Popen, callback: Callable[[subprocess.Popen], None]):
+        try:
+            callback(proc)
+        except:
+            traceback.print_exc()
+
+    def run(self):
+        while True:
+            for key, mask in self.selector.select():
+                if key.fd == self.wake_r:
+                    os.read(self.wake_r, 512)
+                    with self.lock:
+                        pending = self.pending
+                        self.pending = []
+                    for fd, proc, callback in pending:
+                        self.selector.register(fd, selectors.EVENT_READ, (proc, callback))
+                else:
+                    proc, callback = key.data
+                    self.selector.unregister(key.fd)
+                    os.close(key.fd)
+                    proc.wait()
+                    self.notify(proc, callback)
@@ -0,0 +1,270 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import binascii
+import json
+import os
+import re
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# Client for rclone's remote control (rc) API and management of a single
+# "rclone rcd" daemon that hosts all mounts.
+
+
+class RcError(Exception):
+    pass
+
+
+class RcClient:
+    def __init__(self, url: str, user: str = "", password: str = "") -> None:
+        self.url = url.rstrip("/") + "/"
+        self.auth = None
+        if user != "":
+            self.auth = "Basic " + binascii.b2a_base64("{}:{}".format(user, password).encode(), newline=False).decode()
+
+    def call(self, method: str, timeout: float = 10.0, **params) -> Dict:
+        # Imported here since urllib is slow to import and only needed once
+        # something talks to rclone (keeps tray startup fast)
+        import urllib.error
+        import urllib.request
+        req = urllib.request.Request(self.url + method, data=json.dumps(params).encode(), method="POST")
+        req.add_header("Content-Type", "application/json")
+        if self.auth is not None:
+            req.add_header("Authorization", self.auth)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as res:
+                return json.loads(res.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            # rclone reports failures as {"error": "...", "status": N}
+            try:
+                msg = json.loads(e.read()).get("error", str(e))
+            except:
+                msg = str(e)
+            raise RcError("{} failed: {}".format(method, msg))
+        except (urllib.error.URLError, OSError) as e:
+            raise RcError("{} failed: {}".format(method, e))
+
+
+# Translation of rclone mount flags into mount/mount's vfsOpt and mountOpt
+# (go field names). Types: bool, int, str, dur (nanoseconds), size (bytes),
+# mode (octal int), cache (cache mode enum).
+VFS_OPTS = {
+    "--vfs-cache-mode": ("CacheMode", "cache"),
+    "--dir-cache-time": ("DirCacheTime", "dur"),
+    "--poll-interval": ("PollInterval", "dur"),
+    "--read-only": ("ReadOnly", "bool"),
+    "--no-modtime": ("NoModTime", "bool"),
+    "--no-checksum": ("NoChecksum", "bool"),
+    "--no-seek": ("NoSeek", "bool"),
+    "--uid": ("UID", "int"),
+    "--gid": ("GID", "int"),
+    "--umask": ("Umask", "mode"),
+    "--dir-perms": ("DirPerms", "mode"),
+    "--file-perms": ("FilePerms", "mode"),
+    "--vfs-cache-max-age": ("CacheMaxAge", "dur"),
+    "--vfs-cache-max-size": ("CacheMaxSize", "size"),
+    "--vfs-cache-poll-interval": ("CachePollInterval", "dur"),
+    "--vfs-read-ahead": ("ReadAhead", "size"),
+    "--vfs-read-chunk-size": ("ChunkSize", "size"),
+    "--vfs-read-chunk-size-limit": ("ChunkSizeLimit", "size"),
+    "--vfs-write-back": ("WriteBack", "dur"),
+    "--vfs-case-insensitive": ("CaseInsensitive", "bool"),
+}
+MOUNT_OPTS = {
+    "--allow-other": ("AllowOther", "bool"),
+    "--allow-root": ("AllowRoot", "bool"),
+    "--allow-non-empty": ("AllowNonEmpty", "bool"),
+    "--default-permissions": ("DefaultPermissions", "bool"),
+    "--write-back-cache": ("WritebackCache", "bool"),
+    "--async-read": ("AsyncRead", "bool"),
+    "--attr-timeout": ("AttrTimeout", "dur"),
+    "--daemon-timeout": ("DaemonTimeout", "dur"),
+    "--max-read-ahead": ("MaxReadAhead", "size"),
+    "--volname": ("VolumeName", "str"),
+}
+RC_USER = "rclone-drive-manager"  # rc user of the rclone processes this app starts
+CACHE_MODES = {"off": 0, "minimal": 1, "writes": 2, "full": 3}
+DURATION_UNITS = {"ns": 1, "us": 10**3, "ms": 10**6, "s": 10**9, "m": 60 * 10**9, "h": 3600 * 10**9, "d": 86400 * 10**9}
+SIZE_UNITS = {"b": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40, "p": 1 << 50}
+
+
+def parse_duration(text: str) -> int:
+    parts = re.findall(r"([0-9.]+)(ns|us|ms|s|m|h|d)", text)
+    if len(parts) == 0 or "".join(n + u for n, u in parts) != text:
+        raise ValueError("Invalid duration '{}'".format(text))
+    return int(sum(float(n) * DURATION_UNITS[u] for n, u in parts))
+
+
+def parse_size(text: str) -> int:
+    m = re.fullmatch(r"([0-9.]+)([bkmgtp]?)(i?b)?", text.lower())
+    if m is None:
+        raise ValueError("Invalid size '{}'".format(text))
+    # Plain numbers are KiB like rclone's SizeSuffix
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2) or "k"])
+
+
+def convert(kind: str, value: str):
+    if kind == "bool":
+        return value.lower() in ("", "true", "1")
+    if kind == "int":
+        return int(value)
+    if kind == "mode":
+        return int(value, 8)
+    if kind == "dur":
+        return parse_duration(value)
+    if kind == "size":
+        return parse_size(value)
+    if kind == "cache":
+        if value not in CACHE_MODES:
+            raise ValueError("Invalid cache mode '{}'".format(value))
+        return CACHE_MODES[value]
+    return value
+
+
+def mount_opts(mount_args: str) -> Tuple[Dict, Dict]:
+    # Returns (vfsOpt, mountOpt). Raises ValueError for flags that can't be
+    # applied to a single mount of a shared rcd.
+    vfs_opt = {}
+    mount_opt = {}
+    args = str(mount_args).split()
+    i = 0
+    unsupported = []
+    while i < len(args):
+        flag, eq, value = args[i].partition("=")
+        i += 1
+        if flag in VFS_OPTS:
+            field, kind = VFS_OPTS[flag]
+            dest = vfs_opt
+        elif flag in MOUNT_OPTS:
+            field, kind = MOUNT_OPTS[flag]
+            dest = mount_opt
+        else:
+            unsupported.append(flag)
+            # Skip the flag's value if it has one
+            if eq == "" and i < len(args) and not args[i].startswith("-"):
+                i += 1
+            continue
+        if eq == "" and kind != "bool":
+            if i >= len(args):
+                raise ValueError("Missing value for {}".format(flag))
+            value = args[i]
+            i += 1
+        dest[field] = convert(kind, value)
+    if len(unsupported) != 0:
+        raise ValueError("Arguments not supported in rcd mode: {}".format(" ".join(unsupported)))
+    return vfs_opt, mount_opt
+
+
+def new_password() -> str:
+    return binascii.hexlify(os.urandom(16)).decode()
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RcDaemon:
+    # One "rclone rcd" hosting every mount. If url is given, an already
+    # running rcd (or a stand-in such as rcstub.py) is used instead.
+
+    def __init__(self, url: str = "") -> None:
+        self.lock = threading.Lock()
+        self.url = url
+        self.proc: Optional[subprocess.Popen] = None
+        self.client: Optional[RcClient] = RcClient(url) if url != "" else None
+
+    def ensure_started(self, timeout: float = 10.0) -> RcClient:
+        with self.lock:
+            if self.url != "":
+                return self.client
+            if self.proc is not None and self.proc.poll() is None:
+                return self.client
+            port = free_port()
+            user = RC_USER
+            password = new_password()
+            args = ["systemd-inhibit", "rclone", "rcd",
+                    "--rc-addr", "127.0.0.1:{}".format(port),
+                    "--rc-user", user]
+            print(" ".join(args))
+            # Not on the command line, which any local user can read
+            self.proc = subprocess.Popen(args, env=dict(os.environ, RCLONE_RC_PASS=password))
+            self.client = RcClient("http://127.0.0.1:{}/".format(port), user, password)
+            start = time.monotonic()
+            while True:
+                try:
+                    self.client.call("rc/noop", timeout=1.0)
+                    return self.client
+                except RcError:
+                    if self.proc.poll() is not None:
+                        raise RcError("rclone rcd exited with error code {}.".format(self.proc.poll()))
+                    if time.monotonic() - start > timeout:
+                        self.stop()
+                        raise RcError("rclone rcd did not start within {} seconds.".format(timeout))
+                    time.sleep(0.05)
+
+    def mount(self, name: str, mountpoint: str, mount_args: str, timeout: float):
+        vfs_opt, mount_opt = mount_opts(mount_args)
+        client = self.ensure_started(timeout)
+        # mount/mount returns once the filesystem is mounted
+        client.call("mount/mount", timeout=timeout, fs="{}:/".format(name), mountPoint=mountpoint,
+                    mountType="mount", vfsOpt=vfs_opt, mountOpt=mount_opt)
+
+    def unmount(self, mountpoint: str, timeout: float = 10.0):
+        self.client.call("mount/unmount", timeout=timeout, mountPoint=mountpoint)
+
+    def listmounts(self) -> List[Dict]:
+        return self.ensure_started().call("mount/listmounts").get("mountPoints", [])
+
+    def adopt(self, proc, client: RcClient):
+        # Use an rcd started by a previous run of the app
+        with self.lock:
+            self.proc = proc
+            self.client = client
+
+    def stop(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        try:
+            self.client.call("core/quit", timeout=1.0)
+            self.proc.wait(2.0)
+        except (RcError, subprocess.TimeoutExpired):
+            self.proc.terminate()
+            try:
+                self.proc.wait(0.3)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
@@ -0,0 +1,263 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+from rc import parse_size
+
+
+# Local stand-in for rclone's rc API. Implements enough of the mount calls to
+# exercise the rcd backend without rclone installed. Mounts are only recorded,
+# nothing is actually mounted.
+#
+# Run standalone with:  python3 rcstub.py [host:port]
+# and set "rcd_url" in config.json to the printed url.
+
+
+class StubError(Exception):
+    def __init__(self, status: int, msg: str):
+        super().__init__(msg)
+        self.status = status
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        stub: RcStub = self.server.stub
+        method = self.path.strip("/")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+            if method not in stub.methods:
+                raise StubError(404, "couldn't find method \"{}\"".format(method))
+            status, out = 200, stub.methods[method](params)
+        except StubError as e:
+            status, out = e.status, {"error": str(e), "input": {}, "path": method, "status": e.status}
+        body = json.dumps(out).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RcStub:
+    def __init__(self, addr: Tuple[str, int] = ("127.0.0.1", 0), mount_delay: float = 0.0) -> None:
+        self.lock = threading.Lock()
+        self.mount_delay = mount_delay
+        self.mounts: Dict[str, Dict] = {}  # mountPoint: info
+        self.calls = []  # (method, params) of every call, for inspection
+        # Values returned by core/stats and vfs/stats. Edit to simulate activity.
+        self.stats = {"bytes": 0, "speed": 0, "transfers": 0, "transferring": [], "errors": 0}
+        self.disk_cache: Dict[str, Dict] = {}  # fs: diskCache
+        self.bwlimit = "off"
+        # Simulated upload queue. Due items upload at upload_rate bytes / s.
+        self.uploads: Dict[str, List[Dict]] = {}  # fs: [{"id", "name", "size", "due", "left"}]
+        self.upload_rate = 1 << 20
+        self.next_upload_id = 1
+        self.uploads_time = time.monotonic()
+        self.methods = {
+            "rc/noop": self.noop,
+            "core/quit": self.quit,
+            "mount/mount": self.mount,
+            "mount/unmount": self.unmount,
+            "mount/unmountall": self.unmountall,
+            "mount/listmounts": self.listmounts,
+            "core/stats": self.core_stats,
+            "core/bwlimit": self.core_bwlimit,
+            "vfs/stats": self.vfs_stats,
+            "vfs/queue": self.vfs_queue,
+            "vfs/refresh": self.vfs_refresh,
+            "vfs/queue-set-expiry": self.vfs_queue_set_expiry,
+        }
+        self.server = ThreadingHTTPServer(addr, Handler)
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="rcstub", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record(self, method: str, params: Dict):
+        with self.lock:
+            self.calls.append((method, params))
+
+    def noop(self, params: Dict) -> Dict:
+        return params
+
+    def quit(self, params: Dict) -> Dict:
+        threading.Thread(target=self.stop, daemon=True).start()
+        return {}
+
+    def mount(self, params: Dict) -> Dict:
+        self.record("mount/mount", params)
+        if "fs" not in params or "mountPoint" not in params:
+            raise StubError(400, "fs and mountPoint are required")
+        time.sleep(self.mount_delay)
+        with self.lock:
+            if params["mountPoint"] in self.mounts:
+                raise StubError(500, "mount point {} already mounted".format(params["mountPoint"]))
+            self.mounts[params["mountPoint"]] = {
+                "Fs": params["fs"].rstrip("/").rstrip(":"),
+                "MountPoint": params["mountPoint"],
+                "MountedOn": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "vfsOpt": params.get("vfsOpt", {}),
+                "mountOpt": params.get("mountOpt", {}),
+            }
+        return {}
+
+    def unmount(self, params: Dict) -> Dict:
+        self.record("mount/unmount", params)
+        with self.lock:
+            if self.mounts.pop(params.get("mountPoint", ""), None) is None:
+                raise StubError(500, "mount not found")
+        return {}
+
+    def unmountall(self, params: Dict) -> Dict:
+        with self.lock:
+            self.mounts.clear()
+        return {}
+
+    def listmounts(self, params: Dict) -> Dict:
+        with self.lock:
+            return {"mountPoints": [{k: m[k] for k in ("Fs", "MountPoint", "MountedOn")} for m in self.mounts.values()]}
+
+    def core_stats(self, params: Dict) -> Dict:
+        with self.lock:
+            return dict(self.stats)
+
+    def core_bwlimit(self, params: Dict) -> Dict:
+        self.record("core/bwlimit", params)
+        with self.lock:
+            rate = params.get("rate", self.bwlimit)
+            try:
+                limits = [-1 if r in ("", "off") else parse_size(r) for r in rate.split(":")]
+            except ValueError as e:
+                raise StubError(500, str(e))
+            self.bwlimit = rate
+            tx, rx = limits[0], limits[-1]
+            return {"rate": self.bwlimit, "bytesPerSecond": tx, "bytesPerSecondTx": tx, "bytesPerSecondRx": rx}
+
+    def vfs_fs(self, params: Dict) -> str:
+        # Like rclone, fs may be left out when only one remote is mounted
+        with self.lock:
+            if "fs" in params:
+                fs = params["fs"].rstrip("/").rstrip(":")
+                if fs not in [m["Fs"] for m in self.mounts.values()]:
+                    raise StubError(500, "no VFS found with name \"{}\"".format(params["fs"]))
+                return fs
+            if len(self.mounts) != 1:
+                raise StubError(500, "more than one VFS active - need \"fs\" parameter")
+            return list(self.mounts.values())[0]["Fs"]
+
+    def vfs_stats(self, params: Dict) -> Dict:
+        fs = self.vfs_fs(params)
+        with self.lock:
+            cache = {"bytesUsed": 0, "files": 0, "uploadsInProgress": 0, "uploadsQueued": 0}
+            cache.update(self.disk_cache.get(fs, {}))
+            self.advance_uploads()
+            now = time.monotonic()
+            for item in self.uploads.get(fs, []):
+                cache["uploadsInProgress" if item["due"] <= now else "uploadsQueued"] += 1
+        return {"fs": fs, "diskCache": cache, "inUse": 1}
+
+    def vfs_refresh(self, params: Dict) -> Dict:
+        self.record("vfs/refresh", params)
+        self.vfs_fs(params)
+        dirs = [v for k, v in params.items() if k == "dir" or (k.startswith("dir") and k[3:].isdigit())]
+        return {"result": {d: "OK" for d in dirs or [""]}}
+
+    def add_upload(self, fs: str, name: str, size: int, delay: float = 5.0):
+        # Like a file written to the cache with --vfs-write-back delay
+        with self.lock:
+            self.advance_uploads()
+            self.uploads.setdefault(fs, []).append({"id": self.next_upload_id, "name": name, "size": size,
+                                                    "due": time.monotonic() + delay, "left": size})
+            self.next_upload_id += 1
+
+    def advance_uploads(self):
+        # Called with the lock held. Due items share the upload rate in order.
+        now = time.monotonic()
+        budget = (now - self.uploads_time) * self.upload_rate
+        self.uploads_time = now
+        for fs, items in self.uploads.items():
+            for item in items:
+                if item["due"] <= now and budget > 0:
+                    done = min(budget, item["left"])
+                    item["left"] -= done
+                    budget -= done
+            self.uploads[fs] = [item for item in items if item["left"] > 0]
+
+    def vfs_queue(self, params: Dict) -> Dict:
+        fs = self.vfs_fs(params)
+        with self.lock:
+            self.advance_uploads()
+            now = time.monotonic()
+            return {"queue": [{"id": i["id"], "name": i["name"], "size": i["size"], "expiry": max(0.0, i["due"] - now),
+                               "tries": 0, "delay": 0.0, "uploading": i["due"] <= now}
+                              for i in self.uploads.get(fs, [])]}
+
+    def vfs_queue_set_expiry(self, params: Dict) -> Dict:
+        self.record("vfs/queue-set-expiry", params)
+        fs = self.vfs_fs(params)
+        with self.lock:
+            self.advance_uploads()
+            for item in self.uploads.get(fs, []):
+                if item["id"] == params.get("id"):
+                    item["due"] = time.monotonic() + float(params.get("expiry", 0))
+                    return {}
+        raise StubError(500, "item {} not found".format(params.get("id")))
+
+
+if __name__ == "__main__":
+    host, _, port = (sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1:5572").rpartition(":")
+    stub = RcStub((host or "127.0.0.1", int(port)))
+    print("rc stand-in listening on {}".format(stub.url))
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
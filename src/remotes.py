@@ -0,0 +1,145 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import re
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+# Names of the remotes configured in rclone, used to autocomplete remote names
+# in the config editor and to reject unknown ones before spawning rclone.
+# rclone.conf is parsed directly and the result is kept until the file's
+# mtime or size changes. Encrypted configs (and unreadable ones) fall back to
+# `rclone listremotes`, cached the same way. Remotes defined through
+# RCLONE_CONFIG_<NAME>_TYPE environment variables are included. Without a
+# config file (eg a portable rclone or none installed) names aren't checked.
+
+
+SECTION = re.compile(r"^\s*\[(.+)\]\s*$")
+LISTREMOTES_TIMEOUT = 10.0
+
+
+def config_path(mount_args: str = "") -> str:
+    # A --config in the mount args wins like it does for rclone
+    args = str(mount_args).split()
+    for i, arg in enumerate(args):
+        if arg == "--config" and i + 1 < len(args):
+            return os.path.expanduser(args[i + 1])
+        if arg.startswith("--config="):
+            return os.path.expanduser(arg[len("--config="):])
+    if os.environ.get("RCLONE_CONFIG"):
+        return os.environ["RCLONE_CONFIG"]
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    path = os.path.join(base, "rclone", "rclone.conf")
+    legacy = os.path.expanduser("~/.rclone.conf")
+    if not os.path.exists(path) and os.path.exists(legacy):
+        return legacy
+    return path
+
+
+def parse_config(text: str) -> Optional[List[str]]:
+    # None if the file is encrypted
+    if text.startswith("# Encrypted rclone configuration File"):
+        return None
+    names = []
+    for line in text.splitlines():
+        m = SECTION.match(line)
+        if m is not None and m.group(1).strip() not in names:
+            names.append(m.group(1).strip())
+    return names
+
+
+def env_remotes() -> List[str]:
+    names = []
+    for key in os.environ:
+        if key.startswith("RCLONE_CONFIG_") and key.endswith("_TYPE") and len(key) > len("RCLONE_CONFIG__TYPE"):
+            names.append(key[len("RCLONE_CONFIG_"):-len("_TYPE")].lower())
+    return names
+
+
+def listremotes(path: str) -> Optional[List[str]]:
+    try:
+        out = subprocess.run(["rclone", "listremotes", "--config", path], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, timeout=LISTREMOTES_TIMEOUT, check=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return [line.strip().rstrip(":") for line in out.decode("utf-8", "replace").splitlines() if line.strip()]
+
+
+class RemoteCatalog:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.cache: Dict[str, Tuple[Tuple, Optional[List[str]]]] = {}  # path: (mtime and size, names)
+
+    def remotes(self, mount_args: str = "") -> Optional[List[str]]:
+        # None when the remotes can't be determined (don't validate then)
+        path = config_path(mount_args)
+        try:
+            st = os.stat(path)
+            key = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = (None, None)
+        with self.lock:
+            cached = self.cache.get(path)
+            if cached is None or cached[0] != key:
+                cached = (key, self.load(path))
+                self.cache[path] = cached
+            names = cached[1]
+        if names is None:
+            return None
+        return names + [n for n in env_remotes() if n not in names]
+
+    def load(self, path: str) -> Optional[List[str]]:
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                names = parse_config(f.read())
+        except OSError:
+            names = None
+        if names is None and os.path.exists(path):
+            names = listremotes(path)
+        return names
+
+    def check(self, name: str, mount_args: str = "") -> Optional[str]:
+        # Error message if name is not a configured remote
+        if name.startswith(":"):
+            # On the fly backend (eg ":local")
+            return None
+        names = self.remotes(mount_args)
+        if names is None or name in names:
+            return None
+        if len(names) == 0:
+            return "Remote {} is not configured in rclone (no remotes in {}).".format(name, config_path(mount_args))
+        return "Remote {} is not configured in rclone. Configured remotes: {}.".format(name, ", ".join(names))
+
+
+catalog = RemoteCatalog()
@@ -0,0 +1,105 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import random
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Dict, List, Optional
+
+from config import Config
+from mountengine import MountEngine
+
+
+# Mounts the remotes marked mount_at_startup, highest priority first. At most
+# startup_parallel mounts run at once and each start is spaced by a random
+# delay around startup_stagger seconds, so many remotes don't all read
+# rclone.conf and refresh their tokens at the same moment.
+
+
+DEFAULT_PARALLEL = 2
+DEFAULT_STAGGER = 0.5  # Seconds. Actual delays are 50% to 150% of this.
+
+
+class StartupMounter:
+    def __init__(self, engine: MountEngine, config: Config) -> None:
+        self.engine = engine
+        # Stable sort keeps config order within a priority
+        self.remotes = sorted((r for r in config.remotes.values() if r.mount_at_startup), key=lambda r: -r.priority)
+        self.parallel = max(1, int(config.setting("startup_parallel", DEFAULT_PARALLEL)))
+        self.stagger = max(0.0, float(config.setting("startup_stagger", DEFAULT_STAGGER)))
+        self.slots = threading.Semaphore(self.parallel)
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.ready: Dict[str, Optional[float]] = {}  # name: seconds until mounted (None if failed)
+        self.start = time.monotonic()
+        self.thread = None
+        if len(self.remotes) != 0:
+            self.thread = threading.Thread(target=self.run, name="startup", daemon=True)
+            self.thread.start()
+
+    def cancel(self):
+        # Stop starting mounts (eg when quitting). Running ones finish.
+        self.cancelled.set()
+        self.slots.release()
+
+    def run(self):
+        futures: List[Future] = []
+        for i, remote in enumerate(self.remotes):
+            self.slots.acquire()
+            if i != 0 and self.stagger > 0:
+                self.cancelled.wait(self.stagger * random.uniform(0.5, 1.5))
+            if self.cancelled.is_set():
+                break
+            future = self.engine.mount(remote)
+            if future is None:
+                # Already mounted (or adopted)
+                self.slots.release()
+                continue
+            future.add_done_callback(lambda f, name=remote.remote_name: self.finished(name, f))
+            futures.append(future)
+        wait(futures)
+        print(self.summary(), flush=True)
+
+    def finished(self, name: str, future: Future):
+        ok = not future.cancelled() and future.exception() is None and future.result()
+        with self.lock:
+            self.ready[name] = time.monotonic() - self.start if ok else None
+        self.slots.release()
+
+    def summary(self) -> str:
+        with self.lock:
+            ready = dict(self.ready)
+        mounted = sorted((t, name) for name, t in ready.items() if t is not None)
+        text = "Startup mounted {} of {} drives".format(len(mounted), len(self.remotes))
+        if len(mounted) != 0:
+            text += " in {:.1f}s ({})".format(mounted[-1][0], ", ".join("{} {:.1f}s".format(n, t) for t, n in mounted))
+        return text
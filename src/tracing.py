@@ -0,0 +1,171 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import atexit
+import collections
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+# Opt-in tracing of mount lifecycle phases (--trace FILE). Spans are recorded
+# in memory (the last MAX_EVENTS) and written at exit as Chrome trace JSON,
+# which chrome://tracing and ui.perfetto.dev open, plus a summary of latency
+# percentiles per span name in FILE.summary.txt. When disabled span() returns
+# a shared no-op context manager.
+#
+#   with tracing.span("spawn", remote=name):
+#       ...
+
+
+MAX_EVENTS = 100000
+PERCENTILES = (50, 90, 99)
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add({"name": self.name, "ph": "X", "ts": self.tracer.micros(self.start),
+                         "dur": (end - self.start) * 1e6, "args": self.args})
+        return False
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.path = ""
+        self.lock = threading.Lock()
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+        self.threads: Dict[int, str] = {}
+        self.origin = time.perf_counter()
+
+    def enable(self, path: str):
+        self.path = path
+        self.enabled = True
+        atexit.register(self.write)
+
+    def micros(self, t: float) -> float:
+        return (t - self.origin) * 1e6
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def instant(self, name: str, **args):
+        if self.enabled:
+            self.add({"name": name, "ph": "i", "s": "t", "ts": self.micros(time.perf_counter()), "args": args})
+
+    def add(self, event: Dict):
+        thread = threading.current_thread()
+        event["pid"] = os.getpid()
+        event["tid"] = thread.ident
+        with self.lock:
+            self.threads.setdefault(thread.ident, thread.name)
+            self.events.append(event)
+
+    def write(self):
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        meta = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in threads.items()]
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms"}, f)
+        summary = self.summary(events)
+        with open(self.path + ".summary.txt", "w") as f:
+            f.write(summary)
+        print("Trace written to {}".format(self.path))
+        print(summary, end="")
+
+    def summary(self, events: Optional[List[Dict]] = None) -> str:
+        if events is None:
+            with self.lock:
+                events = list(self.events)
+        durations = collections.defaultdict(list)
+        for event in events:
+            if event["ph"] == "X":
+                durations[event["name"]].append(event["dur"] / 1000)
+                remote = event["args"].get("remote")
+                if remote is not None:
+                    durations["{} [{}]".format(event["name"], remote)].append(event["dur"] / 1000)
+        lines = ["{:<40} {:>6} {}  {:>9}".format("span (ms)", "count", "  ".join("{:>9}".format("p{}".format(p))
+                                                                           for p in PERCENTILES), "max")]
+        for name in sorted(durations):
+            values = sorted(durations[name])
+            lines.append("{:<40} {:>6} {}  {:>9.1f}".format(name, len(values), "  ".join(
+                "{:>9.1f}".format(percentile(values, p)) for p in PERCENTILES), values[-1]))
+        return "\n".join(lines) + "\n"
+
+
+def percentile(values: List[float], p: float) -> float:
+    # Nearest rank of sorted values
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+tracer = Tracer()
+
+
+def span(name: str, **args):
+    return tracer.span(name, **args)
+
+
+def instant(name: str, **args):
+    tracer.instant(name, **args)
@@ -1,298 +1,426 @@
 
-import shutil
-import subprocess
 import os
-import json
-import time
+import threading
 import traceback
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, Dict, TYPE_CHECKING
 
 try:
     from PySide6.QtWidgets import QSystemTrayIcon, QMenu, QWidget, QApplication, QMessageBox
     from PySide6.QtGui import QIcon, QCursor, QAction
-    from PySide6.QtCore import QStandardPaths, QTimer, QFile
+    from PySide6.QtCore import QStandardPaths, QFile, QObject, Signal, QFileSystemWatcher, QTimer
 except:
     from PySide2.QtWidgets import QSystemTrayIcon, QMenu, QWidget, QApplication, QMessageBox, QAction
     from PySide2.QtGui import QIcon, QCursor
-    from PySide2.QtCore import QStandardPaths, QTimer, QFile
+    from PySide2.QtCore import QStandardPaths, QFile, QObject, Signal, QFileSystemWatcher, QTimer
 
-from configwindow import ConfigWindow
+from config import Config, load_config, save_config
+if TYPE_CHECKING:
+    from configwindow import ConfigWindow
+from mountengine import MountEngine, DEFAULT_SHUTDOWN_TIMEOUT
+from metrics import MetricsCollector, describe, format_size, DEFAULT_INTERVAL
+from idle import IdleMonitor
+from bandwidth import BandwidthScheduler
+from cache import CacheManager
+from startup import StartupMounter
+from warm import Warmer
+from watchdog import Watchdog
+import tracing
+
+
+LOG_DIALOG_LINES = 20  # Output lines shown in failure dialogs
+
+
+def show_warning(text: str, detail: str):
+    dialog = QMessageBox()
+    dialog.setWindowTitle("RcloneDriveManager")
+    dialog.setText(text)
+    dialog.setDetailedText(detail)
+    dialog.setIcon(QMessageBox.Warning)
+    dialog.setStandardButtons(QMessageBox.Ok)
+    dialog.setDefaultButton(QMessageBox.Ok)
+    dialog.exec_()
+
+
+class EngineBridge(QObject):
+    # Engine listeners run on worker threads. Emitting a signal queues the
+    # event onto the GUI thread.
+    event = Signal(str, str, str)
+    metrics = Signal(object)
+    reload = Signal()
+    benchmark = Signal(str, object)  # name, results dict or error message
 
 
 class TrayIcon(QSystemTrayIcon):
-    def __init__(self, config_win: ConfigWindow, parent: Optional[QWidget] = None) -> None:
+    def __init__(self, config_win: Optional["ConfigWindow"] = None, parent: Optional[QWidget] = None) -> None:
         super().__init__(parent)
 
         self.cfg_file = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation) + "/config.json"
 
+        # Created on first use if not given (most sessions never open it)
         self.config_win = config_win
         self.menu = QMenu()
         self.setContextMenu(self.menu)
-        self.poll_timer = QTimer(self)
-        self.mounted_list: Dict[str, Tuple[str, subprocess.Popen]] = {} # name: (mountpoint, popen)
-        self.mount_actions: List[QAction] = []
-        self.data = {}
-        self.data["count"] = 0
-        self.data["items"] = {}
+        self.config = Config()  # Read by the monitors' threads from the start
+        self.engine = MountEngine()
+        self.bridge = EngineBridge(self)
+        self.engine.add_listener(self.bridge.event.emit)
+        self.bridge.event.connect(self.engine_event)
+        self.metrics = MetricsCollector(self.engine)
+        self.metrics.add_listener(self.bridge.metrics.emit)
+        self.bridge.metrics.connect(self.update_tooltip)
+        self.idle_monitor = IdleMonitor(self.engine, self.metrics, lambda: self.config)
+        self.bandwidth = BandwidthScheduler(self.engine, lambda: self.config)
+        self.cache = CacheManager(self.engine, self.metrics, lambda: self.config)
+        self.warmer = Warmer(self.engine, lambda: self.config)
+        self.watchdog = Watchdog(self.engine, self.metrics, lambda: self.config)
+        self.metrics_server = None
+        self.control_server = None
+        self.bridge.reload.connect(self.reload_config)
+        self.bridge.benchmark.connect(self.benchmark_done)
+        self.benchmarking = set()
+        self.exiting = False
+        self.mount_actions: Dict[str, QAction] = {}  # name: action, in menu order
+        self.draining: Dict[str, str] = {}  # name: upload progress while unmounting
         self.construct_menu()
         self.setIcon(QIcon(":/icon.png"))
         self.setToolTip("RcloneDriveManager")
 
         self.activated.connect(self.showMenuOnTrigger)
 
+        # Reload when config.json is changed outside the app. The directory is
+        # watched too since editors (and save_config) replace the file.
+        self.cfg_watcher = QFileSystemWatcher(self)
+        self.cfg_watcher.fileChanged.connect(self.config_file_changed)
+        self.cfg_watcher.directoryChanged.connect(self.config_file_changed)
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(300)  # Debounce bursts of saves
+        self.reload_timer.timeout.connect(self.reload_config)
+
         if os.path.exists(self.cfg_file):
             try:
-                with open(self.cfg_file, "r") as f:
-                    data = json.load(f)
-                    self.update_menu(data)
+                self.update_menu(load_config(self.cfg_file))
             except Exception as e:
                 traceback.print_exc()
-                dialog = QMessageBox()
-                dialog.setWindowTitle("RcloneDriveManager")
-                dialog.setText("Error occurred loading configuration file.")
-                dialog.setDetailedText("{} occurred with message {}.".format(type(e).__name__, str(e)))
-                dialog.setIcon(QMessageBox.Warning)
-                dialog.setStandardButtons(QMessageBox.Ok)
-                dialog.setDefaultButton(QMessageBox.Ok)
-                dialog.exec_()
-        self.config_win.closed.connect(self.update_menu)
-        self.poll_timer.timeout.connect(self.poll_mounted)
-        self.poll_timer.setSingleShot(False)
-        self.poll_timer.start(5000)
+                show_warning("Error occurred loading configuration file.",
+                             "{} occurred with message {}.".format(type(e).__name__, str(e)))
+        if self.config_win is not None:
+            self.config_win.closed.connect(self.update_menu)
+        self.watch_config()
+        # Pick up drives still mounted from before a restart
+        self.engine.adopt_running(self.config)
+        self.startup = StartupMounter(self.engine, self.config)
+
+    def watch_config(self):
+        cfg_dir = os.path.dirname(self.cfg_file)
+        if os.path.isdir(cfg_dir) and cfg_dir not in self.cfg_watcher.directories():
+            self.cfg_watcher.addPath(cfg_dir)
+        if os.path.exists(self.cfg_file) and self.cfg_file not in self.cfg_watcher.files():
+            self.cfg_watcher.addPath(self.cfg_file)
+
+    def config_file_changed(self, path: str):
+        self.reload_timer.start()
+
+    def reload_config(self):
+        self.watch_config()
+        if not os.path.exists(self.cfg_file):
+            return
+        try:
+            config = load_config(self.cfg_file)
+        except Exception:
+            # Probably mid edit. The next save triggers another reload.
+            traceback.print_exc()
+            return
+        if config != self.config:
+            self.update_menu(config)
 
     def showMenuOnTrigger(self, reason):
         if reason == QSystemTrayIcon.Trigger:
             self.contextMenu().popup(QCursor.pos())
 
-    def update_menu(self, data):
-        for action in self.mount_actions:
-            self.menu.removeAction(action)
-            action.deleteLater()
-        self.mount_actions.clear()
-        self.data = data
-        for i in range(self.data["count"]):
-            name = self.data["items"][str(i)]["remote_name"]
-            act = QAction(name, self.menu)
-            act.setCheckable(True)
-            act.setChecked(name in self.mounted_list)
-            act.triggered.connect(self.toggle_mount)
-            self.menu.insertAction(self.sep_2, act)
-            self.mount_actions.append(act)
+    def update_menu(self, config: Optional[Config]):
+        with tracing.span("update_menu"):
+            if config is None:
+                # Config window failed to save
+                return
+            added, removed, changed = self.config.diff(config)
+            old_order = list(self.mount_actions)
+            self.config = config
+            self.engine.apply_config(config)
+            self.metrics.set_interval(config.setting("metrics_interval", DEFAULT_INTERVAL))
+            self.bandwidth.wake()
+            self.cache.wake()
+            self.start_metrics_server(config.setting("metrics_port", 0))
+            self.start_control_server(config.setting("control_socket", False))
+
+            # Only touch actions for remotes that changed. Existing actions (and
+            # their mounted checkmarks) are kept.
+            for name in removed:
+                act = self.mount_actions.pop(name)
+                self.menu.removeAction(act)
+                act.deleteLater()
+            for name in added:
+                act = QAction(name, self.menu)
+                act.setData(name)
+                act.setCheckable(True)
+                act.triggered.connect(self.toggle_mount)
+                self.mount_actions[name] = act
+            names = config.names()
+            kept = [name for name in old_order if name in config.remotes]
+            reordered = kept != [name for name in names if name not in added]
+            before = self.sep_2
+            for name in reversed(names):
+                act = self.mount_actions[name]
+                if reordered or name in added:
+                    self.menu.insertAction(before, act)
+                before = act
+            self.mount_actions = {name: self.mount_actions[name] for name in names}
+            for name in added + changed:
+                self.update_action(name)
+            self.watch_config()
 
     def construct_menu(self):
         self.lbl_action = self.menu.addAction("RcloneDriveManager")
         self.sep_1 = self.menu.addSeparator()
         self.sep_2 = self.menu.addSeparator()
+        self.mount_all_action = self.menu.addAction("Mount all")
+        self.unmount_all_action = self.menu.addAction("Unmount all")
+        self.sep_3 = self.menu.addSeparator()
+        self.cache_menu = self.menu.addMenu("Cache usage")
+        self.cache_menu.aboutToShow.connect(self.update_cache_menu)
+        self.bench_menu = self.menu.addMenu("Benchmark")
+        self.bench_menu.aboutToShow.connect(self.update_bench_menu)
+        self.log_menu = self.menu.addMenu("Show log")
+        self.log_menu.aboutToShow.connect(self.update_log_menu)
         self.quit_action = self.menu.addAction("Quit")
         self.quit_action.triggered.connect(self.exit_app)
         self.lbl_action.triggered.connect(self.open_config)
+        self.mount_all_action.triggered.connect(self.mount_all)
+        self.unmount_all_action.triggered.connect(self.unmount_all)
+        self.menu.aboutToShow.connect(lambda: self.metrics.set_menu_open(True))
+        self.menu.aboutToHide.connect(lambda: self.metrics.set_menu_open(False))
         self.setContextMenu(self.menu)
 
+    def start_metrics_server(self, port: int):
+        if self.metrics_server is not None:
+            if self.metrics_server.port == port:
+                return
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if port == 0:
+            return
+        try:
+            from metricsexporter import MetricsServer
+            self.metrics_server = MetricsServer(self.metrics, port)
+        except OSError as e:
+            traceback.print_exc()
+            show_warning("Failed to start metrics server.", "{} occurred with message {}.".format(type(e).__name__, str(e)))
+
+    def start_control_server(self, enabled: bool):
+        # Lets scripts (daemon.py status / mount / unmount ...) drive the tray's engine
+        if self.control_server is not None:
+            if enabled:
+                return
+            self.control_server.stop()
+            self.control_server = None
+        if not enabled:
+            return
+        try:
+            from control import ControlServer
+            self.control_server = ControlServer(self.engine, lambda: self.config, reload=self.bridge.reload.emit)
+        except Exception as e:
+            traceback.print_exc()
+            show_warning("Failed to start control socket.", "{} occurred with message {}.".format(type(e).__name__, str(e)))
+
+    def update_tooltip(self, samples):
+        lines = ["RcloneDriveManager"]
+        for name, sample in sorted(samples.items()):
+            text = describe(sample)
+            if text != "":
+                lines.append("{}: {}".format(name, text))
+        self.setToolTip("\n".join(lines))
+
     def open_config(self):
-        self.config_win.show(self.data)
-    
-    def act_for_name(self, name: str) -> QAction:
-        for act in self.mount_actions:
-            if act.text() == name:
-                return act
-        return None
-
-    def poll_mounted(self):     
-        to_delete = []  
-        for name, value in self.mounted_list.items():
-            proc = value[1]
-            mountpoint = value[0]
-            if proc.poll() is not None:
-                to_delete.append(name)
-                act = self.act_for_name(name)
-                if act is not None:
-                    act.setChecked(False)
-                res = proc.poll()
-                if res != 0:
-                    dialog = QMessageBox()
-                    dialog.setWindowTitle("RcloneDriveManager")
-                    dialog.setText("Drive Unmounted Unexpectedly")
-                    dialog.setDetailedText("Drive {} was unmounted unexpectedly. Rclone exited with code {}.".format(name, res))
-                    dialog.setIcon(QMessageBox.Warning)
-                    dialog.setStandardButtons(QMessageBox.Ok)
-                    dialog.setDefaultButton(QMessageBox.Ok)
-                    dialog.exec_()
-                # Remove mount dir when unmounted (only if empty to prevent accidental data loss)
-                try:
-                    os.rmdir(mountpoint)
-                except:
-                    traceback.print_exc()
-        for name in to_delete:
-            del self.mounted_list[name]
+        if self.config_win is None:
+            from configwindow import ConfigWindow
+            self.config_win = ConfigWindow()
+            self.config_win.closed.connect(self.update_menu)
+        self.config_win.show(self.config)
     
-    def toggle_mount(self):
-        act: QAction = self.sender()
-        name = act.text()
-        if act.isChecked():
-            # Don't actually check until mounted
-            act.setChecked(False)
-            self.mount(name)
+    def act_for_name(self, name: str) -> Optional[QAction]:
+        return self.mount_actions.get(name)
+
+    def update_action(self, name: str):
+        act = self.act_for_name(name)
+        if act is None:
+            return
+        state = self.engine.state(name)
+        if state == "unmounting" and name in self.draining:
+            act.setText("{} (uploading {}...)".format(name, self.draining[name]))
+        elif state in ("mounting", "unmounting"):
+            act.setText("{} ({}...)".format(name, state))
+        elif state == "idle":
+            # Clicking remounts it
+            act.setText("{} (idle)".format(name))
         else:
-            # Don't actually uncheck until unmounted
-            act.setChecked(True)
-            self.unmount(name)
+            act.setText(name)
+        act.setEnabled(state not in ("mounting", "unmounting"))
+        act.setChecked(state in ("mounted", "unmounting"))
 
-    def mount(self, name: str):
-        idx = -1
-        for i in range(self.data["count"]):
-            if self.data["items"][str(i)]["remote_name"] == name:
-                idx = i
-                break
-        if idx == -1:
-            dialog = QMessageBox()
-            dialog.setWindowTitle("RcloneDriveManager")
-            dialog.setText("Error occurred mounting the drive")
-            dialog.setDetailedText("No configuration with the name {} was found.".format(name))
-            dialog.setIcon(QMessageBox.Warning)
-            dialog.setStandardButtons(QMessageBox.Ok)
-            dialog.setDefaultButton(QMessageBox.Ok)
-            dialog.exec_()
+    def update_cache_menu(self):
+        self.cache_menu.clear()
+        usage, budget = self.cache.report()
+        if budget is None:
+            self.cache_menu.addAction("No cache_budget set").setEnabled(False)
             return
-        
-        mountpoint = self.data["items"][str(idx)]["mount_point"]
-        if mountpoint == "":
-            dialog = QMessageBox()
-            dialog.setWindowTitle("RcloneDriveManager")
-            dialog.setText("Error occurred mounting the drive")
-            dialog.setDetailedText("No mountpoint was specified.".format(name))
-            dialog.setIcon(QMessageBox.Warning)
-            dialog.setStandardButtons(QMessageBox.Ok)
-            dialog.setDefaultButton(QMessageBox.Ok)
-            dialog.exec_()
+        total = "{} of {}".format(format_size(sum(usage.values())), format_size(budget))
+        self.cache_menu.addAction(total).setEnabled(False)
+        self.cache_menu.addSeparator()
+        for name, size in sorted(usage.items()):
+            self.cache_menu.addAction("{}: {}".format(name, format_size(size))).setEnabled(False)
+
+    def update_bench_menu(self):
+        self.bench_menu.clear()
+        with self.engine.lock:
+            names = [name for name in self.mount_actions if name in self.engine.mounted]
+        for name in names:
+            act = self.bench_menu.addAction(name)
+            act.setEnabled(name not in self.benchmarking)
+            act.triggered.connect(lambda checked=False, name=name: self.benchmark(name))
+        if len(names) == 0:
+            self.bench_menu.addAction("No drives mounted").setEnabled(False)
+
+    def benchmark(self, name: str):
+        import mountbench
+        with self.engine.lock:
+            mount = self.engine.mounted.get(name)
+        if mount is None:
             return
-        mountpoint = os.path.expandvars(os.path.expanduser(mountpoint))
-        if not os.path.exists(mountpoint):
-            os.makedirs(mountpoint)
-        if not os.path.exists(mountpoint):
-            dialog = QMessageBox()
-            dialog.setWindowTitle("RcloneDriveManager")
-            dialog.setText("Error occurred mounting the drive")
-            dialog.setDetailedText("Mountpoint does not exist and could not be created.".format(name))
-            dialog.setIcon(QMessageBox.Warning)
-            dialog.setStandardButtons(QMessageBox.Ok)
-            dialog.setDefaultButton(QMessageBox.Ok)
-            dialog.exec_()
+        dialog = QMessageBox()
+        dialog.setWindowTitle("RcloneDriveManager")
+        dialog.setText("Benchmark {}? This writes and reads {} of test data on the drive.".format(
+            name, format_size(mountbench.DEFAULT_SIZE)))
+        dialog.setIcon(QMessageBox.Question)
+        dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        dialog.setDefaultButton(QMessageBox.No)
+        if dialog.exec_() != QMessageBox.Yes:
             return
-        if not os.path.isdir(mountpoint):
-            dialog = QMessageBox()
-            dialog.setWindowTitle("RcloneDriveManager")
-            dialog.setText("Error occurred mounting the drive")
-            dialog.setDetailedText("Mountpoint exists, but is not a directory.".format(name))
-            dialog.setIcon(QMessageBox.Warning)
-            dialog.setStandardButtons(QMessageBox.Ok)
-            dialog.setDefaultButton(QMessageBox.Ok)
-            dialog.exec_()
+        self.benchmarking.add(name)
+
+        def run():
+            try:
+                results = mountbench.run(mount.mountpoint)
+                mountbench.record_results(os.path.join(os.path.dirname(self.cfg_file), "benchmarks.json"), name, results)
+            except Exception as e:
+                traceback.print_exc()
+                results = "{} occurred with message {}.".format(type(e).__name__, str(e))
+            self.bridge.benchmark.emit(name, results)
+        threading.Thread(target=run, name="benchmark", daemon=True).start()
+
+    def benchmark_done(self, name: str, results):
+        import mountbench
+        self.benchmarking.discard(name)
+        if isinstance(results, str):
+            show_warning("Benchmark of {} failed".format(name), results)
             return
-        if len(os.listdir(mountpoint)) != 0:
-            dialog = QMessageBox()
-            dialog.setWindowTitle("RcloneDriveManager")
-            dialog.setText("Error occurred mounting the drive")
-            dialog.setDetailedText("Mountpoint exists, but is a non-empty directory.".format(name))
-            dialog.setIcon(QMessageBox.Warning)
-            dialog.setStandardButtons(QMessageBox.Ok)
-            dialog.setDefaultButton(QMessageBox.Ok)
-            dialog.exec_()
+        remote = self.config.get(name)
+        if remote is None:
             return
+        rcd = self.config.setting("backend", "process") == "rcd"
+        suggested = mountbench.suggest(results, remote.mount_args, rcd)
+        dialog = QMessageBox()
+        dialog.setWindowTitle("RcloneDriveManager")
+        dialog.setText("Benchmark of {}\n\n{}\n\nApply the suggested mount arguments? They are used the next time the drive is mounted.".format(
+            name, mountbench.describe(results)))
+        dialog.setDetailedText(suggested)
+        dialog.setIcon(QMessageBox.Information)
+        dialog.setStandardButtons(QMessageBox.Apply | QMessageBox.Close)
+        dialog.setDefaultButton(QMessageBox.Close)
+        if dialog.exec_() != QMessageBox.Apply:
+            return
+        config = Config.from_dict(self.config.to_dict())
+        config.get(name).mount_args = suggested
+        try:
+            save_config(self.cfg_file, config)
+        except OSError as e:
+            show_warning("Error occurred saving configuration file.", str(e))
+            return
+        self.update_menu(config)
 
-        # TODO subprocess call rclone to mount
-        # Also need to make mount directory first if it does not exit
-        # Also, error if mount directory not empty
-        # store popen for later
-        user_args = str(self.data["items"][str(idx)]["mount_args"]).split()
-        args = []
-        args.append("systemd-inhibit")   # Mounted remotes cause some systems to lockup on sleep
-        args.append("rclone")
-        args.append("mount")
-        args.extend(user_args)
-        args.append("{}:/".format(name)),
-        args.append("{}".format(mountpoint))
-
-        print(" ".join(args))
-        p = subprocess.Popen(args)
-
-        # Show mount failed if process dies immediately (within 100ms)
-        start = time.time()
-        while time.time() - start < 0.1:
-            if p.poll() is not None:
-                res = p.poll()
-                dialog = QMessageBox()
-                dialog.setWindowTitle("RcloneDriveManager")
-                dialog.setText("Error occurred mounting the drive")
-                dialog.setDetailedText("Rclone exited with error code {}.".format(res))
-                dialog.setIcon(QMessageBox.Warning)
-                dialog.setStandardButtons(QMessageBox.Ok)
-                dialog.setDefaultButton(QMessageBox.Ok)
-                dialog.exec_()
-                return
-            time.sleep(0.01)
+    def update_log_menu(self):
+        self.log_menu.clear()
+        with self.engine.lock:
+            names = list(self.engine.logs)
+        for name in names:
+            act = self.log_menu.addAction(name)
+            act.triggered.connect(lambda checked=False, name=name: self.show_log(name))
+        if len(names) == 0:
+            self.log_menu.addAction("No output yet").setEnabled(False)
 
-        self.mounted_list[name] = (mountpoint, p)
+    def show_log(self, name: str):
+        dialog = QMessageBox()
+        dialog.setWindowTitle("RcloneDriveManager")
+        dialog.setText("Output of rclone for {}".format(name))
+        dialog.setDetailedText("\n".join(self.engine.log_tail(name)))
+        dialog.setIcon(QMessageBox.Information)
+        dialog.setStandardButtons(QMessageBox.Ok)
+        dialog.exec_()
 
-        act = self.act_for_name(name)
-        if act is not None:
-            act.setChecked(True)
-
-    def unmount(self, name: str, force: bool = False, noprompt: bool = False):
-        # Don't check this process in poll_mounted anymore
-        proc = self.mounted_list[name][1]
-        mountpoint = self.mounted_list[name][0]
-        del self.mounted_list[name]
-        
-        # If process is already dead, just remove checkmark
-        if proc.poll() is not None:
-            act = self.act_for_name(name)
-            if act is not None:
-                act.setChecked(False)
+    def with_log(self, name: str, detail: str) -> str:
+        lines = self.engine.log_tail(name, LOG_DIALOG_LINES)
+        if len(lines) == 0:
+            return detail
+        return "{}\n\nLast output of rclone:\n{}".format(detail, "\n".join(lines))
+
+    def engine_event(self, event: str, name: str, detail: str):
+        if event == "draining":
+            if name not in self.draining:
+                self.showMessage("Finishing uploads", "Waiting for uploads of {} before unmounting: {}".format(name, detail))
+            self.draining[name] = detail
+        else:
+            self.draining.pop(name, None)
+        self.update_action(name)
+        if event == "mount_failed":
+            show_warning("Error occurred mounting the drive", self.with_log(name, detail))
+        elif event == "unmount_failed" and not self.exiting:
+            show_warning("Unmount failed", self.with_log(name, detail))
+        elif event == "restarting":
+            self.showMessage("Restarting drive", "Drive {} is being restarted. {}".format(name, detail))
+        elif event == "restart_busy":
+            self.showMessage("Can't restart drive", "Drive {} is over its resource limits. {}".format(name, detail))
+        elif event == "crash_loop":
+            show_warning("Drive keeps failing", self.with_log(name, "Drive {}: {}".format(name, detail)))
+        elif event == "died" and detail != "0":
+            message = "Drive {} was unmounted unexpectedly.".format(name)
+            if detail != "":
+                message += " Rclone exited with code {}.".format(detail)
+            show_warning("Drive Unmounted Unexpectedly", self.with_log(name, message))
+
+    def toggle_mount(self):
+        act: QAction = self.sender()
+        name = act.data()
+        # Don't actually change checkmark until mounted / unmounted
+        self.update_action(name)
+        if self.engine.state(name) == "mounted":
+            self.unmount(name)
+        else:
+            self.mount(name)
+
+    def mount(self, name: str):
+        remote = self.config.get(name)
+        if remote is None:
+            show_warning("Error occurred mounting the drive", "No configuration with the name {} was found.".format(name))
             return
+        self.engine.mount(remote)
 
-        # Try clean unmount
-        # Try up to 3 times with 100ms delay between
-        for i in range(3):
-            res = subprocess.call(["umount", mountpoint])
-            if res == 0:
-                break
-            time.sleep(0.1)
-
-        # Force unmount by killing rclone if clean unmount failed
-        if res != 0:
-            if force:
-                proc.terminate()
-                start = time.time()
-                while (time.time() - start < 0.3) and (proc.poll() is None):
-                    time.sleep(0.01)
-                if proc.poll() is None:
-                    proc.kill()
-            else:
-                # Unmount failed. Add back to list
-                self.mounted_list[name] = (mountpoint, proc)
-                if not noprompt:
-                    dialog = QMessageBox()
-                    dialog.setWindowTitle("RcloneDriveManager")
-                    dialog.setText("Unmount failed")
-                    dialog.setDetailedText("Failed to cleanly unmount {}.".format(name))
-                    dialog.setIcon(QMessageBox.Warning)
-                    dialog.setStandardButtons(QMessageBox.Ok)
-                    dialog.setDefaultButton(QMessageBox.Ok)
-                    dialog.exec_()
-                return False
-        
-        # Remove mount dir when unmounted (only if empty to prevent accidental data loss)
-        try:
-            os.rmdir(mountpoint)
-        except:
-            traceback.print_exc()
+    def unmount(self, name: str, force: bool = False):
+        self.engine.unmount(name, force)
 
-        act = self.act_for_name(name)
-        if act is not None:
-            act.setChecked(False)
-        return True
-        
+    def mount_all(self):
+        self.engine.mount_many(list(self.config.remotes.values()))
 
+    def unmount_all(self):
+        self.engine.unmount_many(list(self.engine.mounted))
 
     def exit_app(self):
         dialog = QMessageBox()
@@ -303,24 +431,32 @@ class TrayIcon(QSystemTrayIcon):
         dialog.setDefaultButton(QMessageBox.No)
         res = dialog.exec_()
         if res == QMessageBox.Yes:
-            # Unmount all
-            self.poll_timer.stop()
-            for name, value in self.mounted_list.copy().items():
-                if not self.unmount(name, False, True):
-                    dialog = QMessageBox()
-                    dialog.setWindowTitle("RcloneDriveManager")
-                    dialog.setText("Failed to cleanly umount {}. Force unmount? If no is selected, the application will not exit.".format(name))
-                    dialog.setIcon(QMessageBox.Question)
-                    dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                    dialog.setDefaultButton(QMessageBox.No)
-                    res = dialog.exec_()
-                    if res != QMessageBox.Yes:
-                         # Exit was aborted. Restart poll timer
-                        self.poll_timer.start(5000)
-                        return
-                    # Force unmount
-                    self.unmount(name, True, True)
+            # Unmount all at once
+            self.exiting = True
+            self.startup.cancel()
+            self.watchdog.cancel()
+            timeout = self.config.setting("shutdown_timeout", DEFAULT_SHUTDOWN_TIMEOUT)
+            failed = self.engine.unmount_all(timeout)
+            if len(failed) != 0:
+                dialog = QMessageBox()
+                dialog.setWindowTitle("RcloneDriveManager")
+                dialog.setText("Failed to cleanly unmount {} drive(s). Force unmount all remaining? If no is selected, the application will not exit.".format(len(failed)))
+                dialog.setDetailedText("Failed to cleanly unmount:\n{}".format("\n".join(failed)))
+                dialog.setIcon(QMessageBox.Question)
+                dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+                dialog.setDefaultButton(QMessageBox.No)
+                res = dialog.exec_()
+                if res != QMessageBox.Yes:
+                    # Exit was aborted. Drives can be mounted (and restarted) again.
+                    self.exiting = False
+                    self.engine.abort_close()
+                    self.watchdog.resume()
+                    return
+                # Force unmount
+                self.engine.unmount_all(timeout, True)
+            self.engine.shutdown()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+            if self.control_server is not None:
+                self.control_server.stop()
             QApplication.instance().quit()
-            
-           
-
@@ -0,0 +1,101 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import format_size
+from rc import RcClient, RcError
+
+
+# Waits for a mount's pending uploads (--vfs-cache-mode writes / full) to
+# finish before it is unmounted. The upload queue is read with vfs/queue
+# (rclone 1.68+) and every queued file is made due now with
+# vfs/queue-set-expiry, skipping the --vfs-write-back delay. Older rclone
+# only has the file counts from vfs/stats.
+
+
+POLL_INTERVAL = 0.5
+RATE_SMOOTHING = 0.3
+
+
+def pending(rc: RcClient, params: Dict) -> Tuple[int, Optional[int], List[Dict]]:
+    # Returns (files, bytes or None if unknown, queue items)
+    try:
+        queue = rc.call("vfs/queue", timeout=2.0, **params).get("queue") or []
+        return len(queue), sum(item.get("size", 0) for item in queue), queue
+    except RcError:
+        cache = rc.call("vfs/stats", timeout=2.0, **params).get("diskCache", {})
+        return cache.get("uploadsQueued", 0) + cache.get("uploadsInProgress", 0), None, []
+
+
+def flush(rc: RcClient, params: Dict, queue: List[Dict]):
+    for item in queue:
+        if not item.get("uploading") and item.get("expiry", 0) > 0:
+            try:
+                rc.call("vfs/queue-set-expiry", timeout=2.0, id=item["id"], expiry=0.0, **params)
+            except (RcError, KeyError):
+                pass
+
+
+def describe(files: int, size: Optional[int], rate: Optional[float]) -> str:
+    text = "{} file{}".format(files, "" if files == 1 else "s")
+    if size is not None:
+        text += ", {} left".format(format_size(size))
+        if rate:
+            text += ", about {:.0f}s".format(size / rate)
+    return text
+
+
+def drain(rc: RcClient, params: Dict, deadline: float, progress: Callable[[str], None]) -> bool:
+    # Returns True once nothing is waiting to be uploaded, False at deadline.
+    # progress(text) is called whenever the amount left changes.
+    rate = None
+    last_time = last_size = shown = None
+    flushed = set()
+    while True:
+        files, size, queue = pending(rc, params)
+        now = time.monotonic()
+        if files == 0:
+            return True
+        new = [item for item in queue if item.get("id") not in flushed]
+        flush(rc, params, new)
+        flushed.update(item.get("id") for item in new)
+        if size is not None and last_size is not None and now > last_time:
+            current = max(0, last_size - size) / (now - last_time)
+            rate = current if rate is None else rate * (1 - RATE_SMOOTHING) + current * RATE_SMOOTHING
+        last_time, last_size = now, size
+        if (files, size) != shown:
+            shown = (files, size)
+            progress(describe(files, size, rate))
+        if now + POLL_INTERVAL > deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,158 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from config import Config
+from mountengine import Mount, MountEngine
+from rc import RcError
+
+
+# Prefetches directory listings of each remote's warm_paths (relative to the
+# remote root) down to warm_depth levels once it is mounted, so the first
+# browse of big folders is served from rclone's directory cache. Uses
+# vfs/refresh when the mount has an rc API and the whole tree is wanted
+# (warm_depth 0) or only the paths themselves (warm_depth 1). Otherwise the
+# mountpoint is walked by a few low priority threads. Stops when the drive
+# starts unmounting.
+
+
+WALK_THREADS = 4
+WALK_NICE = 10
+
+
+class WarmJob:
+    def __init__(self, mount: Mount, paths: List[str], depth: int) -> None:
+        self.mount = mount
+        self.paths = paths
+        self.depth = depth
+        self.cancelled = threading.Event()
+        self.dirs = 0
+
+
+class Warmer:
+    def __init__(self, engine: MountEngine, get_config: Callable[[], Config]) -> None:
+        self.engine = engine
+        self.get_config = get_config
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, WarmJob] = {}
+        self.pool = ThreadPoolExecutor(max_workers=WALK_THREADS, thread_name_prefix="warm",
+                                       initializer=self.lower_priority)
+        engine.add_listener(self.engine_event)
+
+    def lower_priority(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WALK_NICE)
+        except (AttributeError, OSError):
+            pass
+
+    def engine_event(self, event: str, name: str, detail: str):
+        if event == "mounted":
+            remote = self.get_config().get(name)
+            with self.engine.lock:
+                mount = self.engine.mounted.get(name)
+            if remote is None or mount is None or len(remote.warm_paths) == 0:
+                return
+            job = WarmJob(mount, [str(p) for p in remote.warm_paths], int(remote.warm_depth))
+            with self.lock:
+                old = self.jobs.get(name)
+                if old is not None:
+                    old.cancelled.set()
+                self.jobs[name] = job
+            threading.Thread(target=self.run, args=(job,), name="warm-{}".format(name), daemon=True).start()
+        elif event in ("unmounting", "died"):
+            with self.lock:
+                job = self.jobs.pop(name, None)
+            if job is not None:
+                job.cancelled.set()
+
+    def run(self, job: WarmJob):
+        self.lower_priority()
+        start = time.monotonic()
+        try:
+            if job.mount.rc is not None and job.depth in (0, 1) and self.refresh(job):
+                how = "vfs/refresh"
+            else:
+                self.walk(job)
+                how = "{} directories".format(job.dirs)
+        except:
+            traceback.print_exc()
+            return
+        finally:
+            with self.lock:
+                if self.jobs.get(job.mount.name) is job:
+                    del self.jobs[job.mount.name]
+        if not job.cancelled.is_set():
+            print("Warmed {} ({}) in {:.1f}s".format(job.mount.name, how, time.monotonic() - start))
+
+    def refresh(self, job: WarmJob) -> bool:
+        params = dict(job.mount.vfs_params())
+        for i, path in enumerate(job.paths):
+            params["dir" if i == 0 else "dir{}".format(i + 1)] = path.strip("/")
+        params["recursive"] = job.depth == 0
+        try:
+            job.mount.rc.call("vfs/refresh", timeout=600.0, **params)
+            return True
+        except RcError:
+            traceback.print_exc()
+            return False
+
+    def walk(self, job: WarmJob):
+        # Breadth first over at most WALK_THREADS directories at a time
+        results: "queue.Queue[Tuple[int, List[str]]]" = queue.Queue()
+        pending = 0
+        todo = [(os.path.join(job.mount.mountpoint, p.strip("/")), 1) for p in job.paths]
+        while (len(todo) != 0 or pending != 0) and not job.cancelled.is_set():
+            while len(todo) != 0 and pending < WALK_THREADS:
+                path, level = todo.pop(0)
+                self.pool.submit(self.list_dir, job, path, level, results)
+                pending += 1
+            level, subdirs = results.get()
+            pending -= 1
+            if job.depth == 0 or level < job.depth:
+                todo.extend((d, level + 1) for d in subdirs)
+
+    def list_dir(self, job: WarmJob, path: str, level: int, results: queue.Queue):
+        subdirs = []
+        if not job.cancelled.is_set():
+            try:
+                with os.scandir(path) as it:
+                    subdirs = [e.path for e in it if e.is_dir(follow_symlinks=False)]
+                job.dirs += 1
+            except OSError:
+                pass
+        results.put((level, subdirs))
@@ -0,0 +1,265 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from config import Config, RemoteConfig
+from metrics import MetricsCollector, Sample, format_size
+from mountengine import MountEngine
+from rc import parse_size
+
+
+# Per remote resource limits.
+#
+# Soft limits (max_rss, max_cpu in % of one core, max_fds) are checked
+# against the metrics samples, which read /proc of the rclone process tree.
+# A drive that stays over one of them for watchdog_grace seconds is cleanly
+# unmounted and mounted again. A drive with any limit whose rclone dies (eg
+# killed by a hard limit) is mounted again too. The remount waits
+# watchdog_backoff seconds, doubled for every restart within the last hour.
+# After watchdog_max_restarts restarts within an hour the drive is left
+# unmounted (crash loop).
+#
+# Hard limits are applied at spawn. hard_fds becomes RLIMIT_NOFILE (through
+# util-linux prlimit). hard_rss and hard_cpu become MemoryMax / CPUQuota of a
+# transient systemd scope, which needs cgroup v2 and a systemd user instance.
+# Limits don't apply to the rcd backend, where one process serves every drive.
+
+
+DEFAULT_GRACE = 30.0  # Seconds
+DEFAULT_BACKOFF = 5.0  # Seconds
+DEFAULT_MAX_RESTARTS = 5
+MAX_BACKOFF = 600.0
+CRASH_LOOP_WINDOW = 3600.0
+
+
+def size_limit(value) -> int:
+    # rclone style size ("2G") or bytes
+    if isinstance(value, str):
+        return parse_size(value) if value != "" else 0
+    return int(value or 0)
+
+
+def has_limits(remote: RemoteConfig) -> bool:
+    return any((remote.max_rss, remote.max_cpu, remote.max_fds, remote.hard_rss, remote.hard_cpu, remote.hard_fds))
+
+
+def over_limits(remote: RemoteConfig, sample: Sample) -> List[str]:
+    reasons = []
+    max_rss = size_limit(remote.max_rss)
+    if max_rss > 0 and sample.rss is not None and sample.rss > max_rss:
+        reasons.append("{} RSS over {}".format(format_size(sample.rss), format_size(max_rss)))
+    if remote.max_cpu > 0 and sample.cpu_percent is not None and sample.cpu_percent > remote.max_cpu:
+        reasons.append("{:.0f}% CPU over {}%".format(sample.cpu_percent, remote.max_cpu))
+    if remote.max_fds > 0 and sample.fds is not None and sample.fds > remote.max_fds:
+        reasons.append("{} open files over {}".format(sample.fds, remote.max_fds))
+    return reasons
+
+
+def scopes_available() -> bool:
+    # systemd-run --user --scope needs cgroup v2 and the user manager's socket
+    if shutil.which("systemd-run") is None or not os.path.exists("/sys/fs/cgroup/cgroup.controllers"):
+        return False
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+    return runtime_dir != "" and os.path.exists(os.path.join(runtime_dir, "systemd", "private"))
+
+
+class Watchdog:
+    def __init__(self, engine: MountEngine, collector: MetricsCollector, get_config: Callable[[], Config]) -> None:
+        self.engine = engine
+        self.get_config = get_config
+        self.cond = threading.Condition()
+        self.cancelled = False
+        self.over_since: Dict[str, float] = {}
+        self.restarting: Dict[str, str] = {}  # name: reason, while unmounting for a restart
+        self.pending: Dict[str, float] = {}  # name: time to mount again
+        self.remounting: Set[str] = set()
+        self.history: Dict[str, Deque[float]] = {}  # name: times of recent restarts
+        self.blocked: Set[str] = set()  # Over a limit but busy. Reported once.
+        self.scopes: Optional[bool] = None
+        engine.add_listener(self.engine_event)
+        engine.add_command_prefix(self.command_prefix)
+        collector.add_listener(self.samples)
+        self.thread = threading.Thread(target=self.run, name="watchdog", daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        # Stop restarting drives (eg when quitting)
+        with self.cond:
+            self.cancelled = True
+            self.pending.clear()
+            self.cond.notify()
+
+    def resume(self):
+        # Undo cancel (quitting was aborted)
+        with self.cond:
+            self.cancelled = False
+
+    def command_prefix(self, remote: RemoteConfig) -> List[str]:
+        prefix = []
+        hard_rss = size_limit(remote.hard_rss)
+        if hard_rss > 0 or remote.hard_cpu > 0:
+            if self.scopes is None:
+                self.scopes = scopes_available()
+            if self.scopes:
+                prefix.extend(["systemd-run", "--user", "--scope", "--quiet", "--collect"])
+                if hard_rss > 0:
+                    prefix.append("--property=MemoryMax={}".format(hard_rss))
+                if remote.hard_cpu > 0:
+                    prefix.append("--property=CPUQuota={}%".format(remote.hard_cpu))
+            else:
+                print("Ignoring hard memory / CPU limits of {} (needs cgroup v2 and systemd-run --user)".format(
+                    remote.remote_name))
+        if remote.hard_fds > 0:
+            if shutil.which("prlimit") is not None:
+                prefix.extend(["prlimit", "--nofile={}".format(int(remote.hard_fds))])
+            else:
+                print("Ignoring hard_fds of {} (prlimit not found)".format(remote.remote_name))
+        return prefix
+
+    def samples(self, samples: Dict[str, Sample]):
+        # Runs on the metrics thread
+        config = self.get_config()
+        grace = float(config.setting("watchdog_grace", DEFAULT_GRACE))
+        now = time.monotonic()
+        with self.engine.lock:
+            names = [mount.name for mount in self.engine.mounted.values() if mount.rcd is None]
+        restart = []
+        with self.cond:
+            for name in list(self.over_since):
+                if name not in names:
+                    del self.over_since[name]
+            for name in names:
+                remote = config.get(name)
+                sample = samples.get(name)
+                reasons = over_limits(remote, sample) if remote is not None and sample is not None else []
+                if len(reasons) == 0:
+                    self.over_since.pop(name, None)
+                    self.blocked.discard(name)
+                elif now - self.over_since.setdefault(name, now) >= grace:
+                    del self.over_since[name]
+                    restart.append((name, ", ".join(reasons)))
+        for name, reason in restart:
+            self.restart(name, reason)
+
+    def restart(self, name: str, reason: str):
+        print("Restarting {}: {}".format(name, reason))
+        with self.cond:
+            self.restarting[name] = reason
+        future = self.engine.unmount_quietly(name)
+        if future is None:
+            with self.cond:
+                self.restarting.pop(name, None)
+            return
+        future.add_done_callback(lambda f: self.unmount_done(name, reason, f))
+
+    def unmount_done(self, name: str, reason: str, future):
+        if not future.cancelled() and future.exception() is None and future.result():
+            return
+        # Busy. Tried again if still over the limit after another grace period.
+        with self.cond:
+            self.restarting.pop(name, None)
+            if name in self.blocked:
+                return
+            self.blocked.add(name)
+        print("Could not restart {}, it is busy".format(name))
+        self.engine.emit("restart_busy", name, "{}. It is busy, restarting once it can be unmounted.".format(reason))
+
+    def engine_event(self, event: str, name: str, detail: str):
+        if event in ("unmounted", "died"):
+            with self.cond:
+                reason = self.restarting.pop(name, None)
+                self.blocked.discard(name)
+            if reason is None and event == "died" and detail != "0":
+                remote = self.get_config().get(name)
+                if remote is not None and has_limits(remote):
+                    reason = "Rclone exited" + (" with code {}".format(detail) if detail != "" else "")
+            if reason is not None:
+                self.schedule(name, reason)
+        elif event == "mounting":
+            with self.cond:
+                self.pending.pop(name, None)
+        elif event == "mounted":
+            with self.cond:
+                self.remounting.discard(name)
+        elif event == "mount_failed":
+            with self.cond:
+                if name not in self.remounting:
+                    return
+                self.remounting.discard(name)
+            self.schedule(name, "Mounting again failed")
+
+    def schedule(self, name: str, reason: str):
+        config = self.get_config()
+        backoff = float(config.setting("watchdog_backoff", DEFAULT_BACKOFF))
+        max_restarts = int(config.setting("watchdog_max_restarts", DEFAULT_MAX_RESTARTS))
+        now = time.monotonic()
+        delay = None
+        with self.cond:
+            if self.cancelled:
+                return
+            history = self.history.setdefault(name, deque())
+            while len(history) != 0 and now - history[0] > CRASH_LOOP_WINDOW:
+                history.popleft()
+            if len(history) < max_restarts:
+                delay = min(MAX_BACKOFF, backoff * 2 ** len(history))
+                history.append(now)
+                self.pending[name] = now + delay
+                self.cond.notify()
+        if delay is None:
+            print("Not restarting {} again: {} restarts within an hour".format(name, max_restarts))
+            self.engine.emit("crash_loop", name, "{}. Restarted {} times within an hour, leaving it unmounted.".format(
+                reason, max_restarts))
+        else:
+            self.engine.emit("restarting", name, "{}. Mounting again in {:g}s.".format(reason, delay))
+
+    def run(self):
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                due = [name for name, when in self.pending.items() if when <= now]
+                if len(due) == 0:
+                    self.cond.wait(min(self.pending.values()) - now if len(self.pending) != 0 else None)
+                    continue
+                for name in due:
+                    del self.pending[name]
+                    self.remounting.add(name)
+            config = self.get_config()
+            for name in due:
+                remote = config.get(name)
+                if remote is None or self.engine.mount(remote) is None:
+                    with self.cond:
+                        self.remounting.discard(name)
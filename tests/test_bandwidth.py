@@ -0,0 +1,84 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bandwidth import current_limit, format_rate, parse_limit
+
+
+# Which limit of the "bandwidth" setting applies at a given time.
+
+
+BANDWIDTH = {
+    "limit": "10M:2M",
+    "schedule": [
+        {"start": "08:00", "end": "18:00", "days": ["mon", "tue", "wed", "thu", "fri"], "limit": "1M"},
+        {"start": "22:00", "end": "06:00", "days": ["fri"], "limit": "off"},
+    ],
+}
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime.datetime:
+    # 2024-01-01 was a monday
+    return datetime.datetime(2024, 1, day, hour, minute)
+
+
+def test_parse_limit():
+    assert parse_limit("10M:2M") == (10 << 20, 2 << 20)
+    assert parse_limit("1M") == (1 << 20, 1 << 20)
+    assert parse_limit("off") == (None, None)
+    assert parse_limit("off:512k") == (None, 512 << 10)
+    assert format_rate((None, 1024)) == "off:1024B"
+
+
+def test_daytime_schedule():
+    assert current_limit(BANDWIDTH, at(1, 8)) == (1 << 20, 1 << 20)
+    assert current_limit(BANDWIDTH, at(1, 17, 59)) == (1 << 20, 1 << 20)
+    assert current_limit(BANDWIDTH, at(1, 18)) == (10 << 20, 2 << 20)
+    assert current_limit(BANDWIDTH, at(6, 12)) == (10 << 20, 2 << 20)  # Saturday
+
+
+def test_schedule_across_midnight():
+    # Friday 22:00 until Saturday 06:00
+    assert current_limit(BANDWIDTH, at(5, 21, 59)) == (10 << 20, 2 << 20)
+    assert current_limit(BANDWIDTH, at(5, 22)) == (None, None)
+    assert current_limit(BANDWIDTH, at(5, 23, 59)) == (None, None)
+    assert current_limit(BANDWIDTH, at(6, 0)) == (None, None)
+    assert current_limit(BANDWIDTH, at(6, 5, 59)) == (None, None)
+    assert current_limit(BANDWIDTH, at(6, 6)) == (10 << 20, 2 << 20)
+    # Not the night after thursday, nor sunday morning after saturday
+    assert current_limit(BANDWIDTH, at(5, 3)) == (10 << 20, 2 << 20)
+    assert current_limit(BANDWIDTH, at(7, 3)) == (10 << 20, 2 << 20)
@@ -0,0 +1,99 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import Config, RemoteConfig, load_config, save_config
+
+
+# save_config only writes when the settings changed, and replaces the file
+# atomically.
+
+
+def make_config() -> Config:
+    config = Config(settings={"backend": "rcd"})
+    config.add(RemoteConfig("a", "~/a", "--vfs-cache-mode full"))
+    return config
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "config.json")
+    assert save_config(path, make_config())
+    assert load_config(path) == make_config()
+
+
+def test_unchanged_is_not_written(tmp_path):
+    path = str(tmp_path / "config.json")
+    # Hand edited formatting of the same settings
+    with open(path, "w") as f:
+        json.dump(make_config().to_dict(), f, indent=4)
+    mtime = os.stat(path).st_mtime_ns
+    assert not save_config(path, make_config())
+    assert os.stat(path).st_mtime_ns == mtime
+
+    config = make_config()
+    config.get("a").mount_args = "--vfs-cache-mode writes"
+    assert save_config(path, config)
+    assert load_config(path) == config
+
+
+def test_unreadable_is_replaced(tmp_path):
+    path = str(tmp_path / "config.json")
+    with open(path, "w") as f:
+        f.write("{\"count\": ")
+    assert save_config(path, make_config())
+    assert load_config(path) == make_config()
+
+
+def test_failed_write_keeps_old_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "config.json")
+    save_config(path, make_config())
+    with open(path) as f:
+        old = f.read()
+
+    def fail(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, "replace", fail)
+    config = make_config()
+    config.settings["backend"] = "process"
+    with pytest.raises(OSError):
+        save_config(path, config)
+    with open(path) as f:
+        assert f.read() == old
+    # The temp file was removed
+    assert os.listdir(str(tmp_path)) == ["config.json"]
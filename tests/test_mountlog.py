@@ -0,0 +1,118 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from mountlog import MAX_LINE, LogReader, MountLog
+
+
+# Bounded in-memory tail of rclone's output, and tailing / rotation of the log
+# file rclone writes to.
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_keeps_last_lines():
+    log = MountLog("a", max_lines=3)
+    log.feed(b"one\ntwo\nthr")
+    log.feed(b"ee\r\nfour\nfi")
+    assert log.tail() == ["two", "three", "four", "fi"]
+    assert log.tail(2) == ["four", "fi"]
+    log.close()
+    assert log.tail() == ["three", "four", "fi"]
+    assert log.closed.is_set()
+
+
+def test_long_lines_are_cut():
+    log = MountLog("a")
+    log.feed(b"x" * (MAX_LINE + 10))
+    log.feed(b"y" * 10 + b"\nnext\n")
+    assert log.tail() == ["x" * MAX_LINE, "next"]
+    log.feed("é\n".encode() + b"\xff\n")
+    assert log.tail(2) == ["é", "�"]
+
+
+def test_tail_file(tmp_path):
+    path = str(tmp_path / "logs" / "a.log")
+    log = MountLog("a", path=path)
+    out, offset = log.open_output()
+    reader = LogReader()
+    with out:
+        out.write(b"old\n")
+        out.flush()
+        # Only output after offset belongs to this run
+        reader.attach(log, offset + 4)
+        out.write(b"started\n")
+        out.flush()
+        assert wait_for(lambda: log.tail() == ["started"])
+        out.write(b"done")
+        out.flush()
+    reader.detach(log)
+    assert log.closed.wait(5)
+    assert log.tail() == ["started", "done"]
+
+
+def test_rotation(tmp_path):
+    path = str(tmp_path / "a.log")
+    log = MountLog("a", max_lines=1000, path=path, max_bytes=1024)
+    out, offset = log.open_output()
+    reader = LogReader()
+    reader.attach(log, offset)
+    lines = [("line {} ".format(i) + "x" * 50).encode() + b"\n" for i in range(100)]
+    with out:
+        for line in lines:
+            out.write(line)
+            out.flush()
+            time.sleep(0.001)
+        assert wait_for(lambda: len(log.tail()) == 100)
+    reader.detach(log)
+    assert log.closed.wait(5)
+    # Appending continues at the start of the truncated file. Nothing is lost.
+    with open(path + ".1", "rb") as f:
+        rotated = f.read()
+    with open(path, "rb") as f:
+        current = f.read()
+    assert len(rotated) >= 1024
+    assert len(current) < 1024 + len(lines[0])
+    assert b"".join(lines).endswith(rotated + current)
+    assert log.tail() == [line.decode().rstrip("\n") for line in lines]
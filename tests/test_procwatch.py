@@ -0,0 +1,101 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from procwatch import ProcessWatcher
+
+
+# Exit detection latency of ProcessWatcher with a fake rclone that exits
+# after a delay. Both the pidfd path and the wait() thread fallback are
+# covered.
+
+
+EXIT_DELAY = 0.3
+MAX_LATENCY = 0.1
+
+
+def fake_rclone(tmp_path) -> str:
+    path = str(tmp_path / "rclone")
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\nsleep {}\nexit 3\n".format(EXIT_DELAY))
+    os.chmod(path, 0o755)
+    return path
+
+
+def watch_exit(watcher: ProcessWatcher, path: str):
+    exited = threading.Event()
+    result = {}
+
+    def callback(proc):
+        result["time"] = time.monotonic()
+        result["returncode"] = proc.returncode
+        exited.set()
+
+    start = time.monotonic()
+    proc = subprocess.Popen([path, "mount", "remote:/", "/mnt"])
+    watcher.watch(proc, callback)
+    assert exited.wait(5), "exit was not detected"
+    return result["time"] - start, result["returncode"]
+
+
+def test_exit_latency(tmp_path):
+    elapsed, returncode = watch_exit(ProcessWatcher(), fake_rclone(tmp_path))
+    assert returncode == 3
+    assert EXIT_DELAY <= elapsed < EXIT_DELAY + MAX_LATENCY
+
+
+def test_exit_latency_without_pidfd(tmp_path, monkeypatch):
+    def no_pidfd(pid):
+        raise OSError("pidfd_open not supported")
+    monkeypatch.setattr(os, "pidfd_open", no_pidfd, raising=False)
+    elapsed, returncode = watch_exit(ProcessWatcher(), fake_rclone(tmp_path))
+    assert returncode == 3
+    assert EXIT_DELAY <= elapsed < EXIT_DELAY + MAX_LATENCY
+
+
+def test_watch_several(tmp_path):
+    watcher = ProcessWatcher()
+    path = fake_rclone(tmp_path)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(watch_exit(watcher, path))) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 3
+    assert all(EXIT_DELAY <= elapsed < EXIT_DELAY + MAX_LATENCY for elapsed, returncode in results)
@@ -0,0 +1,83 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from rc import mount_opts, parse_duration, parse_size
+
+
+# Translation of mount_args into the vfsOpt / mountOpt of rc mount/mount.
+
+
+def test_parse_duration():
+    assert parse_duration("10s") == 10 * 10**9
+    assert parse_duration("1m30s") == 90 * 10**9
+    assert parse_duration("1h0m0s") == 3600 * 10**9
+    assert parse_duration("1.5ms") == 1500000
+    assert parse_duration("2d") == 2 * 86400 * 10**9
+    for text in ("", "10", "10x", "s", "1m 30s"):
+        with pytest.raises(ValueError):
+            parse_duration(text)
+
+
+def test_parse_size():
+    assert parse_size("512") == 512 * 1024  # KiB like rclone
+    assert parse_size("10b") == 10
+    assert parse_size("128M") == 128 << 20
+    assert parse_size("1.5G") == 3 << 29
+    assert parse_size("2GiB") == 2 << 30
+    assert parse_size("1t") == 1 << 40
+    for text in ("", "M", "10x", "-1M"):
+        with pytest.raises(ValueError):
+            parse_size(text)
+
+
+def test_mount_opts():
+    vfs_opt, mount_opt = mount_opts("--vfs-cache-mode full --dir-cache-time=1m0s --vfs-cache-max-size 10G\n"
+                                    "--allow-other --read-only --volname drive")
+    assert vfs_opt == {"CacheMode": 3, "DirCacheTime": 60 * 10**9, "CacheMaxSize": 10 << 30, "ReadOnly": True}
+    assert mount_opt == {"AllowOther": True, "VolumeName": "drive"}
+    assert mount_opts("") == ({}, {})
+
+
+def test_mount_opts_errors():
+    with pytest.raises(ValueError, match="--config --transfers"):
+        mount_opts("--config /tmp/rclone.conf --vfs-cache-mode full --transfers 4")
+    with pytest.raises(ValueError, match="Missing value"):
+        mount_opts("--vfs-cache-mode")
+    with pytest.raises(ValueError, match="cache mode"):
+        mount_opts("--vfs-cache-mode everything")
@@ -0,0 +1,145 @@
+# BSD 3-Clause License
+
+# Copyright (c) 2022, Marcus Behel
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import Config
+from mountengine import MountEngine
+from rc import RcClient
+from rcstub import RcStub
+import uploads
+
+
+# The rcd backend against RcStub (an external rcd, so no rclone is needed):
+# mounting, listing, unmounting, adopting mounts left by a previous run and
+# draining pending uploads before unmounting.
+
+
+def make_config(tmp_path, stub: RcStub, names) -> Config:
+    items = {str(i): {"remote_name": name, "mount_point": str(tmp_path / name), "mount_args": "--vfs-cache-mode full"}
+             for i, name in enumerate(names)}
+    return Config.from_dict({"backend": "rcd", "rcd_url": stub.url, "log_dir": str(tmp_path / "logs"),
+                             "count": len(items), "items": items})
+
+
+def calls(stub: RcStub, method: str):
+    return [params for m, params in stub.calls if m == method]
+
+
+def make_engine(config: Config):
+    engine = MountEngine()
+    engine.apply_config(config)
+    events = []
+    engine.add_listener(lambda event, name, detail: events.append((event, name)))
+    return engine, events
+
+
+def test_mount_and_unmount(tmp_path):
+    stub = RcStub()
+    stub.start()
+    try:
+        config = make_config(tmp_path, stub, ["a", "b"])
+        engine, events = make_engine(config)
+        assert all(f.result(5) for f in engine.mount_many(list(config.remotes.values())))
+        assert sorted(engine.mounted) == ["a", "b"]
+        listed = {m["Fs"]: m["MountPoint"] for m in engine.rcd.listmounts()}
+        assert listed == {"a": str(tmp_path / "a"), "b": str(tmp_path / "b")}
+        assert calls(stub, "mount/mount")[0]["vfsOpt"] == {"CacheMode": 3}
+
+        assert engine.unmount("a").result(5)
+        assert list(engine.mounted) == ["b"]
+        assert [m["Fs"] for m in engine.rcd.listmounts()] == ["b"]
+        assert events[:2] == [("mounting", "a"), ("mounting", "b")]
+        assert events[-2:] == [("unmounting", "a"), ("unmounted", "a")]
+        engine.shutdown()
+    finally:
+        stub.stop()
+
+
+def test_adopt_mounts_of_previous_run(tmp_path):
+    stub = RcStub()
+    stub.start()
+    try:
+        config = make_config(tmp_path, stub, ["a", "b"])
+        first, _ = make_engine(config)
+        assert first.mount(config.get("a")).result(5)
+        first.shutdown()
+
+        # The app restarted. The rcd still serves "a".
+        engine, events = make_engine(config)
+        assert all(f.result(5) for f in engine.adopt_running(config))
+        assert list(engine.mounted) == ["a"]
+        assert len(calls(stub, "mount/mount")) == 1
+        assert engine.unmount("a").result(5)
+        assert engine.rcd.listmounts() == []
+        engine.shutdown()
+    finally:
+        stub.stop()
+
+
+def test_drain_uploads(tmp_path):
+    stub = RcStub()
+    stub.start()
+    try:
+        client = RcClient(stub.url)
+        client.call("mount/mount", fs="a:/", mountPoint=str(tmp_path / "a"))
+        stub.add_upload("a", "x", 200 * 1024, delay=60.0)
+        stub.add_upload("a", "y", 100 * 1024, delay=60.0)
+        progress = []
+        assert uploads.drain(client, {"fs": "a:/"}, time.monotonic() + 5.0, progress.append)
+        # Both were made due now instead of waiting for the write back delay
+        assert [c["id"] for c in calls(stub, "vfs/queue-set-expiry")] == [1, 2]
+        assert progress[0].startswith("2 files")
+        assert uploads.pending(client, {"fs": "a:/"})[0] == 0
+    finally:
+        stub.stop()
+
+
+def test_unmount_waits_for_uploads(tmp_path):
+    stub = RcStub()
+    stub.start()
+    try:
+        config = make_config(tmp_path, stub, ["a"])
+        engine, events = make_engine(config)
+        assert engine.mount(config.get("a")).result(5)
+        stub.add_upload("a", "x", 100 * 1024, delay=60.0)
+        assert engine.unmount("a").result(5)
+        assert ("draining", "a") in events
+        assert stub.uploads["a"] == []
+        engine.shutdown()
+    finally:
+        stub.stop()